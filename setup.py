@@ -13,6 +13,10 @@ qcviz_requires=[
     'matplotlib',
     ]
 
+watch_requires=[
+    'pyinotify',
+    ]
+
 tests_requires= [
     'nose',
     ]
@@ -36,16 +40,21 @@ setup(name='qccodar',
       packages=find_packages('src'),
       package_dir={'': 'src'},
       include_package_data=True,
+      package_data={'qccodar': ['benchmark_baseline.json']},
       zip_safe=False,
       namespace_packages=["qccodar", "qccodar.qcviz", "qccodar.test"],
       install_requires=install_requires,
       extras_require={
         'tests' : tests_requires,
-        'qcviz' : qcviz_requires
+        'qcviz' : qcviz_requires,
+        'watch' : watch_requires
         },
       test_suite="qccodar.test",
       entry_points="""
         [console_scripts]
         qccodar = qccodar.app:main
+        qccodar-benchmark = qccodar.benchmark:main
+        qccodar-synthetic = qccodar.synthetic:main
+        qccodar-equivalence = qccodar.equivalence:main
       """
       )
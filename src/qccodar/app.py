@@ -1,12 +1,27 @@
 """Quality control CODAR (qccodar) RadialMetric data. 
 
 Usage:
-  qccodar (auto | catchup | manual) [options]
+  qccodar (auto | catchup | manual | update | shard) [options]
+  qccodar batch --config FILE [options]
   qccodar --help | --version
 
 Options:
   -d DIR --datadir DIR      Data directory to process [default: /Codar/SeaSonde/Data]
   -p PAT --pattern PAT      Pattern type [default: IdealPattern]
+  -e EXEC --executor EXEC   Manual-mode executor (serial | pipeline | taskgraph | stream) [default: serial]
+  --resume                  Manual-mode skips output already made from current inputs
+  -c FILE --config FILE     Batch-mode config file listing datadir and patterns of each site
+  -w NUM --workers NUM      Number of batch-mode worker processes or taskgraph threads [default: 2]
+  --max-memory MB           Stream-executor ceiling for parsed files held in memory [default: 256]
+  --chunk-files NUM         Shard-mode number of RadialMetric files per chunk [default: 48]
+  -t NUM --threads NUM      Threads for averaging the range cells of each file [default: 1]
+  --metrics FILE            Append per-stage timings and counts as JSON lines to FILE (- for stdout)
+  --textfile FILE           Keep Prometheus metrics in FILE for node_exporter's textfile collector
+  --profile                 Profile the qc of each file and the merges, report in DATADIR/.qccodar/PATTERN
+  --profile-rate FRAC       Share of files (and merges) profiled [default: 1.0]
+  --profile-top NUM         Number of functions in the profile report [default: 30]
+  --memory                  Track peak memory (RSS) of each file and step, report in DATADIR/.qccodar/PATTERN
+  --backlog-share FRAC      Catchup-mode share of CPU for the backlog behind the newest files [default: 0.5]
   -h --help                 Show this help message and exit
   --version                 Show version
   
@@ -15,29 +30,149 @@ Options:
 import os
 import re
 import glob
-
-from pkg_resources import get_distribution
+import fnmatch
 
 import time
 
-from .qcutils import do_qc, recursive_glob
-from .codarutils import run_LLUVMerger, get_radialmetric_foldername
-
-__version__ = get_distribution("qccodar").version
+# qcutils and codarutils (numpy, geopy) are imported when there is qc
+# or merging to do, so a cron run of auto that finds nothing new
+# starts quickly
+from .catalog import build_catalog, lluvtype_for, output_filename, get_radialmetric_foldername
+from .manifest import Manifest, merge_sources, merge_output, statedir
+from .locks import output_lock, pid_alive, makedirs
+from .archive import is_archive, archive_outdir, ArchiveSource
 
 debug = 1
 
-def manual(datadir, pattern):
-    """ Manual mode runs qc and merge on all files in datadir """
-
-    rmfoldername = get_radialmetric_foldername(datadir)
-    # get file listing of datadir
-    fns = recursive_glob(os.path.join(datadir, rmfoldername, pattern), 'RDL*.ruv')
+def get_version():
+    """ Version of the installed qccodar distribution """
+    try:
+        from importlib.metadata import version
+    except ImportError:
+        try:
+            from importlib_metadata import version
+        except ImportError:
+            from pkg_resources import get_distribution
+            return get_distribution("qccodar").version
+    return version("qccodar")
+
+def do_qc(datadir, fn, pattern, **kwargs):
+    """ qcutils.do_qc(), imported on first use """
+    from .qcutils import do_qc
+    return do_qc(datadir, fn, pattern, **kwargs)
+
+def run_LLUVMerger(datadir, fn, pattern):
+    """ codarutils.run_LLUVMerger(), imported on first use """
+    from .codarutils import run_LLUVMerger
+    return run_LLUVMerger(datadir, fn, pattern)
+
+def qc_window(catalog, fullfn, pattern):
+    """ RadialMetric files that the qc of fullfn depends on """
+    from .qcutils import find_files_to_merge, qc_params
+    return find_files_to_merge(fullfn, qc_params['numfiles'], qc_params['sample_interval'],
+                               catalog=catalog, patterntype=pattern)
+
+def merge_files(catalog, pattern):
+    """ RadialShorts_qcd files that are merge sources for LLUVMerger """
+    # depending on system and desired time span for merge, change the target time for file search
+    return [fn for fn in catalog.paths(lluvtype_for('RadialShorts', pattern), pattern) \
+            if fnmatch.fnmatch(os.path.basename(fn), 'RDL*00.ruv')]
+
+def manual(datadir, pattern, executor='serial', resume=False, workers=2, max_memory=256):
+    """ Manual mode runs qc and merge on all files in datadir 
+
+    datadir may also be a tar or zip archive of RadialMetric files,
+    output then goes to the directory named after the archive (see
+    qccodar.archive).
+
+    With executor 'serial' each file is read, qc'd and written in
+    turn and then all merges are run.  With 'pipeline' reading, qc,
+    writing and merging overlap (see qccodar.pipeline).  With
+    'taskgraph' each read, qc and merge is a task run once on workers
+    threads when the tasks it depends on are done (see
+    qccodar.taskgraph).  With 'stream' only the parsed files of a
+    sliding window are held, reading ahead while under max_memory MB
+    (see qccodar.stream).
+
+    With resume, qc and merge outputs that are complete and were made
+    from the current inputs and settings (as recorded in the manifest
+    and its journal) are skipped, so an interrupted run carries on
+    where it stopped.
+    """
+
+    from .qcutils import qc_params
+    from .codarutils import merge_params
+
+    source = None
+    if is_archive(datadir):
+        # RadialMetric members of a tar or zip archive, output next to it
+        source = ArchiveSource(datadir)
+        indir, datadir = datadir, archive_outdir(datadir)
+        for folder in ['RadialShorts_qcd', 'Radials_qcd']:
+            makedirs(os.path.join(datadir, folder, pattern))
+        catalog = build_catalog(datadir, pattern, kinds=('RadialShorts', 'Radials'))
+        catalog.add_files(source.paths(pattern), pattern)
+    else:
+        rmfoldername = get_radialmetric_foldername(datadir)
+        indir = os.path.join(datadir, rmfoldername, pattern)
+        # catalogue of RadialMetric, RadialShorts_qcd and Radials_qcd files in datadir
+        catalog = build_catalog(datadir, pattern)
+    manifest = Manifest(datadir, pattern)
+    manifest.source = source
+    fns = catalog.paths(lluvtype_for('RadialMetric', pattern), pattern)
 
     # handle if no files to process
     if not fns:
         print "Warn: qccodar manual --datadir %s --pattern %s" % (datadir, pattern)
-        print "No files RDL*.ruv found in %s" % fulldatadir
+        print "No files RDL*.ruv found in %s" % indir
+        return
+
+    def merge_is_stale(rsfn):
+        sources = merge_sources(catalog, rsfn, pattern, merge_params)
+        mfn = merge_output(datadir, rsfn, pattern, merge_params)
+        return manifest.is_stale(mfn, sources, merge_params)
+
+    if resume:
+        remove_partial_outputs(datadir, pattern)
+        nfns = len(fns)
+        fns = [fn for fn in fns \
+               if manifest.is_stale(output_filename(datadir, fn, pattern, 'RadialShorts'),
+                                    qc_window(catalog, fn, pattern), qc_params)]
+        print 'qccodar (manual) -- resume: %d of %d files left to qc' % (len(fns), nfns)
+
+    if executor == 'pipeline':
+        from .pipeline import run_pipeline
+        print 'qccodar (manual) -- qc and merge pipeline ...'
+        skip_merge = (lambda rsfn: not merge_is_stale(rsfn)) if resume else None
+        try:
+            run_pipeline(datadir, pattern, catalog, fns, manifest=manifest, skip_merge=skip_merge,
+                         source=source)
+        finally:
+            manifest.save()
+        return
+    elif executor == 'taskgraph':
+        from .taskgraph import run_taskgraph
+        print 'qccodar (manual) -- qc and merge task graph ...'
+        skip_merge = (lambda rsfn: not merge_is_stale(rsfn)) if resume else None
+        try:
+            run_taskgraph(datadir, pattern, catalog, fns, manifest=manifest, workers=workers,
+                          skip_merge=skip_merge, source=source)
+        finally:
+            manifest.save()
+        return
+    elif executor == 'stream':
+        from .stream import run_stream
+        print 'qccodar (manual) -- qc and merge stream ...'
+        skip_merge = (lambda rsfn: not merge_is_stale(rsfn)) if resume else None
+        try:
+            run_stream(datadir, pattern, catalog, fns, manifest=manifest, max_memory=max_memory,
+                       skip_merge=skip_merge, source=source)
+        finally:
+            manifest.save()
+        return
+    elif executor != 'serial':
+        print "Error: qccodar manual --executor %s" % executor
+        print "Unknown executor, expecting serial, pipeline, taskgraph or stream"
         return
 
     print 'qccodar (manual) -- qc step ...'
@@ -46,124 +181,257 @@ def manual(datadir, pattern):
     for fullfn in fns:
         print '... input: %s' % fullfn
         fn = os.path.basename(fullfn)
-        ofn = do_qc(datadir, fn, pattern)
+        ofn = do_qc(datadir, fn, pattern, catalog=catalog, source=source, manifest=manifest)
         print '... output: %s' % ofn
 
     # get file list of RadialShorts
-    # depending on system and desired time span for merge, change the target time for file search
-    fns = recursive_glob(os.path.join(datadir, 'RadialShorts_qcd', pattern), 'RDL*00.ruv')
+    fns = merge_files(catalog, pattern)
 
     print 'qccodar (manual) -- merge step: ...'
 
     # run LLUVMerger for each
     for fullfn in fns:
+        if resume and not merge_is_stale(fullfn):
+            continue
         print '... input: %s' % fullfn
         fn = os.path.basename(fullfn)
         ofn = run_LLUVMerger(datadir, fn, pattern)
         print '... output: %s' % ofn
-
-def auto(datadir, pattern, fullfn):
-    """ Auto mode runs qc and merge for each fullfn """
+        if ofn:
+            manifest.record(ofn, merge_sources(catalog, fullfn, pattern, merge_params), \
+                            merge_params, 'Radials')
+    manifest.save()
+
+def remove_partial_outputs(datadir, pattern):
+    """ Remove temporary files left by write_output() of an interrupted run """
+    from .qcutils import recursive_glob
+    outdir = os.path.join(datadir, 'RadialShorts_qcd', pattern)
+    for fn in recursive_glob(outdir, 'RDL*.ruv.part*'):
+        # leave the output another run on this host is still writing
+        pid = fn.rsplit('.part', 1)[1]
+        if pid.isdigit() and int(pid) != os.getpid() and pid_alive(int(pid)):
+            continue
+        os.remove(fn)
+
+def update(datadir, pattern):
+    """ Update mode redoes only qc and merge outputs that are out of date
+
+    An output is redone if it is missing, if any file it depends on
+    (its 3- or 5-file RadialMetric window, or the RadialShorts_qcd
+    files merged by LLUVMerger) has changed or newly arrived, or if
+    qc_params or merge_params changed since it was made.
+    """
+    manual(datadir, pattern, resume=True)
+
+def auto(datadir, pattern, fullfn, catalog=None, manifest=None):
+    """ Auto mode runs qc and merge for each fullfn 
+
+    The catalogue of files in datadir is built if not passed in, so
+    catchup() can build it once for all new files.  If a manifest is
+    passed, the inputs of each output are recorded in it.
+    """
+
+    from .readiness import first_not_ready, NotReadyLog
 
     numfiles = 3
     
-    # get file listing of RadialMetric folder in datadir
-    rmfoldername = get_radialmetric_foldername(datadir)
-    indir = os.path.join(datadir, rmfoldername, pattern)
-    fns = recursive_glob(indir, 'RDL*.ruv')
-
-    try:
-        idx = fns.index(fullfn)
-    except ValueError, e:
-        idx = None
-
-    if idx == None:
+    if catalog is None:
+        catalog = build_catalog(datadir, pattern)
+    # make sure the new file is in the catalogue (as when it has just arrived)
+    if os.path.isfile(fullfn):
+        catalog.add(fullfn, pattern)
+
+    key = catalog.key(fullfn, pattern)
+    if key is None or key not in catalog or \
+       key[1] != lluvtype_for('RadialMetric', pattern):
         print "qccodar (auto): Expecting RadialMetric file. "
         print "    File %s does not match 'RDL*.ruv'" % fullfn
         return
     
-    if numfiles == 1 and len(fns)>=1:
-        fullfn = fns[idx]
-    elif numfiles == 3 and len(fns)>=2 and idx>=1:
-        fullfn = fns[idx-1]
-    elif numfiles == 5 and len(fns)>=3 and idx>=2:
-        fullfn = fns[idx-2]
+    if numfiles == 1:
+        fullfn = catalog.neighbour(fullfn, pattern, 0)
+    elif numfiles == 3:
+        fullfn = catalog.neighbour(fullfn, pattern, -1)
+    elif numfiles == 5:
+        fullfn = catalog.neighbour(fullfn, pattern, -2)
     else:
+        fullfn = None
+
+    if fullfn is None:
         print "... Nothing processed. Need more files to run qc"
         return
 
+    # the newest file of the window may still be being written, waited
+    # on before taking the lock so other runs are not held up
+    window = qc_window(catalog, fullfn, pattern)
+    log = NotReadyLog(datadir, pattern)
+    wfn = first_not_ready(window, max(window, key=os.path.basename), log=log)
+    if wfn is not None and log.given_up(wfn):
+        print '... skip %s, %s not complete after %d waits ... not waited on until it changes' % \
+            (os.path.basename(fullfn), os.path.basename(wfn), log.attempts(wfn))
+        return
+    elif wfn is not None:
+        print '... skip %s, %s not complete ... wait for next file event to process' % \
+            (os.path.basename(fullfn), os.path.basename(wfn))
+        return
+
+    # another run (e.g. an overlapping cron started one) may be on it
+    rsdfn = output_filename(datadir, fullfn, pattern, 'RadialShorts')
+    lock = output_lock(datadir, pattern, rsdfn)
+    if not lock.acquire():
+        print '... skip %s, being processed by another run' % os.path.basename(fullfn)
+        return
     try:
+        if not catalog.has_output(fullfn, pattern, 'RadialShorts') and os.path.exists(rsdfn):
+            print '... skip %s, processed by another run' % os.path.basename(fullfn)
+            return
         print '... qc input: %s' % fullfn
         fn = os.path.basename(fullfn)
-        rsdfn = do_qc(datadir, fn, pattern)
+        rsdfn = do_qc(datadir, fn, pattern, catalog=catalog, manifest=manifest)
         print '... qc output: %s' % rsdfn
     except EOFError, e:
         print 'Encountered empty file in qc process ... wait for next file event to process'
         return
+    finally:
+        lock.release()
 
-    # get file listing of RadialShorts_qcd folder in datadir
-    indir = os.path.join(datadir, 'RadialShorts_qcd', pattern)
-    fns = recursive_glob(indir, 'RDL*00.ruv')
+    # merge RadialShorts_qcd output if it is one that is merged
+    if rsdfn and catalog.key(rsdfn, pattern) in catalog and \
+       fnmatch.fnmatch(os.path.basename(rsdfn), 'RDL*00.ruv'):
+        merge(datadir, pattern, rsdfn, catalog, manifest=manifest)
 
-    try:
-        idx = fns.index(rsdfn)
-    except ValueError, e:
-        idx = None
+def merge(datadir, pattern, rsfn, catalog, manifest=None):
+    """ Run LLUVMerger for merge source rsfn, unless another run is merging it """
+    from .codarutils import merge_params
 
-    if idx != None:
-        fullfn = fns[idx]
-        print '... merge input: %s' % fullfn        
-        fn = os.path.basename(fullfn)
+    lock = output_lock(datadir, pattern, merge_output(datadir, rsfn, pattern, merge_params))
+    if not lock.acquire():
+        print '... skip merge of %s, being merged by another run' % os.path.basename(rsfn)
+        return
+    try:
+        print '... merge input: %s' % rsfn
+        fn = os.path.basename(rsfn)
         ofn = run_LLUVMerger(datadir, fn, pattern)
         print '... merge output: %s' % ofn
-
-def catchup(datadir, pattern):
-    """ Process any new RadialMetric files not processed yet in datadir """
-
-    numfiles = 3
-
-    if pattern=='IdealPattern':
-        lluvtype = 'v'
-    elif pattern=='MeasPattern':
-        lluvtype = 'w'
-
-    # find what is new in RadialMetric folder -- that does not have corresponding RadialShort
-    rmfoldername = get_radialmetric_foldername(datadir)
-    fns = recursive_glob(os.path.join(datadir, rmfoldername, pattern), 'RDL*.ruv')
-    fns = [os.path.basename(fn) for fn in fns]
-    # print fns
-    rsfns = recursive_glob(os.path.join(datadir, 'RadialShorts_qcd', pattern), 'RDL*.ruv')
-    rsfns = [os.path.basename(fn) for fn in rsfns]
-    # print rsfns
-    # replace RDL[xy] in radialshort names to compare with radialmetric names
-    for idx, fn in enumerate(rsfns):
-        rsfns[idx] = re.sub(r'RDL[xy]', 'RDL'+lluvtype, fn)
-    # print rsfns
-
-    # use dict-list to identify what is new
-    fns = dict([(fn,None) for fn in fns])
-    rsfns = dict([(fn,None) for fn in rsfns])
-    newfns = [fn for fn in fns if not fn in rsfns]
-    newfns.sort()
-
-    if numfiles == 3:
-        newfns = newfns[1:]
-    elif numfiles == 5:
-        newfns = newfns[2:]
-    print "Files to process ..." 
-    print newfns
-
-    for fn in newfns:
-        fullfn = os.path.join(datadir, rmfoldername, pattern, fn)
-        auto(datadir, pattern, fullfn)
+    finally:
+        lock.release()
+    if ofn:
+        catalog.add(ofn, pattern)
+        if manifest is not None:
+            manifest.record(ofn, merge_sources(catalog, rsfn, pattern, merge_params), \
+                            merge_params, 'Radials')
+
+def remerge(datadir, pattern, catalog, manifest, since):
+    """ Redo merges, of sources from since on, made before all their sources were qc'd
+
+    catchup() qc's and merges the newest files before the backlog, so
+    the latest merges are first made without the backlog files in their
+    window.  They are recorded in the manifest with the sources they
+    had and are redone once the backlog has filled in the rest.
+    """
+    from .codarutils import merge_params
+
+    for rsfn in merge_files(catalog, pattern):
+        if catalog.key(rsfn, pattern)[3] < since:
+            continue
+        mfn = merge_output(datadir, rsfn, pattern, merge_params)
+        # only merges made with fewer sources, not those made without a manifest
+        if mfn and manifest.relpath(mfn) in manifest.outputs and \
+           manifest.is_stale(mfn, merge_sources(catalog, rsfn, pattern, merge_params), merge_params):
+            print '... redo merge of %s, with backlog sources' % os.path.basename(rsfn)
+            merge(datadir, pattern, rsfn, catalog, manifest=manifest)
+
+def catchup(datadir, pattern, backlog_share=0.5):
+    """ Process any new RadialMetric files not processed yet in datadir
+
+    The newest files (for the latest merged product) are done first,
+    then the older backlog with backlog_share of the CPU (see
+    qccodar.scheduler).  Merges of the newest files that were made
+    before the backlog was qc'd are redone at the end (see remerge()).
+    """
+    from .scheduler import Scheduler
+    manifest = Manifest(datadir, pattern)
+    scheduler = Scheduler(datadir, pattern, backlog_share=backlog_share)
+    try:
+        scheduler.run(lambda fullfn, catalog: \
+                      auto(datadir, pattern, fullfn, catalog=catalog, manifest=manifest),
+                      remerge=lambda catalog, since: \
+                      remerge(datadir, pattern, catalog, manifest, since))
+    finally:
+        # an idle tick leaves the manifest and lag unread and unwritten
+        if manifest.recorded:
+            manifest.save()
+            scheduler.save()
+    scheduler.report()
 
 
 def main():
     """Run qccodar from the command line."""
     from docopt import docopt
 
-    arguments = docopt(__doc__, version="qccodar %s" % __version__)
+    arguments = docopt(__doc__)
     # print arguments
+    if arguments['--version']:
+        print "qccodar %s" % get_version()
+        return
+
+    if int(arguments['--threads']) != 1:
+        from . import qcutils
+        qcutils.qc_threads = int(arguments['--threads'])
+
+    sinks = []
+    if arguments['--metrics']:
+        from .metrics import JSONLinesSink
+        sinks.append(JSONLinesSink(arguments['--metrics']))
+    if arguments['--textfile']:
+        from .prometheus import TextfileSink
+        sinks.append(TextfileSink(arguments['--textfile'], None if arguments['batch'] else arguments['--pattern']))
+    if not (sinks or arguments['--profile'] or arguments['--memory']):
+        run_mode(arguments)
+        return
+
+    from . import metrics
+    if sinks:
+        metrics.set_sink(sinks[0] if len(sinks) == 1 else metrics.MultiSink(sinks))
+    # profiling and memory reports go with the manifest, next to the config in batch mode
+    if arguments['batch']:
+        outdir = os.path.dirname(os.path.abspath(arguments['--config']))
+    else:
+        outdir = statedir(arguments['--datadir'], arguments['--pattern'])
+    if arguments['--profile']:
+        from .profiling import Profiler
+        metrics.set_profiler(Profiler(outdir, float(arguments['--profile-rate']),
+                                      int(arguments['--profile-top'])))
+    if arguments['--memory']:
+        from .memory import MemoryTracker
+        metrics.set_memory(MemoryTracker(outdir))
+    try:
+        run_mode(arguments)
+    finally:
+        sink = metrics.set_sink(None)
+        if sink is not None:
+            sink.close()
+        profiler, tracker = metrics.set_profiler(None), metrics.set_memory(None)
+        reportfn = profiler.finish() if profiler else None
+        if reportfn:
+            print 'qccodar -- %d of %d calls profiled, report in %s' % \
+                (profiler.profiled, profiler.calls, reportfn)
+        reportfn = tracker.finish() if tracker else None
+        if reportfn:
+            print 'qccodar -- memory report in %s' % reportfn
+
+def run_mode(arguments):
+    """ Run the mode of the qccodar command line arguments """
+    if arguments['batch']:
+        # batch-mode, all sites in config file on one pool of workers
+        from .batch import read_batch_config, run_batch
+        configfn = arguments['--config']
+        if not os.path.isfile(configfn):
+            print "Error: qccodar batch --config %s" % configfn
+            print "File does not exist: %s " % configfn
+            return
+        run_batch(read_batch_config(configfn), int(arguments['--workers']))
+        return
 
     datadir, pattern = arguments['--datadir'], arguments['--pattern']
     if arguments['manual']:
@@ -172,9 +440,25 @@ def main():
         runarg = 'auto'
     elif arguments['catchup']:
         runarg = 'catchup'
+    elif arguments['update']:
+        runarg = 'update'
+    elif arguments['shard']:
+        runarg = 'shard'
     else:
         runarg = ''
 
+    if is_archive(datadir):
+        # archive of RadialMetric files, output goes next to it
+        if arguments['manual']:
+            manual(datadir, pattern, arguments['--executor'], arguments['--resume'],
+                   int(arguments['--workers']), float(arguments['--max-memory']))
+        elif arguments['update']:
+            update(datadir, pattern)
+        else:
+            print "Error: qccodar %s --datadir %s" % (runarg, datadir)
+            print "An archive can only be processed in manual or update mode"
+        return
+
     rmfoldername = get_radialmetric_foldername(datadir)
     # indatadir = os.path.join(datadir, 'RadialMetric', pattern)
     indatadir = os.path.join(datadir, rmfoldername, pattern)
@@ -194,15 +478,25 @@ def main():
     # run modes (manual | catchup | auto)
     if arguments['manual']:
         # manual-mode 
-        manual(datadir, pattern)
+        manual(datadir, pattern, arguments['--executor'], arguments['--resume'],
+                   int(arguments['--workers']), float(arguments['--max-memory']))
         return
     elif arguments['catchup']:
         # catchup once
-        catchup(datadir, pattern)
+        catchup(datadir, pattern, float(arguments['--backlog-share']))
+        return
+    elif arguments['update']:
+        # redo only what changed since last run
+        update(datadir, pattern)
+        return
+    elif arguments['shard']:
+        # one node of a manual run shared out over nodes
+        from .shard import run_shard
+        run_shard(datadir, pattern, int(arguments['--chunk-files']))
         return
     elif arguments['auto']:
         # catchup and then create watchdog to monitor datadir
-        catchup(datadir, pattern)
+        catchup(datadir, pattern, float(arguments['--backlog-share']))
         return
 
 if __name__ == "__main__":
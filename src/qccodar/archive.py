@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+#
+""" Tar and zip archives of RadialMetric files as input
+
+Historical RadialMetric data are often kept in monthly tar or zip
+bundles.  ArchiveSource indexes the RadialMetric members of an archive
+once (by name, no data is extracted) and reads members straight into
+the LLUV parser.  Members are named in the catalogue by a path inside
+the archive, e.g.
+
+  /data/HATY_2014_08.tar/RadialMetric/IdealPattern/RDLv_HATY_2014_08_01_0000.ruv
+
+so find_files_to_merge() windows resolve to members.  The pattern of
+a member is the name of its folder (IdealPattern or MeasPattern), or
+else follows its LLUV type (RDLv or RDLw).
+
+Outputs go to a directory named after the archive without extension
+(archive_outdir()), e.g. /data/HATY_2014_08/RadialShorts_qcd/IdealPattern.
+
+"""
+import os
+import hashlib
+import zipfile
+import tarfile
+import threading
+import collections
+
+from .catalog import FileCatalog, LLUVTYPES, parse_lluv_filename
+
+ARCHIVE_EXTENSIONS = ('.tar.gz', '.tar.bz2', '.tgz', '.tbz2', '.tar', '.zip')
+
+def is_archive(path):
+    """ True if path is a tar or zip file """
+    if not os.path.isfile(path):
+        return False
+    return zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+
+def archive_outdir(path):
+    """ Output directory for archive path, path without its extension """
+    for ext in ARCHIVE_EXTENSIONS:
+        if path.lower().endswith(ext):
+            return path[:-len(ext)]
+    return os.path.splitext(path)[0]
+
+
+class ArchiveSource(object):
+    """ Index of and reader for the RadialMetric members of an archive
+
+    The last cachesize parsed members are kept, so the overlapping qc
+    windows of members in time order read each member once (which for
+    compressed tar files also keeps reading forward through the file).
+    """
+    def __init__(self, path, cachesize=8):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cache = collections.OrderedDict()
+        self.cachesize = cachesize
+        self.members = {}     # member path -> (member info, pattern)
+        self._byname = {}     # (basename, pattern) -> member path
+        if zipfile.is_zipfile(path):
+            self._zip, self._tar = zipfile.ZipFile(path), None
+            infos = [(i.filename, i) for i in self._zip.infolist() if not i.filename.endswith('/')]
+        else:
+            self._zip, self._tar = None, tarfile.open(path, 'r:*')
+            infos = [(i.name, i) for i in self._tar.getmembers() if i.isfile()]
+        for name, info in infos:
+            pattern = self._pattern(name)
+            if pattern is None:
+                continue
+            mpath = os.path.join(path, name)
+            self.members[mpath] = (info, pattern)
+            self._byname[(os.path.basename(name), pattern)] = mpath
+
+    def _pattern(self, name):
+        """ Pattern of RadialMetric member name, None if it is not one """
+        parsed = parse_lluv_filename(name)
+        if parsed is None:
+            return None
+        lluvtypes = LLUVTYPES['RadialMetric']
+        folder = os.path.basename(os.path.dirname(name))
+        if lluvtypes.get(folder) == parsed[1]:
+            return folder
+        for pattern, lluvtype in lluvtypes.items():
+            if lluvtype == parsed[1]:
+                return pattern
+        return None
+
+    def patterns(self):
+        return sorted(set(pattern for info, pattern in self.members.values()))
+
+    def paths(self, pattern):
+        return sorted(mpath for mpath, (info, p) in self.members.items() if p == pattern)
+
+    def find(self, fn, pattern):
+        """ Member path of RadialMetric filename fn, None if not in archive """
+        return self._byname.get((os.path.basename(fn), pattern))
+
+    def catalog(self, pattern):
+        """ FileCatalog of the RadialMetric members of pattern """
+        catalog = FileCatalog()
+        catalog.add_files(self.paths(pattern), pattern)
+        return catalog
+
+    def size(self, mpath):
+        """ Uncompressed size in bytes of member mpath """
+        info, pattern = self.members[mpath]
+        return info.file_size if self._zip is not None else info.size
+
+    def fingerprint(self, mpath):
+        """ md5 of the name, size and checksum (zip) or mtime (tar) of member mpath """
+        info, pattern = self.members[mpath]
+        if self._zip is not None:
+            ident = '%s:%d:%08x' % (info.filename, info.file_size, info.CRC)
+        else:
+            ident = '%s:%d:%d:%d' % (info.name, info.size, info.mtime, info.chksum)
+        return hashlib.md5(ident).hexdigest()
+
+    def read_lines(self, mpath):
+        """ Lines of member mpath """
+        info, pattern = self.members[mpath]
+        with self._lock:
+            if self._zip is not None:
+                f = self._zip.open(info)
+            else:
+                f = self._tar.extractfile(info)
+            try:
+                return f.readlines()
+            finally:
+                f.close()
+
+    def read_lluv_file(self, mpath):
+        """ Same as codarutils.read_lluv_file() for member mpath
+
+        The table is shared with the cache, read-only, as the qc works
+        on copies.
+        """
+        with self._lock:
+            if mpath in self._cache:
+                return self._cache[mpath]
+        if mpath not in self.members:
+            print 'File does not exist: '+ mpath
+            raise IOError('Error opening %s' % mpath)
+        lines = self.read_lines(mpath)
+        if len(lines)<=0:
+            print 'Empty file: '+ mpath
+            raise EOFError('Empty File: %s' % mpath)
+        from .codarutils import parse_lluv_lines
+        result = parse_lluv_lines(lines, mpath)
+        result[0].setflags(write=False)
+        with self._lock:
+            self._cache[mpath] = result
+            while len(self._cache) > self.cachesize:
+                self._cache.popitem(last=False)
+        return result
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._tar.close()
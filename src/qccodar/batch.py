@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+#
+""" Batch mode for many sites and patterns in one run
+
+The sites are listed in a config file, one section per site, e.g.
+
+  [HATY]
+  datadir = /Codar/SeaSonde/Data/HATY
+  patterns = IdealPattern, MeasPattern
+
+  [DUCK]
+  datadir = /Codar/SeaSonde/Data/DUCK
+  patterns = IdealPattern
+
+The qc jobs (one per RadialMetric file) and merge jobs (one per
+RadialShorts_qcd merge source) of all sites run on one pool of worker
+processes.  Jobs are handed to the pool fair-share, next job from the
+site with the fewest jobs running, and in turn from each pattern of
+the site, so a site or pattern with a long backlog does not hold up
+the others.  A pattern's merge jobs are ready once all of
+its qc jobs are done.
+
+Parsed RadialMetric tables are shared between the workers through a
+BufferPool (qccodar.bufferpool), so each file is parsed once however
+many qc windows include it, and jobs carry only file names.
+
+"""
+import os
+import time
+import Queue
+import collections
+import ConfigParser
+import multiprocessing
+
+from .qcutils import do_qc, find_files_to_merge, qc_params
+from .codarutils import run_LLUVMerger, get_radialmetric_foldername, merge_params
+from .catalog import FileCatalog, build_catalog, lluvtype_for
+from .manifest import Manifest, merge_sources
+from .bufferpool import BufferPool, PoolSource
+
+debug = 1
+
+def read_batch_config(fn):
+    """ Read batch config file, return list of targets (site, datadir, pattern) """
+    cp = ConfigParser.SafeConfigParser()
+    if not cp.read(fn):
+        raise IOError('Error opening %s' % fn)
+    targets = []
+    for site in cp.sections():
+        datadir = cp.get(site, 'datadir')
+        if cp.has_option(site, 'patterns'):
+            patterns = cp.get(site, 'patterns').replace(',', ' ').split()
+        else:
+            patterns = ['IdealPattern']
+        for pattern in patterns:
+            targets.append((site, datadir, pattern))
+    return targets
+
+def _run_job(job):
+    """ Run one qc or merge job in a worker process """
+    kind, datadir, fn, pattern, window, pooldir = job
+    t0 = time.time()
+    try:
+        if kind == 'qc':
+            # small catalogue of the window so do_qc need not glob datadir
+            catalog = FileCatalog()
+            catalog.add_files(window, pattern)
+            source = PoolSource(pooldir, window) if pooldir else None
+            ofn = do_qc(datadir, fn, pattern, catalog=catalog, source=source)
+        else:
+            ofn = run_LLUVMerger(datadir, fn, pattern)
+        error = None
+    except Exception, e:
+        ofn, error = None, '%s: %s' % (e.__class__.__name__, e)
+    return ofn, time.time()-t0, error
+
+
+class _Target(object):
+    """ Jobs and bookkeeping of one (site, datadir, pattern) """
+    def __init__(self, site, datadir, pattern, pool=None):
+        self.site, self.datadir, self.pattern = site, datadir, pattern
+        self.catalog = build_catalog(datadir, pattern)
+        self.manifest = Manifest(datadir, pattern)
+        self.pool = pool
+        self.jobs = collections.deque()
+        self.qc_left = 0
+        self.refs = collections.defaultdict(int)   # path -> qc windows left that include it
+        for fullfn in self.catalog.paths(lluvtype_for('RadialMetric', pattern), pattern):
+            window = find_files_to_merge(fullfn, qc_params['numfiles'], qc_params['sample_interval'],
+                                         catalog=self.catalog, patterntype=pattern)
+            self.jobs.append(('qc', datadir, os.path.basename(fullfn), pattern, window,
+                              pool.dir if pool else None))
+            self.qc_left += 1
+            for path in window:
+                self.refs[path] += 1
+        if self.qc_left == 0:
+            self.queue_merges()
+
+    def done(self, job, ofn):
+        """ Record a finished job, queue merges once all qc jobs are done """
+        kind, datadir, fn, pattern, window, pooldir = job
+        if not ofn:
+            pass
+        elif kind == 'qc':
+            self.catalog.add(ofn, pattern)
+            self.manifest.record(ofn, window, qc_params, 'RadialShorts')
+        else:
+            self.catalog.add(ofn, pattern)
+            rsfn = os.path.join(datadir, 'RadialShorts_qcd', pattern, fn)
+            self.manifest.record(ofn, merge_sources(self.catalog, rsfn, pattern, merge_params),
+                                 merge_params, 'Radials')
+        if kind == 'qc':
+            for path in window:
+                self.refs[path] -= 1
+                if self.refs[path] == 0 and self.pool is not None:
+                    self.pool.release(path)
+            self.qc_left -= 1
+            if self.qc_left == 0:
+                self.queue_merges()
+
+    def queue_merges(self):
+        for rsfn in self.catalog.paths(lluvtype_for('RadialShorts', self.pattern), self.pattern):
+            if os.path.basename(rsfn).endswith('00.ruv'):
+                self.jobs.append(('merge', self.datadir, os.path.basename(rsfn), self.pattern, None, None))
+
+
+def _next_job(sites, running, stats, turn):
+    """ Next (site, target, job) to run, None if no jobs are left
+
+    Fair-share: the site with fewest jobs running, then fewest done,
+    then round-robin between the patterns (targets) of the site, from
+    the one after the target of turn[site].
+    """
+    candidates = [site for site in sites if any(t.jobs for t in sites[site])]
+    if not candidates:
+        return None
+    site = min(candidates, key=lambda s: (running[s], stats[s].qc+stats[s].merge))
+    targets = sites[site]
+    for k in range(len(targets)):
+        i = (turn.get(site, -1)+1+k) % len(targets)
+        if targets[i].jobs:
+            turn[site] = i
+            return site, targets[i], targets[i].jobs.popleft()
+
+
+class SiteStats(object):
+    """ Per-site counts and timing for the throughput report """
+    def __init__(self):
+        self.qc = 0
+        self.merge = 0
+        self.errors = 0
+        self.busy = 0.0      # seconds of worker time
+        self.start = None
+        self.end = None
+
+    def report(self, site):
+        wall = (self.end - self.start) if self.start is not None else 0.0
+        rate = self.qc / wall if wall > 0 else 0.0
+        return '%-8s qc %5d  merge %5d  errors %3d  wall %8.1f s  busy %8.1f s  %6.2f files/s' % \
+            (site, self.qc, self.merge, self.errors, wall, self.busy, rate)
+
+
+def run_batch(targets, workers=2, shared=True):
+    """ Run qc and merge of all targets on one pool of worker processes
+
+    Parameters
+    ----------
+    targets : list of (site, datadir, pattern)
+    workers : int
+       The number of worker processes
+    shared : bool
+       If True, parsed files are shared between workers (BufferPool)
+
+    Returns
+    -------
+    stats : dict
+       SiteStats for each site
+    """
+    workers = max(int(workers), 1)
+    pool = BufferPool() if shared else None
+    sites = collections.OrderedDict()
+    for site, datadir, pattern in targets:
+        if os.path.isdir(datadir):
+            indir = os.path.join(datadir, get_radialmetric_foldername(datadir), pattern)
+        else:
+            indir = os.path.join(datadir, 'RadialMetric', pattern)
+        if not os.path.isdir(indir):
+            print "Warn: qccodar batch site %s skipped" % site
+            print "Directory does not exist: %s " % indir
+            continue
+        for folder in ['RadialShorts_qcd', 'Radials_qcd']:
+            outdir = os.path.join(datadir, folder, pattern)
+            if not os.path.isdir(outdir):
+                os.makedirs(outdir)
+        sites.setdefault(site, []).append(_Target(site, datadir, pattern, pool))
+
+    stats = dict((site, SiteStats()) for site in sites)
+    running = dict((site, 0) for site in sites)
+    turn = {}
+    finished = Queue.Queue()
+
+    workerpool = multiprocessing.Pool(workers)
+    try:
+        inflight = 0
+        while True:
+            while inflight < workers:
+                item = _next_job(sites, running, stats, turn)
+                if item is None:
+                    break
+                site, target, job = item
+                running[site] += 1
+                inflight += 1
+                if stats[site].start is None:
+                    stats[site].start = time.time()
+                workerpool.apply_async(_run_job, (job,),
+                                 callback=lambda result, item=item: finished.put((item, result)))
+            if inflight == 0:
+                break
+            (site, target, job), (ofn, elapsed, error) = finished.get()
+            running[site] -= 1
+            inflight -= 1
+            st = stats[site]
+            st.end = time.time()
+            st.busy += elapsed
+            if error:
+                st.errors += 1
+                print '... %s %s error: %s' % (site, job[2], error)
+            elif job[0] == 'qc':
+                st.qc += 1
+            else:
+                st.merge += 1
+            if debug:
+                print '... %s %s %s -> %s' % (site, job[0], job[2], ofn)
+            target.done(job, ofn)
+    finally:
+        workerpool.close()
+        workerpool.join()
+        if pool is not None:
+            pool.close()
+        for site in sites:
+            for target in sites[site]:
+                target.manifest.save()
+
+    print 'qccodar (batch) -- per-site throughput'
+    for site in sites:
+        print stats[site].report(site)
+    return stats
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+#
+"""Benchmarks of the qc stages of do_qc() and of a manual-mode run.
+
+Runs offline on the RadialMetric files of DATADIR (by default the HATY
+files of the tests, in a source checkout), on inputs made from them
+with the radial table repeated SCALE times and,
+with --synthetic, on files from qccodar.synthetic (e.g. the hires
+preset of a high-resolution site with 360 degree coverage), made with
+a fixed seed so that runs compare.  Each benchmark is run REPEAT
+times and the best and mean times are kept.  Results are written as
+JSON with the machine they ran on, and are compared with a baseline,
+by default the reference results shipped with qccodar
+(benchmark_baseline.json): a benchmark whose best time is more than
+TOLERANCE slower than in the baseline is flagged as a regression and
+the exit status is 1.
+
+The memory benchmark is the peak RSS growth (see qccodar.memory) of
+do_qc() on the middle file against the bytes of the RadialMetric files
+of its window.  With --memory-limit a growth of more than MULT times
+the input also fails the run.
+
+The startup benchmark is a run of auto that finds nothing new (as
+most cron ticks do) in a new interpreter, timed from before qccodar
+is imported.  Its best time is held to a budget of SEC seconds
+(--startup-budget), over budget also fails the run.
+
+The merge benchmark is only run where LLUVMerger is installed
+(merge_params['lluvmerger']); otherwise the end-to-end benchmark is of
+the qc step of manual mode (manual_qc) rather than of manual mode.
+
+Run as qccodar-benchmark or python -m qccodar.benchmark.
+
+Usage:
+  qccodar-benchmark [options]
+
+Options:
+  -d DIR --datadir DIR      Data directory of the RadialMetric files (IdealPattern) to run on
+  -o FILE --output FILE     Write results as JSON to FILE
+  -b FILE --baseline FILE   Compare with the results JSON in FILE (default the reference results)
+  --no-baseline             Do not compare with a baseline
+  --tolerance FRAC          Regression if slower than baseline by more than FRAC [default: 0.25]
+  -r NUM --repeat NUM       Times each benchmark is run [default: 3]
+  -s LIST --scales LIST     Comma separated sizes of synthetic input, 1 is the HATY files [default: 1,4]
+  --synthetic LIST          Comma separated qccodar.synthetic presets to run on (e.g. haty,hires)
+  --numfiles NUM            Files in the qc window (qc_params numfiles) [default: 3]
+  --memory-limit MULT       Fail if qc of a file grows RSS by more than MULT times the size of its input files
+  --startup-budget SEC      Fail if auto with nothing new takes more than SEC seconds (default 0.25)
+  -k LIST --only LIST       Comma separated names of benchmarks to run (default all)
+  -h --help                 Show this help message and exit
+
+"""
+import os
+import sys
+import json
+import glob
+import shutil
+import socket
+import platform
+import datetime
+import tempfile
+import subprocess
+import multiprocessing
+from timeit import default_timer
+
+import numpy
+
+from .qcutils import read_lluv_file, write_output, stack_window, threshold_qc_all, \
+    weighted_velocities, threshold_rsd_numpoints, generate_radialshort_array, \
+    generate_radialshort_header, find_files_to_merge, do_qc, qc_params
+from .codarutils import run_LLUVMerger, merge_params
+from .catalog import build_catalog, lluvtype_for, get_radialmetric_foldername
+from .synthetic import write_synthetic
+from .memory import MemoryTracker
+from .metrics import set_memory
+
+# HATY files of the tests, not installed with the package
+haty_dir = os.path.join(os.path.dirname(__file__), 'test', 'files', 'codar_raw',
+                        'RadialMetric', 'IdealPattern')
+
+# results of the reference run, the default baseline
+reference_baseline = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+
+# seconds for a run of auto that finds nothing new, not counting the interpreter start
+startup_budget = 0.25
+
+# auto in a new interpreter, prints its time from before the import of qccodar
+startup_code = ("import time; t0 = time.time(); import sys, qccodar.app; "
+                "sys.argv = ['qccodar', 'auto', '-d', %r]; qccodar.app.main(); "
+                "print; print time.time() - t0")
+
+# seed of synthetic inputs, fixed so that results compare between runs
+seed = 0
+
+def machine_info():
+    """ What the benchmarks ran on """
+    from .app import get_version
+    return {'host' : socket.gethostname(),
+            'platform' : platform.platform(),
+            'machine' : platform.machine(),
+            'processor' : platform.processor(),
+            'cpus' : multiprocessing.cpu_count(),
+            'python' : platform.python_version(),
+            'numpy' : numpy.__version__,
+            'qccodar' : get_version(),
+    }
+
+def make_datadir(workdir, scale=1, indir=haty_dir):
+    """ Data directory of the RadialMetric files in indir with tables repeated scale times """
+    datadir = os.path.join(workdir, 'scale%d' % scale)
+    rmdir = os.path.join(datadir, 'RadialMetric', 'IdealPattern')
+    os.makedirs(rmdir)
+    for folder in ['RadialShorts_qcd', 'Radials_qcd']:
+        os.makedirs(os.path.join(datadir, folder, 'IdealPattern'))
+    for ifn in sorted(glob.glob(os.path.join(indir, 'RDL*.ruv'))):
+        ofn = os.path.join(rmdir, os.path.basename(ifn))
+        if scale == 1:
+            shutil.copy(ifn, ofn)
+            continue
+        d, types_str, header, footer = read_lluv_file(ifn)
+        if d.size > 0:
+            d = numpy.tile(d, (scale, 1))
+        write_output(ofn, header, d, footer)
+    return datadir
+
+def radialmetric_dir(datadir=None, pattern='IdealPattern'):
+    """ Folder of the RadialMetric files of pattern in datadir, by default the HATY files of the tests """
+    if datadir is None:
+        return haty_dir
+    if not os.path.isdir(datadir):
+        return os.path.join(datadir, 'RadialMetric', pattern)
+    return os.path.join(datadir, get_radialmetric_foldername(datadir), pattern)
+
+def make_synthetic_datadir(workdir, preset, numfiles=7):
+    """ Data directory of numfiles synthetic RadialMetric files of preset """
+    datadir = os.path.join(workdir, preset)
+    write_synthetic(datadir, numfiles=numfiles, seed=seed, preset=preset)
+    return datadir
+
+def timed(func, repeat=3):
+    """ Best and mean time (seconds) of repeat calls of func() """
+    times = []
+    for i in range(repeat):
+        t0 = default_timer()
+        func()
+        times.append(default_timer() - t0)
+    return {'best' : min(times), 'mean' : sum(times)/len(times), 'repeat' : repeat}
+
+def middle_window(datadir, pattern='IdealPattern'):
+    """ Catalog of datadir, its middle RadialMetric file and the files of its window """
+    catalog = build_catalog(datadir, pattern)
+    fns = catalog.paths(lluvtype_for('RadialMetric', pattern), pattern)
+    ifn = fns[len(fns)/2]
+    window = find_files_to_merge(ifn, qc_params['numfiles'], qc_params['sample_interval'],
+                                 catalog=catalog, patterntype=pattern)
+    return catalog, ifn, window
+
+def stage_benchmarks(datadir, repeat=3, only=None):
+    """ Time each stage of do_qc() on the window of the middle file in datadir """
+    pattern = 'IdealPattern'
+    catalog, ifn, window = middle_window(datadir, pattern)
+    # output of each stage as input of the next
+    d, types_str, header, footer = read_lluv_file(ifn)
+    others = [(xfn, read_lluv_file(xfn)) for xfn in window if xfn != ifn]
+    ds = stack_window(d, types_str, others)
+    dq = threshold_qc_all(ds.copy(), types_str, thresholds=qc_params['thresholds'])
+    xd, xtypes_str = weighted_velocities(dq, types_str, numdegrees=qc_params['numdegrees'],
+                                         weight_parameter=qc_params['weight_parameter'])
+    xd = threshold_rsd_numpoints(xd, xtypes_str, numpoints=qc_params['numpoints'])
+    rsd, rsdtypes_str = generate_radialshort_array(xd, xtypes_str, header)
+    rsdheader = generate_radialshort_header(rsd, rsdtypes_str, header)
+    ofn = os.path.join(datadir, 'RadialShorts_qcd', pattern,
+                       os.path.basename(ifn).replace('RDLv', 'RDLx'))
+
+    stages = [
+        ('read', lambda: read_lluv_file(ifn)),
+        ('stack', lambda: stack_window(d, types_str, others)),
+        ('threshold', lambda: threshold_qc_all(ds.copy(), types_str, thresholds=qc_params['thresholds'])),
+        ('weighted', lambda: weighted_velocities(dq, types_str, numdegrees=qc_params['numdegrees'],
+                                                 weight_parameter=qc_params['weight_parameter'])),
+        ('numpoints', lambda: threshold_rsd_numpoints(xd.copy(), xtypes_str, numpoints=qc_params['numpoints'])),
+        ('geolocation', lambda: generate_radialshort_array(xd, xtypes_str, header)),
+        ('header', lambda: generate_radialshort_header(rsd, rsdtypes_str, header)),
+        ('write', lambda: write_output(ofn, rsdheader, rsd, footer)),
+    ]
+    if os.path.exists(merge_params['lluvmerger']):
+        stages.append(('merge', lambda: run_LLUVMerger(datadir, os.path.basename(ofn), pattern)))
+
+    results = {}
+    for name, func in stages:
+        if only and name not in only:
+            continue
+        results[name] = timed(func, repeat)
+        results[name]['rows'] = ds.shape[0] if len(ds.shape) == 2 else 0
+    return results
+
+def memory_benchmark(datadir, workdir):
+    """ Peak RSS growth of do_qc() on the middle file of datadir, against the size of its window """
+    pattern = 'IdealPattern'
+    catalog, ifn, window = middle_window(datadir, pattern)
+    tracker = MemoryTracker(os.path.join(workdir, 'memory'), interval=0.001)
+    previous = set_memory(tracker)
+    try:
+        do_qc(datadir, os.path.basename(ifn), pattern, catalog=catalog)
+    finally:
+        set_memory(previous)
+    growth = max(r['rss_growth'] for r in tracker.calls() if r['stage'] == 'do_qc')
+    tracker.finish()
+    input_bytes = sum(os.path.getsize(fn) for fn in window)
+    return {'peak_growth' : growth, 'input_bytes' : input_bytes,
+            'ratio' : float(growth)/input_bytes if input_bytes else 0.0}
+
+def startup_benchmark(workdir, repeat=3):
+    """ Best and mean time (seconds) of auto on a datadir with nothing new, each in a new interpreter """
+    datadir = os.path.join(workdir, 'nothing_new')
+    for folder in ['RadialMetric', 'RadialShorts_qcd', 'Radials_qcd']:
+        os.makedirs(os.path.join(datadir, folder, 'IdealPattern'))
+    times = []
+    for i in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', startup_code % datadir])
+        times.append(float(out.split()[-1]))
+    return {'best' : min(times), 'mean' : sum(times)/len(times), 'repeat' : repeat}
+
+def manual_benchmark(datadir, repeat=3):
+    """ Time manual mode on datadir, or its qc step if there is no LLUVMerger """
+    pattern = 'IdealPattern'
+    if os.path.exists(merge_params['lluvmerger']):
+        from .app import manual
+        return 'manual', timed(lambda: manual(datadir, pattern), repeat)
+
+    def manual_qc():
+        catalog = build_catalog(datadir, pattern)
+        for fn in catalog.paths(lluvtype_for('RadialMetric', pattern), pattern):
+            do_qc(datadir, os.path.basename(fn), pattern, catalog=catalog)
+    return 'manual_qc', timed(manual_qc, repeat)
+
+def run_benchmarks(scales=(1, 4), repeat=3, only=None, synthetic=(), numfiles=None, indir=haty_dir):
+    """ Run the benchmarks at each scale and synthetic preset, return results as for JSON
+
+    Benchmarks are named stage/scale (e.g. weighted/4) or stage/preset
+    (e.g. weighted/hires).  The scaled inputs are made from the
+    RadialMetric files in indir.  numfiles sets the number of files in
+    the qc window for this run.
+    """
+    workdir = tempfile.mkdtemp(prefix='qccodar-bench-')
+    saved = dict(qc_params)
+    benchmarks = {}
+    memory = {}
+    try:
+        if numfiles:
+            qc_params['numfiles'] = numfiles
+        inputs = [(str(scale), lambda scale=scale: make_datadir(workdir, scale, indir)) for scale in scales]
+        inputs.extend((preset, lambda preset=preset: make_synthetic_datadir(workdir, preset)) \
+                      for preset in synthetic)
+        for label, make in inputs:
+            datadir = make()
+            for name, result in stage_benchmarks(datadir, repeat, only).items():
+                benchmarks['%s/%s' % (name, label)] = result
+            if not only or 'memory' in only:
+                memory[label] = memory_benchmark(datadir, workdir)
+            if not only or 'manual' in only or 'manual_qc' in only:
+                name, result = manual_benchmark(datadir, repeat)
+                benchmarks['%s/%s' % (name, label)] = result
+        if not only or 'startup' in only:
+            benchmarks['startup'] = startup_benchmark(workdir, repeat)
+        params = dict(qc_params)
+    finally:
+        qc_params.update(saved)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'machine' : machine_info(),
+            'time' : datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'qc_params' : params,
+            'seed' : seed,
+            'benchmarks' : benchmarks,
+            'memory' : memory,
+    }
+
+def compare(results, baseline, tolerance=0.25):
+    """ Benchmarks slower than in baseline by more than tolerance
+
+    Returns a list of (name, best, baseline best, ratio), for the
+    benchmarks in both results.
+    """
+    regressions = []
+    for name in sorted(results['benchmarks']):
+        if name not in baseline['benchmarks']:
+            continue
+        best = results['benchmarks'][name]['best']
+        base = baseline['benchmarks'][name]['best']
+        if base > 0 and best > base*(1.0+tolerance):
+            regressions.append((name, best, base, best/base))
+    return regressions
+
+def memory_regressions(results, limit):
+    """ Memory benchmarks growing by more than limit times their input, as (label, ratio) """
+    return [(label, r['ratio']) for label, r in sorted(results.get('memory', {}).items())
+            if r['ratio'] > limit]
+
+def report(results, baseline=None):
+    print 'qccodar benchmarks on %s (%s)' % (results['machine']['host'], results['machine']['platform'])
+    for name in sorted(results['benchmarks']):
+        r = results['benchmarks'][name]
+        line = '%-20s best %9.4f s  mean %9.4f s' % (name, r['best'], r['mean'])
+        if baseline and name in baseline['benchmarks']:
+            base = baseline['benchmarks'][name]['best']
+            line += '  baseline %9.4f s (%+.0f%%)' % (base, 100.0*(r['best']-base)/base if base else 0.0)
+        print line
+    for label in sorted(results.get('memory', {})):
+        r = results['memory'][label]
+        print '%-20s peak %9.1f MB  input %7.1f MB  (%.1f times)' % \
+            ('memory/'+label, r['peak_growth']/1048576., r['input_bytes']/1048576., r['ratio'])
+
+def main():
+    from docopt import docopt
+    arguments = docopt(__doc__)
+
+    indir = radialmetric_dir(arguments['--datadir'])
+    if not glob.glob(os.path.join(indir, 'RDL*.ruv')):
+        print "Error: qccodar-benchmark --datadir %s" % (arguments['--datadir'] or '')
+        print "No RadialMetric files in %s" % indir
+        if arguments['--datadir'] is None:
+            print "The HATY files of the tests are only in a source checkout, give a --datadir"
+        sys.exit(2)
+
+    scales = [int(s) for s in arguments['--scales'].split(',')]
+    only = arguments['--only'].split(',') if arguments['--only'] else None
+    synthetic = arguments['--synthetic'].split(',') if arguments['--synthetic'] else []
+    results = run_benchmarks(scales, int(arguments['--repeat']), only, synthetic,
+                             int(arguments['--numfiles']), indir)
+
+    baseline = None
+    if not arguments['--no-baseline']:
+        with open(arguments['--baseline'] or reference_baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('machine', {}).get('host') != results['machine']['host']:
+            print 'Warn: baseline is from host %s, times may not compare' % \
+                baseline.get('machine', {}).get('host')
+    report(results, baseline)
+
+    if arguments['--output']:
+        with open(arguments['--output'], 'w') as f:
+            json.dump(results, f, sort_keys=True, indent=1)
+
+    failed = False
+    if baseline:
+        regressions = compare(results, baseline, float(arguments['--tolerance']))
+        for name, best, base, ratio in regressions:
+            print 'Regression: %s %.4f s is %.2f times baseline %.4f s' % (name, best, ratio, base)
+        failed = bool(regressions)
+    if arguments['--memory-limit']:
+        limit = float(arguments['--memory-limit'])
+        for label, ratio in memory_regressions(results, limit):
+            print 'Memory: qc of %s grew RSS by %.1f times its input (limit %g)' % (label, ratio, limit)
+            failed = True
+    budget = float(arguments['--startup-budget'] or startup_budget)
+    if 'startup' in results['benchmarks'] and results['benchmarks']['startup']['best'] > budget:
+        print 'Startup: auto with nothing new took %.3f s (budget %.3f s)' % \
+            (results['benchmarks']['startup']['best'], budget)
+        failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+""" Shared-memory buffers of parsed RadialMetric files for worker processes
+
+The qc window of a file overlaps the windows of its neighbours, so in
+batch mode each RadialMetric file is needed by up to numfiles qc jobs
+in different worker processes.  Rather than each worker parsing it
+again, or the arrays being pickled between processes, the first worker
+to parse a file places its table in the pool, a directory in /dev/shm
+(shared memory on Linux, else the temporary directory).  The table is
+a .npy file that other workers map (numpy.memmap) instead of parsing.
+Jobs carry only the pool directory and file names (descriptors).
+
+The process that owns the pool releases a file's buffer once the last
+job whose window includes it is done, and removes the pool at the end.
+
+"""
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+import numpy
+
+from .codarutils import read_lluv_file
+
+def shm_dir():
+    """ Directory for shared-memory buffers """
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+class BufferPool(object):
+    """ Directory of parsed RadialMetric tables shared by processes """
+    def __init__(self, pooldir=None):
+        if pooldir is None:
+            pooldir = tempfile.mkdtemp(prefix='qccodar-', dir=shm_dir())
+        self.dir = pooldir
+
+    def _fn(self, path, ext):
+        return os.path.join(self.dir, hashlib.md5(path).hexdigest() + ext)
+
+    def get(self, path):
+        """ read_lluv_file() output of path from the pool, None if not there """
+        npyfn = self._fn(path, '.npy')
+        try:
+            d = numpy.load(npyfn, mmap_mode='r')
+        except IOError:
+            return None
+        except ValueError:
+            # no radial data, an empty table cannot be mapped
+            d = numpy.load(npyfn)
+        f = open(self._fn(path, '.json'), 'r')
+        try:
+            types_str, header, footer = json.load(f)
+        finally:
+            f.close()
+        return d, str(types_str), str(header), str(footer)
+
+    def put(self, path, data):
+        """ Place read_lluv_file() output data of path in the pool """
+        d, types_str, header, footer = data
+        tmp = '.%d.tmp' % os.getpid()
+        f = open(self._fn(path, '.json')+tmp, 'w')
+        try:
+            json.dump([types_str, header, footer], f)
+        finally:
+            f.close()
+        os.rename(self._fn(path, '.json')+tmp, self._fn(path, '.json'))
+        # the table is written last, its rename makes the entry visible
+        f = open(self._fn(path, '.npy')+tmp, 'wb')
+        try:
+            numpy.save(f, d)
+        finally:
+            f.close()
+        os.rename(self._fn(path, '.npy')+tmp, self._fn(path, '.npy'))
+
+    def read_lluv_file(self, path):
+        """ Same as codarutils.read_lluv_file(), parsing only on the first read
+
+        Returns the shared table mapped read-only, not a copy.  The qc
+        does not modify its input (the threshold tests flag copies).
+        """
+        data = self.get(path)
+        if data is None:
+            data = read_lluv_file(path)
+            self.put(path, data)
+        return data
+
+    def release(self, path):
+        """ Remove the buffer of path """
+        for ext in ['.npy', '.json']:
+            try:
+                os.remove(self._fn(path, ext))
+            except OSError:
+                pass
+
+    def close(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class PoolSource(object):
+    """ Source for do_qc() reading the files of a window through a pool """
+    def __init__(self, pooldir, window):
+        self.pool = BufferPool(pooldir)
+        self.window = window
+        self.path = os.path.dirname(window[0]) if window else ''
+
+    def find(self, fn, pattern):
+        for path in self.window:
+            if os.path.basename(path) == fn:
+                return path
+        return None
+
+    def read_lluv_file(self, path):
+        return self.pool.read_lluv_file(path)
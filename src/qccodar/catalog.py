@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+#
+""" File catalogue of CODAR LLUV files
+
+Index of RadialMetric, RadialShorts and Radial files in a data
+directory, keyed by (site, lluvtype, pattern, datetime).  Filenames
+are parsed once when the catalogue is built so that finding the files
+in a temporal window, the neighbour of a file or whether an output
+already exists does not require globbing the directory again.
+
+"""
+import os
+import re
+import fnmatch
+import bisect
+import datetime
+
+# folder name for each kind of LLUV product and the lluvtype
+# character used in filenames for each pattern type
+FOLDERS = {'RadialMetric' : None, # variants found by get_radialmetric_foldername()
+           'RadialShorts' : 'RadialShorts_qcd',
+           'Radials' : 'Radials_qcd',
+}
+
+LLUVTYPES = {'RadialMetric' : {'IdealPattern' : 'v', 'MeasPattern' : 'w'},
+             'RadialShorts' : {'IdealPattern' : 'x', 'MeasPattern' : 'y'},
+             'Radials' : {'IdealPattern' : 'i', 'MeasPattern' : 'm'},
+}
+
+# e.g. RDLv_HATY_2013_11_05_0000.ruv, the date and time are parsed by
+# filt_datetime() as in the baseline, so looser timestamps still match
+_lluv_filename = re.compile(r"""
+    ^RDL(?P<lluvtype>[a-z])_     # RDL and lluvtype character
+    (?P<site>[^_]+)_             # site code
+    .*\.ruv$
+    """, re.VERBOSE)
+
+def filt_datetime(input_string, pattern=None):
+    """Attempts to filter date and time from input string based on regex pattern.
+    
+    Default pattern follows the template, YYYY(-)MM(-)DD(-)(hh(:)(mm(:)(ss)))
+    with minimum of YYYY MM and DD (date) supplied in descending order to 
+    return its datetime object, otherwise returns None.
+
+    Typical matches include, YYYYMMDD-hhmmss, YYYY-MM-DD-hh:mm:ss All
+    the following will produce the corresponding datetime object. Any
+    2-digit year will return None.
+
+    Requires date with all three (year, month, day) in decreasing
+    order as integers. Time is optional.
+
+    >>> filt_datetime('RDLv_HATY_2013_11_05_000000.ruv')
+    datetime.datetime(2013, 11, 5, 0, 0)
+
+    >>> filt_datetime('RDLv_HATY_2013_11_05_0000.ruv')
+    datetime.datetime(2013, 11, 5, 0, 0)
+    
+    >>> filt_datetime('RDLv_HATY_2013_11_05_00.ruv')
+    datetime.datetime(2013, 11, 5, 0, 0)
+    
+    >>> filt_datetime('RDLv_HATY_2013_11_05.ruv')
+    datetime.datetime(2013, 11, 5, 0, 0)
+    
+    # NOTE: returns None
+    >>> filt_datetime('RDLv_HATY_13_11_05.ruv')
+    
+    >>> filt_datetime('RDLv_HATY_2013-11-05T00:00:00.ruv')
+    datetime.datetime(2013, 11, 5, 0, 0)
+
+    """
+
+    #  the default pattern for a typical codar time stamp format
+    if not pattern:
+        pattern = r"""
+        # YYYY(-)MM(-)DD(-)(hh(:)(mm(:)(ss)))
+        (\d{4})           # 4-digit YEAR 
+        \D?               # optional 1 character non-digit separator (e.g. ' ' or '-')
+        (\d{2})           # 2-digit MONTH 
+        \D?               # optional 1 character non-digit separator
+        (\d{2})           # 2-digit DAY 
+        \D?               # optional 1 character non-digit separator (e.g. ' ' or 'T')
+        (\d{2})?          # optional 2-digit HOUR 
+        \D?               # optional 1 character non-digit separator (e.g. ' ' or ':')
+        (\d{2})?          # optional 2-digit MINUTE 
+        \D?               # optional 1 character non-digit separator (e.g. ' ' or ':')
+        (\d{2})?          # optional 2-digit SECOND
+        """
+    #         
+    p = re.compile(pattern, re.VERBOSE)
+    m = p.search(input_string) 
+    # m.groups() # should be ('2013', '11', '05', '00', '00', None) for 'RDLv_HATY_2013_11_05_0000.ruv'
+    if m:
+        values = [int(yi) for yi in m.groups() if yi is not None] # [2013, 11, 5, 0, 0]
+        # datetime.datetime(*v) requires mininum of year, month, day
+        dt = datetime.datetime(*values) # datetime.datetime(2013, 11, 5, 0, 0)
+    else:
+        dt = None
+    return dt
+
+def parse_lluv_filename(fn):
+    """ Return (site, lluvtype, datetime) parsed from LLUV filename or None
+
+    >>> parse_lluv_filename('RDLv_HATY_2013_11_05_0000.ruv')
+    ('HATY', 'v', datetime.datetime(2013, 11, 5, 0, 0))
+    """
+    m = _lluv_filename.match(os.path.basename(fn))
+    if not m:
+        return None
+    try:
+        dt = filt_datetime(os.path.basename(fn))
+    except ValueError:
+        # digits in place but not a date, e.g. month 13
+        return None
+    if dt is None:
+        return None
+    return (m.group('site'), m.group('lluvtype'), dt)
+
+def get_radialmetric_foldername(datadir, pattern='?adial*etric*'):
+    """ Slightly different variances in the name of the folder for RadialMetric[s] data"""
+    fns = os.listdir(datadir)
+    mfns = fnmatch.filter(fns, pattern)
+    if mfns:
+        foldername = mfns[0]
+    else:
+        foldername = ''
+    return foldername
+
+def lluvtype_for(kind, pattern):
+    """ The lluvtype character for kind of file and pattern, e.g. ('RadialShorts', 'IdealPattern') -> 'x' """
+    try:
+        return LLUVTYPES[kind][pattern]
+    except KeyError:
+        return None
+
+
+class FileCatalog(object):
+    """Timestamp-indexed catalogue of LLUV files.
+
+    Each file is stored under the key (site, lluvtype, pattern,
+    datetime).  For every (site, lluvtype, pattern) series a sorted
+    list of datetimes and a position lookup is kept so neighbour and
+    window queries do not depend on the number of files in the series.
+
+    """
+    def __init__(self):
+        self._paths = {}      # (site, lluvtype, pattern, dt) -> path
+        self._times = {}      # (site, lluvtype, pattern) -> sorted list of dt
+        self._position = {}   # (site, lluvtype, pattern) -> {dt: index in _times}
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, key):
+        return key in self._paths
+
+    def add(self, path, pattern):
+        """ Add path to catalogue, return its key or None if not an LLUV filename """
+        parsed = parse_lluv_filename(path)
+        if parsed is None:
+            return None
+        site, lluvtype, dt = parsed
+        key = (site, lluvtype, pattern, dt)
+        series = (site, lluvtype, pattern)
+        if key not in self._paths:
+            times = self._times.setdefault(series, [])
+            if not times or dt > times[-1]:
+                # realtime files arrive in order, so append is the common case
+                times.append(dt)
+                if series in self._position:
+                    self._position[series][dt] = len(times)-1
+            else:
+                bisect.insort(times, dt)
+                # positions shifted, rebuild on next lookup
+                self._position.pop(series, None)
+        self._paths[key] = path
+        return key
+
+    def add_files(self, paths, pattern):
+        """ Add list of paths to catalogue """
+        for path in paths:
+            self.add(path, pattern)
+
+    def scan(self, treeroot, pattern, fnpattern='RDL*.ruv'):
+        """ Walk treeroot once and add files matching fnpattern """
+        for base, dirs, files in os.walk(treeroot):
+            for f in fnmatch.filter(files, fnpattern):
+                if self.add(os.path.join(base, f), pattern) is None:
+                    print '... skip %s, no site or date and time in filename' % os.path.join(base, f)
+
+    def key(self, path, pattern):
+        """ The catalogue key for path, whether or not it is catalogued """
+        parsed = parse_lluv_filename(path)
+        if parsed is None:
+            return None
+        site, lluvtype, dt = parsed
+        return (site, lluvtype, pattern, dt)
+
+    def get(self, site, lluvtype, pattern, dt):
+        """ Path for the key or None """
+        return self._paths.get((site, lluvtype, pattern, dt))
+
+    def has(self, site, lluvtype, pattern, dt):
+        return (site, lluvtype, pattern, dt) in self._paths
+
+    def paths(self, lluvtype, pattern, site=None):
+        """ All paths of lluvtype and pattern sorted by site and time """
+        result = []
+        for series in sorted(self._times):
+            s, t, p = series
+            if t == lluvtype and p == pattern and (site is None or s == site):
+                result.extend(self._paths[series+(dt,)] for dt in self._times[series])
+        return result
+
+    def _positions(self, series):
+        pos = self._position.get(series)
+        if pos is None:
+            pos = dict((dt, i) for i, dt in enumerate(self._times.get(series, [])))
+            self._position[series] = pos
+        return pos
+
+    def neighbour(self, path, pattern, offset):
+        """ Path of the file offset positions from path in its time series.
+
+        Returns None if path is not catalogued or there is no file at
+        the offset.
+        """
+        key = self.key(path, pattern)
+        if key is None or key not in self._paths:
+            return None
+        series, dt = key[0:3], key[3]
+        idx = self._positions(series)[dt] + offset
+        times = self._times[series]
+        if idx < 0 or idx >= len(times):
+            return None
+        return self._paths[series+(times[idx],)]
+
+    def window(self, path, pattern, numfiles=3, sample_interval=30):
+        """ Paths of files within the temporal window centered on path.
+
+        The window spans ((numfiles-1)/2)*sample_interval minutes either
+        side of the time of path, the same span used by
+        find_files_to_merge().  Returned in time order.
+        """
+        key = self.key(path, pattern)
+        if key is None:
+            return []
+        series, target_dt = key[0:3], key[3]
+        times = self._times.get(series, [])
+        delta_minutes = ((numfiles-1)/2)*sample_interval
+        dt_start = target_dt - datetime.timedelta(minutes=delta_minutes)
+        dt_end = target_dt + datetime.timedelta(minutes=delta_minutes)
+        if key in self._paths:
+            lo = hi = self._positions(series)[target_dt]
+            while lo > 0 and times[lo-1] >= dt_start:
+                lo -= 1
+            while hi < len(times)-1 and times[hi+1] <= dt_end:
+                hi += 1
+            hi += 1
+        else:
+            lo = bisect.bisect_left(times, dt_start)
+            hi = bisect.bisect_right(times, dt_end)
+        return [self._paths[series+(dt,)] for dt in times[lo:hi]]
+
+    def between(self, site, lluvtype, pattern, dt_start, dt_end):
+        """ Paths of the series with dt_start <= datetime <= dt_end in time order """
+        series = (site, lluvtype, pattern)
+        times = self._times.get(series, [])
+        lo = bisect.bisect_left(times, dt_start)
+        hi = bisect.bisect_right(times, dt_end)
+        return [self._paths[series+(dt,)] for dt in times[lo:hi]]
+
+    def output_for(self, path, pattern, kind='RadialShorts'):
+        """ Key of the kind of output that corresponds to path """
+        key = self.key(path, pattern)
+        lluvtype = lluvtype_for(kind, pattern)
+        if key is None or lluvtype is None:
+            return None
+        return (key[0], lluvtype, pattern, key[3])
+
+    def has_output(self, path, pattern, kind='RadialShorts'):
+        """ True if the kind of output for path is catalogued """
+        key = self.output_for(path, pattern, kind)
+        return key is not None and key in self._paths
+
+
+def output_filename(datadir, fn, pattern, kind='RadialShorts'):
+    """ Path of the kind of output made from RadialMetric file fn in datadir """
+    lluvtype = lluvtype_for(kind, pattern)
+    if lluvtype is None:
+        return None
+    ofn = re.sub(r'RDL[vw]', 'RDL'+lluvtype, os.path.basename(fn))
+    return os.path.join(datadir, FOLDERS[kind], pattern, ofn)
+
+def build_catalog(datadir, pattern, kinds=('RadialMetric', 'RadialShorts', 'Radials')):
+    """ Build a FileCatalog of the pattern folders in datadir """
+    catalog = FileCatalog()
+    for kind in kinds:
+        if kind == 'RadialMetric':
+            foldername = get_radialmetric_foldername(datadir)
+        else:
+            foldername = FOLDERS[kind]
+        catalog.scan(os.path.join(datadir, foldername, pattern), pattern)
+    return catalog
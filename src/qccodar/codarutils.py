@@ -10,15 +10,26 @@ import re
 import fnmatch
 import datetime
 
-import geopy
-import geopy.distance
-
 import numpy
 numpy.set_printoptions(suppress=True)
 from StringIO import StringIO
 
+# in catalog so that finding files does not import numpy
+from .catalog import get_radialmetric_foldername
+from .metrics import instrumented, rows, site_of
+
 debug = 1
 
+# LLUVMerger settings for 5MHz systems on NC coast, HATY, DUCK, CORE
+# (5 CSS files output every 30 min, merged over 5*30 min = 2.5 hours)
+merge_params = {'lluvmerger' : '/Codar/SeaSonde/Apps/Bin/LLUVMerger',
+                'rs_output_interval' : 30, # minutes
+                'rs_num' : 5,
+                'expected_offset' : 60, # minutes merged file time is behind source
+                'options' : ['-angres=5', '-angalign=2', '-angmethod=short',
+                             '-method=average', '-minvect=2', '-velcount', '-diag=4'],
+}
+
 def load_data(inFile):
     lines=None
     if os.path.exists(inFile):
@@ -33,19 +44,35 @@ def load_data(inFile):
         raise IOError('Error opening %s' % inFile)
     return lines
 
+@instrumented('write_output', lambda result, ofn, header, d, footer: \
+              {'file' : os.path.basename(ofn), 'site' : site_of(ofn), 'rows_in' : rows(d),
+               'bytes_written' : os.path.getsize(ofn)})
 def write_output(ofn, header, d, footer):
-    """Write header, radialmetric data, and footer. """
-    f = open(ofn, 'w')
-    if header[-1] == '\n':
-        f.write(header)
-    else:
-        f.write(header+'\n')
-    # if there is any data, save to the file)
-    if d.size > 0:
-        numpy.savetxt(f, d, fmt='%g')
-    f.write(footer)
-    f.close()
+    """Write header, radialmetric data, and footer. 
 
+    The file is written under a temporary name (ofn.part<pid>) and
+    renamed to ofn when complete, so ofn is never seen partly written.
+    """
+    tmpfn = '%s.part%d' % (ofn, os.getpid())
+    f = open(tmpfn, 'w')
+    try:
+        if header[-1] == '\n':
+            f.write(header)
+        else:
+            f.write(header+'\n')
+        # if there is any data, save to the file)
+        if d.size > 0:
+            numpy.savetxt(f, d, fmt='%g')
+        f.write(footer)
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    os.rename(tmpfn, ofn)
+
+@instrumented('read_lluv_file', lambda result, ifn: \
+              {'file' : os.path.basename(ifn), 'site' : site_of(ifn), 'rows_out' : rows(result[0]),
+               'bytes_read' : os.path.getsize(ifn)})
 def read_lluv_file(ifn):
     """Reads header, CSV table, and tail of LLUV files.  
 
@@ -77,7 +104,14 @@ def read_lluv_file(ifn):
        All the '%' commented lines after the data table, starting with '%TableEnd:'
 
     """
-    lines = load_data(ifn)
+    return parse_lluv_lines(load_data(ifn), ifn)
+
+def parse_lluv_lines(lines, ifn=''):
+    """Parses the lines of an LLUV file, as read_lluv_file() does for a file.
+
+    The lines may come from somewhere other than a file on disk, e.g.
+    a member of a tar or zip archive.  ifn names the source in messages.
+    """
     m=re.match(r'(?P<header>(%.*\n)*)(?P<middle>([\d\s-].*\n)*)(?P<tail>(%.*\n)*)', \
                ''.join(lines))
     header  = m.group('header')
@@ -120,16 +154,6 @@ def read_lluv_file(ifn):
     # lat, lon, u, v = numpy.loadtxt(s, usecols=(0,1,2,3), comments='%', unpack=True)
     return d, types_str, header, footer
 
-def get_radialmetric_foldername(datadir, pattern='?adial*etric*'):
-    """ Slightly different variances in the name of the folder for RadialMetric[s] data"""
-    fns = os.listdir(datadir)
-    mfns = fnmatch.filter(fns, pattern)
-    if mfns:
-        foldername = mfns[0]
-    else:
-        foldername = ''
-    return foldername
-
 def get_columns(types_str):
     # use dict to store column label and it's column number
     #c = col.defaultdict(int)
@@ -140,6 +164,8 @@ def get_columns(types_str):
         c[label]=m.index(label) # c['VFLG']=4
     return c
 
+@instrumented('generate_radialshort_array', lambda result, xd, *args, **kw: \
+              {'rows_in' : rows(xd), 'cells_out' : rows(result[0])})
 def generate_radialshort_array(xd, xtypes_str, header, table_type='LLUV RDL7'):
     """Generates radialshort (rsd) data array.
 
@@ -231,6 +257,8 @@ def generate_radialshort_array(xd, xtypes_str, header, table_type='LLUV RDL7'):
     rsd[:,rsc['RNGE']]=rnge
     #
     # Vincenty Great Circle destination point (LATD, LOND) based on rnge, bear from site origin
+    import geopy
+    import geopy.distance
     origin = geopy.Point(lat1,lon1)
     pts = numpy.array([geopy.distance.vincenty(kilometers=r).destination(origin, b)[0:2] for (r,b) in zip(rnge,bear)])
     latd, lond = pts[:,0], pts[:,1]
@@ -367,6 +395,9 @@ def compass2uv(wmag, wdir):
     v = wmag*numpy.cos(wdir*r)
     return (u,v)
 
+@instrumented('run_LLUVMerger', lambda result, datadir, fn, patterntype: \
+              {'file' : fn, 'output' : os.path.basename(result) if result else None},
+              lambda datadir, fn, patterntype: {'site' : site_of(fn), 'pattern' : patterntype})
 def run_LLUVMerger(datadir, fn, patterntype):
     """ Run CODAR's LLUVMerger app in subprocess """
 
@@ -396,16 +427,16 @@ def run_LLUVMerger(datadir, fn, patterntype):
     # subprocess.call(cmdstr, shell=True)
 
     # TO DO -- handle options for LLUVMerger from a config file for other systems
-    # settings for 5MHz systems on NC coast, HATY, DUCK, CORE
+    # settings in merge_params for 5MHz systems on NC coast, HATY, DUCK, CORE
     # (5 CSS files outputevery 30 min)
     # radial_output_interval (1 hour)
-    rs_output_interval = datetime.timedelta(minutes=30)
-    rs_num = 5
+    rs_output_interval = datetime.timedelta(minutes=merge_params['rs_output_interval'])
+    rs_num = merge_params['rs_num']
     # (merge average 5*30 min = 150 min or 2.5 hours)
     span_hrs = rs_num * (rs_output_interval.seconds/3600.) # hours, 2.5 hours
     span_hrs_str = '%f' % span_hrs # '2.5000'
     # if ifn (source file) is on the hour (00 min) expected time 
-    expected_timedelta = datetime.timedelta(minutes=60)
+    expected_timedelta = datetime.timedelta(minutes=merge_params['expected_offset'])
     #
     #       22:30
     # 5\    23:00
@@ -417,18 +448,12 @@ def run_LLUVMerger(datadir, fn, patterntype):
     
     # ordered list of args, order of some options is important,
     # e.g. -span and -startwith before -source
-    args = ['/Codar/SeaSonde/Apps/Bin/LLUVMerger',
+    args = [merge_params['lluvmerger'],
             '-span='+span_hrs_str,
-            '-lluvtype='+lluvtype, 
-            '-angres=5',
-            '-angalign=2',
-            '-angmethod=short',
-            '-method=average',
-            '-minvect=2',
-            '-velcount',
-            '-diag=4',
-            '-source='+ifn,
-            '-output='+outdir]
+            '-lluvtype='+lluvtype]
+    args.extend(merge_params['options'])
+    args.extend(['-source='+ifn,
+                 '-output='+outdir])
 
     if debug>=2:
         print ' '.join(args)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+#
+"""Equivalence of the optimized paths of the qc with the reference functions.
+
+An optimized path (threads, shared buffers, ...) is registered with
+the reference function it stands in for, as a function of a case (the
+window of a RadialMetric file, parsed and at each step of the qc)
+returning both calls.  Each path is run with its reference on the
+RadialMetric files of DATADIR (by default the HATY files of the tests,
+in a source checkout, left out where they are not installed) and on
+qccodar.synthetic presets, and the outputs
+are compared array by array: same shape, NaN in the same places, the
+VFLG column the same bit for bit and other values equal within
+RTOL/ATOL; strings (types_str, header, footer) must be the same.  In
+the same run both are timed and the speed-up reported.  A path fails
+if it is not equivalent or is less than MIN_SPEEDUP times as fast as
+its reference, and the exit status is 1.
+
+Paths needing more cpus than the machine has (threads) are still run,
+with at least 2 threads, and compared, but their speed-up cannot be
+measured there and is not judged.
+
+Run as qccodar-equivalence or python -m qccodar.equivalence.
+
+Usage:
+  qccodar-equivalence [options]
+
+Options:
+  -d DIR --datadir DIR      Data directory of the RadialMetric files (IdealPattern) to run on
+  -r NUM --repeat NUM       Times each call is timed [default: 3]
+  --rtol FRAC               Relative tolerance of values [default: 1e-9]
+  --atol NUM                Absolute tolerance of values [default: 1e-12]
+  --min-speedup MULT        Fail a path less than MULT times as fast as its reference [default: 1.0]
+  --synthetic LIST          Comma separated qccodar.synthetic presets to run on [default: haty,hires]
+  -k LIST --only LIST       Comma separated names of paths to run (default all)
+  -h --help                 Show this help message and exit
+
+"""
+import os
+import sys
+import glob
+import shutil
+import tempfile
+import multiprocessing
+
+import numpy
+
+from . import qcutils
+from .qcutils import read_lluv_file, stack_window, threshold_qc_all, weighted_velocities, \
+    qc_radialshort, qc_params
+from .bufferpool import BufferPool
+from .benchmark import make_datadir, middle_window, make_synthetic_datadir, radialmetric_dir, timed
+
+# (name, prepare, min_cpus) of each path, see equivalence_path()
+paths = []
+
+# threads of the threaded paths
+threads = max(2, multiprocessing.cpu_count())
+
+def equivalence_path(name, min_cpus=1):
+    """Decorator registering prepare(case) as optimized path name.
+
+    prepare(case) returns (reference, candidate, cleanup): calls of no
+    arguments of the reference function and of the optimized path on
+    the case, and a call to run when done with them (or None).
+    """
+    def decorator(prepare):
+        paths.append((name, prepare, min_cpus))
+        return prepare
+    return decorator
+
+@equivalence_path('weighted_velocities/threads', min_cpus=2)
+def weighted_velocities_threads(case):
+    args = (case['dq'], case['types_str'], qc_params['numdegrees'], qc_params['weight_parameter'])
+    return (lambda: weighted_velocities(*args),
+            lambda: weighted_velocities(*args, threads=threads),
+            None)
+
+@equivalence_path('qc_radialshort/threads', min_cpus=2)
+def qc_radialshort_threads(case):
+    args = (case['ds'], case['types_str'], case['header'], case['footer'])
+    def threaded():
+        saved = qcutils.qc_threads
+        qcutils.qc_threads = threads
+        try:
+            return qc_radialshort(*args)
+        finally:
+            qcutils.qc_threads = saved
+    return lambda: qc_radialshort(*args), threaded, None
+
+@equivalence_path('read_lluv_file/bufferpool')
+def read_lluv_file_bufferpool(case):
+    pool = BufferPool(tempfile.mkdtemp(prefix='qccodar-eq-'))
+    # parsed once into the pool, then mapped as by the other workers
+    pool.read_lluv_file(case['ifn'])
+    return lambda: read_lluv_file(case['ifn']), lambda: pool.read_lluv_file(case['ifn']), pool.close
+
+def make_case(datadir):
+    """ Inputs of each step of the qc of the middle file of datadir """
+    catalog, ifn, window = middle_window(datadir)
+    d, types_str, header, footer = read_lluv_file(ifn)
+    others = [(xfn, read_lluv_file(xfn)) for xfn in window if xfn != ifn]
+    ds = stack_window(d, types_str, others)
+    dq = threshold_qc_all(ds.copy(), types_str, thresholds=qc_params['thresholds'])
+    return {'ifn' : ifn, 'window' : window, 'types_str' : types_str,
+            'header' : header, 'footer' : footer, 'ds' : ds, 'dq' : dq}
+
+def _vflg_column(a, strings):
+    """ Index of VFLG in the columns of a, from a types_str or header among strings """
+    for s in strings:
+        for line in s.splitlines():
+            cols = line.split(':', 1)[1].split() if line.startswith('%TableColumnTypes:') \
+                else line.split()
+            if len(cols) == a.shape[1] and 'VFLG' in cols:
+                return cols.index('VFLG')
+    return None
+
+def compare_arrays(ref, out, vflg=None, rtol=1e-9, atol=1e-12):
+    """ Differences of array out from ref, as a list of messages (empty if equivalent) """
+    if ref.shape != out.shape:
+        return ['shape %s is not %s' % (out.shape, ref.shape)]
+    problems = []
+    refnan, outnan = numpy.isnan(ref), numpy.isnan(out)
+    if (refnan != outnan).any():
+        where = numpy.argwhere(refnan != outnan)
+        problems.append('NaN placement differs in %d values, first at %s' % (len(where), tuple(where[0])))
+    both = ~(refnan | outnan)
+    close = numpy.isclose(out, ref, rtol=rtol, atol=atol) | ~both
+    if not close.all():
+        where = numpy.argwhere(~close)
+        i = tuple(where[0])
+        problems.append('%d values differ, first at %s: %r is not %r' % (len(where), i, out[i], ref[i]))
+    if vflg is not None and ref.ndim == 2 and ref.size > 0:
+        rflags, oflags = ref[:,vflg], out[:,vflg]
+        valid = ~(numpy.isnan(rflags) | numpy.isnan(oflags))
+        bits = numpy.bitwise_xor(rflags[valid].astype(numpy.int64), oflags[valid].astype(numpy.int64))
+        if bits.any():
+            problems.append('VFLG bits %s differ in %d rows' % (
+                bin(int(numpy.bitwise_or.reduce(bits))), int((bits != 0).sum())))
+    return problems
+
+def compare_results(ref, out, rtol=1e-9, atol=1e-12):
+    """ Differences of result out of a path from ref of its reference, as a list of messages """
+    if isinstance(ref, numpy.ndarray):
+        return compare_arrays(ref, numpy.asarray(out), rtol=rtol, atol=atol)
+    if not isinstance(ref, tuple):
+        return [] if ref == out else ['%r is not %r' % (out, ref)]
+    if not isinstance(out, tuple) or len(out) != len(ref):
+        return ['result %r does not match %r' % (type(out), type(ref))]
+    strings = [s for s in ref if isinstance(s, basestring)]
+    problems = []
+    for i, (r, o) in enumerate(zip(ref, out)):
+        if isinstance(r, numpy.ndarray):
+            vflg = _vflg_column(r, strings) if r.ndim == 2 else None
+            problems.extend('[%d] %s' % (i, p) for p in
+                            compare_arrays(r, numpy.asarray(o), vflg, rtol, atol))
+        elif r != o:
+            problems.append('[%d] differs' % i)
+    return problems
+
+def run_paths(cases, repeat=3, only=None, rtol=1e-9, atol=1e-12):
+    """ Run each path and its reference on each case of cases {label : case}
+
+    Returns a list of dicts with the path, case, problems found, best
+    times of reference and path and the speed-up, and why the speed-up
+    is not judged (unjudged) on a machine with too few cpus.
+    """
+    results = []
+    cpus = multiprocessing.cpu_count()
+    for name, prepare, min_cpus in paths:
+        if only and name not in only:
+            continue
+        for label in sorted(cases):
+            result = {'path' : name, 'case' : label}
+            results.append(result)
+            if cpus < min_cpus:
+                result['unjudged'] = 'speed-up needs %d cpus, %d here' % (min_cpus, cpus)
+            reference, candidate, cleanup = prepare(cases[label])
+            try:
+                result['problems'] = compare_results(reference(), candidate(), rtol, atol)
+                result['reference'] = timed(reference, repeat)['best']
+                result['candidate'] = timed(candidate, repeat)['best']
+            finally:
+                if cleanup is not None:
+                    cleanup()
+            result['speedup'] = result['reference']/result['candidate'] if result['candidate'] else 0.0
+    return results
+
+def failures(results, min_speedup=1.0):
+    """ Results of paths not equivalent or slower than min_speedup times their reference """
+    return [r for r in results if r['problems'] or \
+            ('unjudged' not in r and r['speedup'] < min_speedup)]
+
+def report(results):
+    for r in results:
+        name = '%s [%s]' % (r['path'], r['case'])
+        print '%-44s %s  reference %8.4f s  path %8.4f s  (%.2f times%s)' % \
+            (name, 'equivalent' if not r['problems'] else 'DIFFERENT ',
+             r['reference'], r['candidate'], r['speedup'],
+             ', not judged, %s' % r['unjudged'] if 'unjudged' in r else '')
+        for p in r['problems']:
+            print '    %s' % p
+
+def main():
+    from docopt import docopt
+    arguments = docopt(__doc__)
+
+    only = arguments['--only'].split(',') if arguments['--only'] else None
+    workdir = tempfile.mkdtemp(prefix='qccodar-eq-')
+    try:
+        cases = {}
+        indir = radialmetric_dir(arguments['--datadir'])
+        if glob.glob(os.path.join(indir, 'RDL*.ruv')):
+            cases['bundled' if arguments['--datadir'] is None else 'datadir'] = \
+                make_case(make_datadir(workdir, indir=indir))
+        elif arguments['--datadir'] is not None:
+            print "Error: qccodar-equivalence --datadir %s" % arguments['--datadir']
+            print "No RadialMetric files in %s" % indir
+            sys.exit(2)
+        else:
+            print 'Note: HATY files of the tests not installed, running on synthetic presets only'
+        for preset in arguments['--synthetic'].split(','):
+            cases[preset] = make_case(make_synthetic_datadir(workdir, preset))
+        results = run_paths(cases, int(arguments['--repeat']), only,
+                            float(arguments['--rtol']), float(arguments['--atol']))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report(results)
+
+    min_speedup = float(arguments['--min-speedup'])
+    failed = failures(results, min_speedup)
+    for r in failed:
+        print 'Fail: %s [%s] %s' % (r['path'], r['case'],
+                                    'is not equivalent' if r['problems'] else \
+                                    'is %.2f times as fast as reference, needs %g' % (r['speedup'], min_speedup))
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
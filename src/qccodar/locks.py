@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+#
+""" Advisory lock files so overlapping runs divide up the work
+
+When a cron started `qccodar auto` runs long, the next one can start
+on the same datadir.  Before making an output (a RadialShorts_qcd
+file or a merged Radials_qcd file) a run takes the output lock in
+DATADIR/.qccodar/PATTERN/locks, and skips the output if another run
+holds it.  The run lock (run.lock next to the manifest) is held while
+the manifest is saved, so records of concurrent runs are combined,
+not overwritten.
+
+A lock file is created with link(), which is atomic also over NFS,
+and holds the host, pid and time of its owner.  A lock is stale if its
+owner on this host is no longer running, or if it is older than
+stale_after seconds, and is then broken by the next run that wants it.
+
+"""
+import os
+import json
+import time
+import errno
+import socket
+
+# seconds after which a lock is taken to be left by a crashed run
+stale_after = 3600
+
+def node_id():
+    """ Identify this process on this host """
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+def pid_alive(pid):
+    """ True if process pid is running on this host """
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+def makedirs(dirname):
+    """ Make dirname, which another run may be making at the same time """
+    if dirname and not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+def create_exclusive(fn, content):
+    """ Create fn with content only if it does not exist, return True if created
+
+    The content is written to a temporary file that is linked to fn,
+    so fn is either absent or complete, also over NFS.
+    """
+    tmpfn = '%s.%s.tmp' % (fn, node_id().replace(':', '.'))
+    f = open(tmpfn, 'w')
+    try:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    try:
+        os.link(tmpfn, fn)
+    except OSError, e:
+        if e.errno == errno.EEXIST:
+            return False
+        raise
+    finally:
+        os.remove(tmpfn)
+    return True
+
+
+class FileLock(object):
+    """ Advisory lock held by the existence of lock file fn
+
+    Use acquire()/release(), or as context manager which waits up to
+    wait seconds and raises IOError if the lock is not free by then.
+    """
+    def __init__(self, fn, wait=60, stale_after=None):
+        self.fn = fn
+        self.wait = wait
+        self.stale_after = stale_after
+        self.held = False
+        self.info = None    # owner info written when taken or renewed
+
+    def owner(self):
+        """ Owner info of the lock file, None if there is none """
+        try:
+            f = open(self.fn, 'r')
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        try:
+            return json.loads(f.read())
+        except ValueError:
+            # not ours or damaged, judge by age
+            return {}
+        finally:
+            f.close()
+
+    def is_stale(self, info):
+        limit = stale_after if self.stale_after is None else self.stale_after
+        host, pid = info.get('host'), info.get('pid')
+        if host == socket.gethostname() and pid is not None and not pid_alive(pid):
+            return True
+        return time.time() - info.get('time', 0) > limit
+
+    def _break(self, info):
+        """ Remove stale lock, unless another run broke and retook it meanwhile """
+        stalefn = '%s.stale.%s' % (self.fn, node_id().replace(':', '.'))
+        try:
+            os.rename(self.fn, stalefn)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        f = open(stalefn, 'r')
+        content = f.read()
+        f.close()
+        try:
+            if json.loads(content) != info:
+                # a live lock was taken in between, put it back
+                try:
+                    os.link(stalefn, self.fn)
+                except OSError, e:
+                    if e.errno != errno.EEXIST:
+                        raise
+        except ValueError:
+            pass
+        os.remove(stalefn)
+
+    def acquire(self, wait=0, poll=0.2):
+        """ Take the lock, waiting up to wait seconds, return True if taken """
+        makedirs(os.path.dirname(self.fn))
+        t0 = time.time()
+        while True:
+            info = {'host' : socket.gethostname(), 'pid' : os.getpid(), 'time' : time.time()}
+            if create_exclusive(self.fn, json.dumps(info, sort_keys=True)):
+                self.held = True
+                self.info = info
+                return True
+            owner = self.owner()
+            if owner is None:
+                continue
+            if self.is_stale(owner):
+                print '... breaking stale lock %s %s' % (self.fn, owner)
+                self._break(owner)
+                continue
+            if time.time() - t0 >= wait:
+                return False
+            time.sleep(poll)
+
+    def renew(self):
+        """ Set the time of the lock held to now, so a long holder is not taken to be stale
+
+        Returns False if the lock is no longer held, e.g. it was broken
+        as stale by another run.
+        """
+        if not self.held or self.owner() != self.info:
+            self.held = False
+            return False
+        info = {'host' : socket.gethostname(), 'pid' : os.getpid(), 'time' : time.time()}
+        tmpfn = '%s.%s.tmp' % (self.fn, node_id().replace(':', '.'))
+        f = open(tmpfn, 'w')
+        try:
+            f.write(json.dumps(info, sort_keys=True))
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmpfn, self.fn)
+        self.info = info
+        return True
+
+    def release(self):
+        """ Remove the lock file, unless the lock was broken as stale and taken by another run """
+        if not self.held:
+            return
+        self.held = False
+        if self.owner() != self.info:
+            return
+        # moved aside and checked again, in case it was taken meanwhile
+        releasefn = '%s.release.%s' % (self.fn, node_id().replace(':', '.'))
+        try:
+            os.rename(self.fn, releasefn)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        f = open(releasefn, 'r')
+        content = f.read()
+        f.close()
+        try:
+            ours = json.loads(content) == self.info
+        except ValueError:
+            ours = False
+        if not ours:
+            # another run's lock, put it back
+            try:
+                os.link(releasefn, self.fn)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        os.remove(releasefn)
+
+    def __enter__(self):
+        if not self.acquire(wait=self.wait):
+            raise IOError('Timed out waiting for lock %s held by %s' % (self.fn, self.owner()))
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+def output_lock(datadir, pattern, ofn):
+    """ Lock of output file ofn """
+    from .manifest import statedir
+    return FileLock(os.path.join(statedir(datadir, pattern), 'locks', os.path.basename(ofn)+'.lock'))
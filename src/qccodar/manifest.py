@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+#
+""" Provenance manifest for incremental reprocessing
+
+Records which RadialMetric files (and qc settings) went into each
+RadialShorts_qcd output and which RadialShorts_qcd files (and merge
+settings) went into each Radials_qcd output.  Inputs are identified by
+a content hash so that regenerated or late files are detected, and
+only the outputs that depend on them are redone.
+
+The manifest is kept as JSON in DATADIR/.qccodar/PATTERN/manifest.json
+with paths relative to DATADIR.  Every record is also appended to a
+journal (journal.jsonl) as soon as it is made, so the progress of a run
+that is interrupted before the manifest is saved is not lost.  The
+journal is replayed when the manifest is loaded and cleared on save.
+
+"""
+import os
+import json
+import hashlib
+import datetime
+
+from .catalog import lluvtype_for, parse_lluv_filename
+from .locks import FileLock, makedirs
+
+STATEDIR = '.qccodar'
+
+def statedir(datadir, pattern):
+    """ Directory for qccodar bookkeeping files of pattern in datadir """
+    return os.path.join(datadir, STATEDIR, pattern)
+
+def params_digest(params):
+    """ Hash of the settings (any json serializable object) used to make an output """
+    return hashlib.md5(json.dumps(params, sort_keys=True)).hexdigest()
+
+def file_digest(path, blocksize=1<<20):
+    """ md5 hash of file contents """
+    h = hashlib.md5()
+    f = open(path, 'rb')
+    try:
+        block = f.read(blocksize)
+        while block:
+            h.update(block)
+            block = f.read(blocksize)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+def atomic_write(fn, content):
+    """ Write content to fn via a temporary file and rename """
+    tmpfn = '%s.tmp%d' % (fn, os.getpid())
+    f = open(tmpfn, 'w')
+    try:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    os.rename(tmpfn, fn)
+
+
+class Manifest(object):
+    """Input fingerprints and dependencies of outputs in a datadir.
+
+    Fingerprints are cached by file size and modification time so
+    unchanged inputs are not hashed again on every run.  The manifest
+    and journal are only read when first needed, so a run with nothing
+    to do does not read a large manifest.
+
+    """
+    def __init__(self, datadir, pattern, filename=None):
+        self.datadir = datadir
+        self.pattern = pattern
+        if filename is None:
+            filename = os.path.join(statedir(datadir, pattern), 'manifest.json')
+        self.filename = filename
+        self.journalfn = os.path.join(os.path.dirname(filename), 'journal.jsonl')
+        self._files = None    # relpath -> {'size', 'mtime', 'md5'}
+        self._outputs = None  # relpath -> {'kind', 'inputs' : {relpath: md5}, 'params'}
+        self.recorded = {}    # outputs recorded since loaded
+        self.source = None    # ArchiveSource the inputs may be members of
+
+    def _load(self):
+        self._files, self._outputs = {}, {}
+        if os.path.exists(self.filename):
+            f = open(self.filename, 'r')
+            try:
+                m = json.load(f)
+            finally:
+                f.close()
+            self._files = m.get('files', {})
+            self._outputs = m.get('outputs', {})
+        self._replay_journal()
+
+    def _get_files(self):
+        if self._files is None:
+            self._load()
+        return self._files
+
+    def _set_files(self, files):
+        self._files = files
+
+    files = property(_get_files, _set_files)
+
+    def _get_outputs(self):
+        if self._outputs is None:
+            self._load()
+        return self._outputs
+
+    def _set_outputs(self, outputs):
+        self._outputs = outputs
+
+    outputs = property(_get_outputs, _set_outputs)
+
+    def _replay_journal(self):
+        """ Apply records of a run that ended before save() """
+        if not os.path.exists(self.journalfn):
+            return
+        f = open(self.journalfn, 'r')
+        try:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # partly written last line of an interrupted run
+                    break
+                self._files.update(rec['files'])
+                self._outputs[rec['output']] = rec['entry']
+        finally:
+            f.close()
+
+    def _journal(self, rel, entry, files):
+        makedirs(os.path.dirname(self.journalfn))
+        f = open(self.journalfn, 'a')
+        try:
+            f.write(json.dumps({'output' : rel, 'entry' : entry, 'files' : files}, sort_keys=True)+'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+
+    def relpath(self, path):
+        return os.path.relpath(path, self.datadir)
+
+    def fingerprint(self, path):
+        """ md5 of path, reusing cached value if size and mtime are unchanged """
+        rel = self.relpath(path)
+        if self.source is not None and path in self.source.members:
+            md5 = self.source.fingerprint(path)
+            self.files[rel] = {'size' : None, 'mtime' : None, 'md5' : md5}
+            return md5
+        st = os.stat(path)
+        entry = self.files.get(rel)
+        if entry and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime:
+            return entry['md5']
+        md5 = file_digest(path)
+        self.files[rel] = {'size' : st.st_size, 'mtime' : st.st_mtime, 'md5' : md5}
+        return md5
+
+    def fingerprints(self, paths):
+        return dict((self.relpath(p), self.fingerprint(p)) for p in paths)
+
+    def record(self, output, inputs, params, kind):
+        """ Record output was made from inputs (list of paths) with params """
+        rel = self.relpath(output)
+        entry = {'kind' : kind,
+                 'inputs' : self.fingerprints(inputs),
+                 'params' : params_digest(params)}
+        self.outputs[rel] = entry
+        self.recorded[rel] = entry
+        # the fingerprint of the new output is needed by what depends on it
+        self.fingerprint(output)
+        files = dict((p, self.files[p]) for p in entry['inputs'].keys()+[rel])
+        self._journal(rel, entry, files)
+
+    def is_stale(self, output, inputs, params):
+        """ True if output is missing or was not made from current inputs and params """
+        if not output or not os.path.exists(output):
+            return True
+        entry = self.outputs.get(self.relpath(output))
+        if entry is None:
+            return True
+        if entry['params'] != params_digest(params):
+            return True
+        # a late file in the window changes the set of inputs
+        return entry['inputs'] != self.fingerprints(inputs)
+
+    def update(self, other):
+        """ Add the records of manifest other """
+        self.files.update(other.files)
+        self.outputs.update(other.outputs)
+        self.recorded.update(other.outputs)
+
+    def save(self):
+        makedirs(os.path.dirname(self.filename))
+        with FileLock(os.path.join(os.path.dirname(self.filename), 'run.lock')):
+            # other runs may have saved or journaled records since this one loaded
+            ondisk = Manifest(self.datadir, self.pattern, filename=self.filename)
+            ondisk.files.update(self.files)
+            ondisk.outputs.update(self.recorded)
+            self.files, self.outputs = ondisk.files, ondisk.outputs
+            m = {'files' : self.files, 'outputs' : self.outputs}
+            atomic_write(self.filename, json.dumps(m, sort_keys=True, indent=1))
+            # everything in the journal is now in the manifest
+            if os.path.exists(self.journalfn):
+                os.remove(self.journalfn)
+
+
+def merge_sources(catalog, rsfn, pattern, merge_params):
+    """ The RadialShorts_qcd files LLUVMerger averages for source rsfn.
+
+    LLUVMerger uses rs_num files back from and including the source
+    file, e.g. for 5 files every 30 minutes source 01:00 uses 23:00
+    through 01:00.
+    """
+    key = catalog.key(rsfn, pattern)
+    if key is None:
+        return []
+    site, lluvtype, _, dt_end = key
+    dt_start = dt_end - datetime.timedelta(minutes=(merge_params['rs_num']-1)*merge_params['rs_output_interval'])
+    return catalog.between(site, lluvtype, pattern, dt_start, dt_end)
+
+def merge_output(datadir, rsfn, pattern, merge_params):
+    """ The expected Radials_qcd output path for merge source rsfn, or None """
+    parsed = parse_lluv_filename(rsfn)
+    lluvtype = lluvtype_for('Radials', pattern)
+    if parsed is None or lluvtype is None:
+        return None
+    site, _, dt = parsed
+    dt = dt - datetime.timedelta(minutes=merge_params['expected_offset'])
+    fn = 'RDL%s_%s_%s.ruv' % (lluvtype, site, dt.strftime('%Y_%m_%d_%H%M'))
+    return os.path.join(datadir, 'Radials_qcd', pattern, fn)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+#
+""" Memory high-water marks of production runs (qccodar --memory)
+
+A MemoryTracker set with metrics.set_memory() measures the resident
+memory (RSS) of the process around each call of an instrumented stage
+(see qccodar.metrics): at the start and end of the call and the peak
+in between, sampled by a thread every few milliseconds.  The growth
+of the peak over the start of the call is what the call (stacking the
+window, copies of the thresholds, ...) needed on top of what was
+already held.  The calls of process_file (within do_qc in serial
+runs) give the figures per RadialMetric file.  When a metrics sink is
+set, rss_peak_mb and rss_growth_mb are added to the records of the
+calls.
+
+RSS is of the whole process, so when calls run at the same time in
+threads (--threads, the taskgraph executor) they count each other's
+memory.  Batch-mode worker processes are each tracked on their own.
+
+At the end of the run finish() writes a line of JSON per call and a
+report of the peak growth per stage and the calls with the largest:
+
+  DATADIR/.qccodar/PATTERN/memory.jsonl
+  DATADIR/.qccodar/PATTERN/memory.txt
+
+"""
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import resource
+import threading
+
+from . import metrics
+from .locks import makedirs
+
+MB = 1048576.
+
+def rss():
+    """ Resident memory (bytes) of this process now, or its peak if unknown """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, IndexError, ValueError):
+        return max_rss()
+
+def max_rss():
+    """ Peak resident memory (bytes) of this process so far """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on Mac OS X
+    return maxrss if sys.platform == 'darwin' else maxrss*1024
+
+class MemoryTracker(object):
+    """RSS at the start, end and peak of calls of instrumented stages.
+
+    Parameters
+    ----------
+    outdir : string
+       Where memory.jsonl and memory.txt are written
+    interval : float
+       Seconds between samples of RSS during calls
+    top : int
+       The number of calls in the report
+    """
+    def __init__(self, outdir, interval=0.005, top=10):
+        self.outdir = outdir
+        self.interval = interval
+        self.top = int(top)
+        self.rundir = os.path.join(outdir, 'memory.%d.%d' % (int(time.time()), os.getpid()))
+        self._lock = threading.Lock()
+        self._open = {}
+        self._count = 0
+        self._pid = None
+        self._local = threading.local()
+
+    def _start(self):
+        # one sampler thread per process, forked workers start their own
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._open = {}
+        sampler = threading.Thread(target=self._sampler, args=(self._pid,))
+        sampler.daemon = True
+        sampler.start()
+
+    def _sampler(self, pid):
+        while self._pid == pid:
+            now = rss()
+            with self._lock:
+                for frame in self._open.values():
+                    if now > frame['rss_peak']:
+                        frame['rss_peak'] = now
+            time.sleep(self.interval)
+
+    def run(self, stage, func, args, kwargs):
+        """ Call func(*args, **kwargs), recording RSS of the call """
+        self._start()
+        # inner stages are of the file of the call they are in
+        files = self._local.__dict__.setdefault('files', [])
+        files.append(metrics.file_of(args) or (files[-1] if files else None))
+        start = rss()
+        frame = {'rss_peak' : start}
+        with self._lock:
+            self._count += 1
+            key = self._count
+            self._open[key] = frame
+        try:
+            return func(*args, **kwargs)
+        finally:
+            end = rss()
+            with self._lock:
+                del self._open[key]
+            peak = max(frame['rss_peak'], end)
+            record = {'stage' : stage, 'file' : files.pop(), 'pid' : os.getpid(),
+                      'rss_start' : start, 'rss_end' : end, 'rss_peak' : peak,
+                      'rss_growth' : peak - start}
+            metrics.add(rss_peak_mb=round(peak/MB, 2), rss_growth_mb=round((peak-start)/MB, 2))
+            makedirs(self.rundir)
+            with open(os.path.join(self.rundir, 'memory.%d.jsonl' % os.getpid()), 'a') as f:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def calls(self):
+        """ Records of the calls tracked so far in this run, in all processes """
+        records = []
+        for fn in sorted(glob.glob(os.path.join(self.rundir, '*.jsonl'))):
+            with open(fn) as f:
+                records.extend(json.loads(line) for line in f)
+        return records
+
+    def finish(self):
+        """ Write memory.jsonl and the report memory.txt of the run
+
+        Returns the filename of the report, None if no call was tracked.
+        """
+        self._pid = None
+        records = self.calls()
+        shutil.rmtree(self.rundir, ignore_errors=True)
+        if not records:
+            return None
+        makedirs(self.outdir)
+        with open(os.path.join(self.outdir, 'memory.jsonl'), 'w') as f:
+            for record in records:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+
+        per_stage = {}
+        for r in records:
+            per_stage.setdefault(r['stage'], []).append(r['rss_growth'])
+        files = set(r['file'] for r in records if r['stage'] == 'process_file')
+        reportfn = os.path.join(self.outdir, 'memory.txt')
+        with open(reportfn, 'w') as f:
+            print >>f, 'qccodar memory -- %d calls, %d files qc\'d, peak RSS %.1f MB' % \
+                (len(records), len(files), max(r['rss_peak'] for r in records)/MB)
+            print >>f
+            print >>f, 'Peak RSS growth per stage (MB)'
+            print >>f, '  %-28s %6s %9s %9s' % ('stage', 'calls', 'max', 'mean')
+            for stage in sorted(per_stage, key=lambda k: -max(per_stage[k])):
+                growth = per_stage[stage]
+                print >>f, '  %-28s %6d %9.1f %9.1f' % (stage, len(growth), max(growth)/MB,
+                                                        sum(growth)/MB/len(growth))
+            print >>f
+            print >>f, 'Top %d calls by peak RSS growth (MB)' % self.top
+            for r in sorted(records, key=lambda r: -r['rss_growth'])[:self.top]:
+                print >>f, '  %-28s %-36s %9.1f  peak %9.1f' % (r['stage'], r['file'] or '',
+                                                               r['rss_growth']/MB, r['rss_peak']/MB)
+        return reportfn
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+#
+""" Per-stage timings and counts as structured records
+
+Functions of the qc (read_lluv_file, threshold_qc_all,
+weighted_velocities, generate_radialshort_array, write_output,
+run_LLUVMerger, process_file and do_qc) are decorated with
+instrumented().  When a sink is set, each call sends a record to it
+such as
+
+  {"stage": "read_lluv_file", "file": "RDLv_HATY_2013_11_05_0000.ruv",
+   "site": "HATY", "seconds": 0.41, "bytes_read": 1318223,
+   "rows_out": 8029, "time": "2013-11-05T00:31:02Z", "host": ..., "pid": ...}
+
+with the wall time of the call, rows in and out, range/bearing cells
+produced, bytes read and written and, for threshold_qc_all, the rows
+newly flagged by each test.  Without a sink (the default) the
+functions run as before, nothing is counted.
+
+A sink is any object with an emit(record) method, set with
+set_sink().  JSONLinesSink writes one JSON object per line to a file
+(qccodar --metrics FILE), TextfileSink (see qccodar.prometheus) counts
+them for Prometheus (qccodar --textfile FILE) and MultiSink sends them
+to several sinks.
+
+The instrumented calls can also be profiled, by setting a Profiler
+(see qccodar.profiling) with set_profiler(), and their memory tracked,
+by setting a MemoryTracker (see qccodar.memory) with set_memory().
+
+"""
+import os
+import sys
+import json
+import time
+import socket
+import datetime
+import functools
+import threading
+
+from .catalog import parse_lluv_filename
+
+# where records go, None for no metrics
+sink = None
+
+# runs instrumented calls under cProfile, None for no profiling
+profiler = None
+
+# tracks RSS of instrumented calls, None for no memory tracking
+memory = None
+
+_local = threading.local()
+
+class JSONLinesSink(object):
+    """ Writes each record as a line of JSON to fn ('-' for stdout)
+
+    The file is opened for appending in each process that writes to
+    it, so batch-mode worker processes can share it.
+    """
+    def __init__(self, fn):
+        self.fn = fn
+        self._f = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self._lock:
+            if self._pid != os.getpid():
+                self._f = sys.stdout if self.fn == '-' else open(self.fn, 'a')
+                self._pid = os.getpid()
+            self._f.write(line)
+            self._f.flush()
+
+    def close(self):
+        with self._lock:
+            if self._f is not None and self._f is not sys.stdout:
+                self._f.close()
+            self._f = None
+            self._pid = None
+
+
+class MultiSink(object):
+    """ Sends each record to all of sinks """
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def emit(self, record):
+        for s in self.sinks:
+            s.emit(record)
+
+    def close(self):
+        for s in self.sinks:
+            s.close()
+
+
+def set_sink(new):
+    """ Send records to new (None to stop), returns the previous sink """
+    global sink
+    previous, sink = sink, new
+    return previous
+
+def set_profiler(new):
+    """ Profile instrumented calls with new (None to stop), returns the previous profiler """
+    global profiler
+    previous, profiler = profiler, new
+    return previous
+
+def set_memory(new):
+    """ Track memory of instrumented calls with new (None to stop), returns the previous tracker """
+    global memory
+    previous, memory = memory, new
+    return previous
+
+def enabled():
+    return sink is not None
+
+def rows(d):
+    """ Number of rows of a table, 0 if empty """
+    return int(d.shape[0]) if d.size > 0 else 0
+
+def site_of(fn):
+    parsed = parse_lluv_filename(fn) if fn else None
+    return parsed[0] if parsed else None
+
+def file_of(args):
+    """ Basename of the first LLUV filename in args of a call, None if none """
+    for a in args:
+        if isinstance(a, basestring) and a.endswith('.ruv'):
+            return os.path.basename(a)
+    return None
+
+def add(**fields):
+    """ Add fields to the record of the instrumented call in progress in this thread """
+    records = getattr(_local, 'records', None)
+    if records:
+        records[-1][0].update(fields)
+
+def _hooked(hook, stage, func):
+    """ func called through hook.run() (a Profiler or MemoryTracker) for stage """
+    return lambda *args, **kwargs: hook.run(stage, func, args, kwargs)
+
+def instrumented(stage, counts=None, labels=None):
+    """Decorator sending a record of stage for each call when a sink is set.
+
+    counts(result, *args, **kwargs) is called with the result and the
+    arguments of the call and returns fields to add to the record.
+    The function itself can add fields with add().  labels(*args,
+    **kwargs) returns fields (e.g. site and pattern) that are set in
+    the record and in the records of instrumented calls made within.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            run = func
+            if profiler is not None:
+                run = _hooked(profiler, stage, run)
+            if memory is not None:
+                run = _hooked(memory, stage, run)
+            call = lambda: run(*args, **kwargs)
+            if sink is None:
+                return call()
+            records = _local.__dict__.setdefault('records', [])
+            context = dict(records[-1][1]) if records else {}
+            if labels is not None:
+                context.update(labels(*args, **kwargs))
+            record = dict(context, stage=stage)
+            records.append((record, context))
+            start = time.time()
+            try:
+                result = call()
+            except Exception, e:
+                record['error'] = '%s: %s' % (e.__class__.__name__, e)
+                raise
+            else:
+                record['seconds'] = time.time() - start
+                if counts is not None:
+                    record.update(counts(result, *args, **kwargs))
+            finally:
+                records.pop()
+                record.setdefault('seconds', time.time() - start)
+                record['time'] = datetime.datetime.utcfromtimestamp(start).strftime('%Y-%m-%dT%H:%M:%SZ')
+                record['host'] = socket.gethostname()
+                record['pid'] = os.getpid()
+                if sink is not None:
+                    sink.emit(record)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+#
+""" Pipelined executor for manual mode
+
+Runs the read, qc and merge steps of manual mode as stages connected
+by queues, so that reading upcoming RadialMetric files and running
+LLUVMerger overlap with the qc computation:
+
+  reader thread  -- reads RadialMetric files in time order, up to
+                    prefetch files ahead of the qc stage
+  qc (caller)    -- does the qc of each file from the files of its
+                    window already read and writes the RadialShorts_qcd
+                    output (qcutils.process_file()), then starts the
+                    merges whose RadialShorts_qcd sources are all written
+  merge threads  -- run LLUVMerger
+
+Each RadialMetric file is read once and kept only while a window
+still needs it.  Output files are the same as the serial manual mode.
+
+"""
+import os
+import datetime
+import threading
+import Queue
+import collections
+
+from .qcutils import read_lluv_file, read_or_error, find_files_to_merge, process_file, \
+    radialshort_filename, qc_params
+from .codarutils import run_LLUVMerger, merge_params
+from .catalog import lluvtype_for, parse_lluv_filename
+from .manifest import merge_sources
+
+debug = 1
+
+# marks the end of items put in a queue
+_done = object()
+
+def _is_merge_source(fn):
+    """ LLUVMerger is run with on-the-hour RadialShorts_qcd as source """
+    return os.path.basename(fn).endswith('00.ruv')
+
+def merge_plan(datadir, pattern, catalog, fns, skip_merge=None):
+    """ Which merges wait for which RadialShorts_qcd outputs of this run.
+
+    Returns (ready, pending, waiting) where ready are merge sources
+    with nothing to wait for, pending maps a merge source to the
+    set of outputs it waits for and waiting maps an output to the
+    merge sources waiting for it.
+    """
+    outputs = [radialshort_filename(datadir, os.path.basename(fn), pattern) for fn in fns]
+    outputs = [ofn for ofn in outputs if ofn]
+    # merge sources made in this run and those already in RadialShorts_qcd
+    existing = catalog.paths(lluvtype_for('RadialShorts', pattern), pattern)
+    sources = dict((os.path.basename(fn), fn) for fn in existing)
+    sources.update((os.path.basename(fn), fn) for fn in outputs)
+    sources = [sources[k] for k in sorted(sources) if _is_merge_source(k)]
+
+    span = datetime.timedelta(minutes=(merge_params['rs_num']-1)*merge_params['rs_output_interval'])
+    outtimes = collections.defaultdict(list)
+    for ofn in outputs:
+        site, lluvtype, dt = parse_lluv_filename(ofn)
+        outtimes[(site, lluvtype)].append((dt, ofn))
+
+    ready, pending, waiting = [], {}, collections.defaultdict(list)
+    for rsfn in sources:
+        site, lluvtype, dt_end = parse_lluv_filename(rsfn)
+        deps = set(ofn for dt, ofn in outtimes[(site, lluvtype)] if dt_end-span <= dt <= dt_end)
+        if deps:
+            pending[rsfn] = deps
+            for ofn in deps:
+                waiting[ofn].append(rsfn)
+        elif skip_merge is None or not skip_merge(rsfn):
+            ready.append(rsfn)
+    return ready, pending, waiting
+
+def output_written(ofn, pending, waiting):
+    """ Merge sources of merge_plan() that waited for ofn and for nothing else now """
+    ready = []
+    for rsfn in waiting.pop(ofn, []):
+        pending[rsfn].discard(ofn)
+        if not pending[rsfn]:
+            del pending[rsfn]
+            ready.append(rsfn)
+    return ready
+
+
+class Pipeline(object):
+    """Read, qc and merge stages of manual mode.
+
+    Parameters
+    ----------
+    datadir : string
+       The data directory
+    pattern : string
+       The pattern type (IdealPattern or MeasPattern)
+    catalog : FileCatalog
+       The catalogue of files in datadir
+    manifest : Manifest, optional
+       If given, the inputs of each output are recorded in it
+    prefetch : int
+       The number of RadialMetric files read ahead of the qc stage
+    merge_workers : int
+       The number of LLUVMerger processes run at the same time
+    source : ArchiveSource, optional
+       The archive the RadialMetric files are read from
+    """
+    def __init__(self, datadir, pattern, catalog, manifest=None, prefetch=4, merge_workers=2,
+                 source=None):
+        self.datadir = datadir
+        self.pattern = pattern
+        self.catalog = catalog
+        self.manifest = manifest
+        self.prefetch = max(int(prefetch), 1)
+        self.merge_workers = max(int(merge_workers), 1)
+        self.read = source.read_lluv_file if source is not None else read_lluv_file
+        self._lock = threading.Lock()  # guards catalog and manifest updates
+        self._errors = []
+
+    def _fail(self, e):
+        with self._lock:
+            self._errors.append(e)
+
+    def _reader(self, fns, read_q):
+        try:
+            for fn in fns:
+                if self._errors:
+                    break
+                read_q.put((fn, read_or_error(self.read, fn)))
+        finally:
+            read_q.put(_done)
+
+    def _merger(self, merge_q):
+        while True:
+            rsfn = merge_q.get()
+            if rsfn is _done:
+                break
+            if self._errors:
+                continue
+            try:
+                print '... merge input: %s' % rsfn
+                ofn = run_LLUVMerger(self.datadir, os.path.basename(rsfn), self.pattern)
+                print '... merge output: %s' % ofn
+                if ofn:
+                    with self._lock:
+                        self.catalog.add(ofn, self.pattern)
+                        if self.manifest is not None:
+                            self.manifest.record(ofn, merge_sources(self.catalog, rsfn, self.pattern, merge_params),
+                                                 merge_params, 'Radials')
+            except Exception, e:
+                self._fail(e)
+
+    def _merge_plan(self, fns, skip_merge=None):
+        return merge_plan(self.datadir, self.pattern, self.catalog, fns, skip_merge)
+
+    def run(self, fns, skip_merge=None):
+        """ Run qc and merge for the RadialMetric files fns (in time order) 
+
+        Merges of sources that do not depend on the output of fns are
+        not run if skip_merge(rsfn) is True.
+        """
+        read_q = Queue.Queue(maxsize=self.prefetch)
+        merge_q = Queue.Queue()
+
+        ready, pending, waiting = self._merge_plan(fns, skip_merge)
+        for rsfn in ready:
+            merge_q.put(rsfn)
+
+        threads = [threading.Thread(target=self._reader, args=(fns, read_q))]
+        threads.extend(threading.Thread(target=self._merger, args=(merge_q,)) \
+                       for i in range(self.merge_workers))
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        position = dict((fn, i) for i, fn in enumerate(fns))
+        loaded = collections.OrderedDict()  # fn -> read_lluv_file() output in read order
+        reading = True
+        try:
+            for i, ifn in enumerate(fns):
+                window = find_files_to_merge(ifn, qc_params['numfiles'], qc_params['sample_interval'],
+                                             catalog=self.catalog, patterntype=self.pattern)
+                # wait for the reader until the whole window is loaded,
+                # files outside of fns are read here when needed
+                while reading and not all(xfn in loaded for xfn in window if xfn in position):
+                    item = read_q.get()
+                    if item is _done:
+                        reading = False
+                        break
+                    fn, data = item
+                    loaded[fn] = data
+                if self._errors:
+                    break
+
+                print '... input: %s' % ifn
+                others = [(xfn, loaded[xfn] if xfn in position else read_or_error(self.read, xfn))
+                          for xfn in window if xfn != ifn]
+                ofn = process_file(self.datadir, ifn, self.pattern, loaded[ifn], others,
+                                   self.catalog, self.manifest, window, lock=self._lock)
+                if ofn is not None:
+                    print '... output: %s' % ofn
+                    # start merges that were waiting for this output
+                    for rsfn in output_written(ofn, pending, waiting):
+                        merge_q.put(rsfn)
+
+                # free files that no later window needs
+                if i+1 < len(fns):
+                    nextwindow = find_files_to_merge(fns[i+1], qc_params['numfiles'], qc_params['sample_interval'],
+                                                     catalog=self.catalog, patterntype=self.pattern)
+                    lo = min([position[xfn] for xfn in nextwindow if xfn in position] + [i+1])
+                    while loaded and position[next(iter(loaded))] < lo:
+                        loaded.popitem(last=False)
+        except Exception, e:
+            self._fail(e)
+        finally:
+            # merges whose sources were not all written (e.g. empty window) run now
+            for rsfn in sorted(pending):
+                merge_q.put(rsfn)
+            for i in range(self.merge_workers):
+                merge_q.put(_done)
+            # let the reader finish if it is blocked on a full queue
+            while reading:
+                if read_q.get() is _done:
+                    reading = False
+            for t in threads:
+                t.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+def run_pipeline(datadir, pattern, catalog, fns, manifest=None, prefetch=4, merge_workers=2,
+                 skip_merge=None, source=None):
+    """ Run manual mode qc and merge of fns as a pipeline """
+    Pipeline(datadir, pattern, catalog, manifest, prefetch, merge_workers, source).run(fns, skip_merge)
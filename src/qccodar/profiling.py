@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#
+""" Profiling of production runs (qccodar --profile)
+
+A Profiler set with metrics.set_profiler() runs calls of the
+instrumented stages (see qccodar.metrics), by default do_qc and
+process_file (the qc of one file, in any executor) and run_LLUVMerger,
+under cProfile.  A stage called within a profiled call is profiled as
+part of it, so serial runs profile do_qc and the other executors
+process_file.  A share rate of the calls is profiled, every 1/rate-th
+call so that a long run can be profiled at little cost.  The profile of each call is saved in a
+directory of the run, which works across batch-mode worker processes.
+
+At the end of the run finish() merges the profiles into one pstats
+file and writes a report of the top functions by cumulative and by
+own time next to it:
+
+  DATADIR/.qccodar/PATTERN/profile.pstats
+  DATADIR/.qccodar/PATTERN/profile.txt
+
+"""
+import os
+import glob
+import time
+import shutil
+import pstats
+import cProfile
+import threading
+from StringIO import StringIO
+
+from . import metrics
+from .locks import makedirs
+
+# stages profiled, one call of do_qc or process_file per RadialMetric file
+default_stages = ('do_qc', 'process_file', 'run_LLUVMerger')
+
+class Profiler(object):
+    """cProfile of sampled calls of stages, merged at the end of the run.
+
+    Parameters
+    ----------
+    outdir : string
+       Where profile.pstats and profile.txt are written
+    rate : float
+       The share of calls profiled (1.0 for all)
+    top : int
+       The number of functions in the report
+    stages : sequence of string
+       The instrumented stages profiled
+    """
+    def __init__(self, outdir, rate=1.0, top=30, stages=default_stages):
+        self.outdir = outdir
+        self.rate = min(max(float(rate), 0.0), 1.0)
+        self.top = int(top)
+        self.stages = set(stages)
+        self.rundir = os.path.join(outdir, 'profile.%d.%d' % (int(time.time()), os.getpid()))
+        self.calls = 0
+        self.profiled = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def sample(self):
+        """ True if the next call is profiled, every 1/rate-th call """
+        with self._lock:
+            n = self.calls
+            self.calls += 1
+        return int((n+1)*self.rate) > int(n*self.rate)
+
+    def run(self, stage, func, args, kwargs):
+        """ Call func(*args, **kwargs), under cProfile if stage is sampled """
+        # one call of a stage at a time in a thread, nested stages are part of the outer one
+        if stage not in self.stages or getattr(self._local, 'active', False):
+            return func(*args, **kwargs)
+        self._local.active = True
+        try:
+            if not self.sample():
+                return func(*args, **kwargs)
+            prof = cProfile.Profile()
+            try:
+                return prof.runcall(func, *args, **kwargs)
+            finally:
+                self._dump(stage, args, prof)
+        finally:
+            self._local.active = False
+
+    def _dump(self, stage, args, prof):
+        with self._lock:
+            self.profiled += 1
+            n = self.profiled
+        makedirs(self.rundir)
+        fn = '%s.%s.%d.%d.prof' % (stage, metrics.file_of(args) or 'call', os.getpid(), n)
+        prof.dump_stats(os.path.join(self.rundir, fn))
+
+    def finish(self):
+        """ Merge the profiles of the run into profile.pstats and write the report
+
+        Returns the filename of the report, None if nothing was profiled.
+        """
+        fns = sorted(glob.glob(os.path.join(self.rundir, '*.prof')))
+        if not fns:
+            shutil.rmtree(self.rundir, ignore_errors=True)
+            return None
+        report = StringIO()
+        stats = pstats.Stats(fns[0], stream=report)
+        for fn in fns[1:]:
+            stats.add(fn)
+        makedirs(self.outdir)
+        statsfn = os.path.join(self.outdir, 'profile.pstats')
+        stats.dump_stats(statsfn)
+
+        per_stage = {}
+        for fn in fns:
+            stage = os.path.basename(fn).split('.')[0]
+            per_stage[stage] = per_stage.get(stage, 0) + 1
+        print >>report, 'qccodar profile -- %s' % ', '.join('%d %s calls' % (per_stage[k], k)
+                                                            for k in sorted(per_stage))
+        print >>report, 'sampled at rate %g, merged pstats in %s' % (self.rate, statsfn)
+        print >>report
+        print >>report, 'Top %d functions by cumulative time' % self.top
+        stats.sort_stats('cumulative').print_stats(self.top)
+        print >>report, 'Top %d functions by own time' % self.top
+        stats.sort_stats('tottime').print_stats(self.top)
+
+        reportfn = os.path.join(self.outdir, 'profile.txt')
+        f = open(reportfn, 'w')
+        try:
+            f.write(report.getvalue())
+        finally:
+            f.close()
+        shutil.rmtree(self.rundir, ignore_errors=True)
+        return reportfn
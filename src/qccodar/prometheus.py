@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+#
+""" Prometheus metrics for node_exporter's textfile collector (qccodar --textfile FILE)
+
+TextfileSink is a metrics sink (see qccodar.metrics) that counts the
+records of the qc and merges and writes the counts in the Prometheus
+text format to FILE, e.g. in the --collector.textfile.directory of
+node_exporter as /var/lib/node_exporter/textfile/qccodar.prom.  All
+metrics are labelled by site and pattern:
+
+  qccodar_files_processed_total            RadialMetric files qc'd
+  qccodar_qc_failures_total                qc of files that raised an error
+  qccodar_merges_total                     Radials merged by LLUVMerger
+  qccodar_merge_failures_total             merges that failed or made no output
+  qccodar_cells_flagged_total{test}        rows flagged by each threshold test
+  qccodar_stage_seconds{stage}             histogram of the time of each step
+  qccodar_newest_output_timestamp_seconds{type}
+                                           data time of the newest output
+  qccodar_output_lag_seconds{type}         time from the data time of the newest
+                                           output until it was written
+  qccodar_last_event_timestamp_seconds     when a file or merge was last done
+
+Counters carry on from the values in FILE, so they keep counting over
+cron runs of qccodar auto, and processes writing to FILE (batch-mode
+workers) add to each other's counts.  After each file qc'd and each
+merge, and at close(), the counts since the last write are added to
+those in FILE under a lock and FILE is replaced atomically, so
+node_exporter never reads a file half written.
+
+"""
+import os
+import re
+import time
+import calendar
+import threading
+
+from .catalog import parse_lluv_filename
+from .locks import FileLock
+from .manifest import atomic_write
+
+# upper bounds (seconds) of the buckets of qccodar_stage_seconds
+buckets = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# stages after which FILE is written, process_file is the qc of a file in all executors
+events = ('process_file', 'run_LLUVMerger')
+
+# (name, type, help) of the metric families, in the order written
+families = [
+    ('qccodar_files_processed_total', 'counter', "RadialMetric files qc'd"),
+    ('qccodar_qc_failures_total', 'counter', 'qc of RadialMetric files that failed'),
+    ('qccodar_merges_total', 'counter', 'Radials merged by LLUVMerger'),
+    ('qccodar_merge_failures_total', 'counter', 'LLUVMerger runs that failed or made no output'),
+    ('qccodar_cells_flagged_total', 'counter', 'Rows flagged by each threshold test'),
+    ('qccodar_stage_seconds', 'histogram', 'Time of each step of qc and merging'),
+    ('qccodar_newest_output_timestamp_seconds', 'gauge', 'Data time of the newest output file'),
+    ('qccodar_output_lag_seconds', 'gauge', 'Time from data time of the newest output until it was written'),
+    ('qccodar_last_event_timestamp_seconds', 'gauge', 'Time a file or merge was last done'),
+]
+
+_sample = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+_label = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _unescape(value):
+    return re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), value)
+
+def _number(value):
+    return '%d' % value if value == int(value) and abs(value) < 1e15 else repr(float(value))
+
+def read_textfile(fn):
+    """ Samples in Prometheus text file fn as {(name, ((label, value), ...)) : value} """
+    samples = {}
+    if not os.path.exists(fn):
+        return samples
+    with open(fn) as f:
+        for line in f:
+            m = _sample.match(line.strip())
+            if not m or line.startswith('#'):
+                continue
+            labels = tuple(sorted((k, _unescape(v)) for k, v in _label.findall(m.group(2) or '')))
+            samples[(m.group(1), labels)] = float(m.group(3))
+    return samples
+
+def format_textfile(samples):
+    """ Prometheus text of samples as returned by read_textfile() """
+    def family(name):
+        for fname, ftype, fhelp in families:
+            if name == fname or (ftype == 'histogram' and name.startswith(fname+'_')):
+                return fname
+        return name
+    def order(key):
+        name, labels = key
+        le = dict(labels).get('le')
+        return ([l for l in labels if l[0] != 'le'], name,
+                float('inf') if le == '+Inf' else float(le or 0))
+
+    byfamily = {}
+    for key in samples:
+        byfamily.setdefault(family(key[0]), []).append(key)
+    known = [f[0] for f in families]
+    lines = []
+    for name in known + sorted(set(byfamily) - set(known)):
+        if name not in byfamily:
+            continue
+        if name in known:
+            fname, ftype, fhelp = families[known.index(name)]
+            lines.append('# HELP %s %s' % (fname, fhelp))
+            lines.append('# TYPE %s %s' % (fname, ftype))
+        for key in sorted(byfamily[name], key=order):
+            labels = ','.join('%s="%s"' % (k, _escape(v)) for k, v in key[1])
+            lines.append('%s{%s} %s' % (key[0], labels, _number(samples[key])))
+    return '\n'.join(lines) + '\n'
+
+
+class TextfileSink(object):
+    """Counts of metrics records written to a Prometheus text file.
+
+    Parameters
+    ----------
+    fn : string
+       The text file, *.prom in node_exporter's textfile directory
+    pattern : string, optional
+       The pattern label of records without one
+    """
+    def __init__(self, fn, pattern=None):
+        self.fn = fn
+        self.pattern = pattern
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._newest = {}
+        self._last = {}
+
+    def _add(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels)))
+        self._counts[key] = self._counts.get(key, 0) + value
+
+    def _output(self, labels, kind, ofn):
+        parsed = parse_lluv_filename(ofn)
+        if parsed is None:
+            return
+        datatime = calendar.timegm(parsed[2].timetuple())
+        key = tuple(sorted(labels + [('type', kind)]))
+        if datatime >= self._newest.get(key, (0, 0))[0]:
+            self._newest[key] = (datatime, time.time() - datatime)
+
+    def emit(self, record):
+        stage = record['stage']
+        labels = [('site', record.get('site') or 'unknown'),
+                  ('pattern', record.get('pattern') or self.pattern or 'unknown')]
+        with self._lock:
+            seconds = record.get('seconds', 0.0)
+            for le in buckets:
+                if seconds <= le:
+                    self._add('qccodar_stage_seconds_bucket', labels + [('stage', stage), ('le', _number(le))])
+            self._add('qccodar_stage_seconds_bucket', labels + [('stage', stage), ('le', '+Inf')])
+            self._add('qccodar_stage_seconds_sum', labels + [('stage', stage)], seconds)
+            self._add('qccodar_stage_seconds_count', labels + [('stage', stage)])
+            for k, v in record.items():
+                if k.startswith('flagged_'):
+                    self._add('qccodar_cells_flagged_total', labels + [('test', k[len('flagged_'):])], v)
+            if stage == 'process_file':
+                if 'error' in record:
+                    self._add('qccodar_qc_failures_total', labels)
+                elif record.get('output'):
+                    self._add('qccodar_files_processed_total', labels)
+                    self._output(labels, 'RadialShorts', record['output'])
+            elif stage == 'run_LLUVMerger':
+                if 'error' in record or not record.get('output'):
+                    self._add('qccodar_merge_failures_total', labels)
+                else:
+                    self._add('qccodar_merges_total', labels)
+                    self._output(labels, 'Radials', record['output'])
+            if stage in events:
+                self._last[tuple(sorted(labels))] = time.time()
+        if stage in events:
+            self.flush()
+
+    def flush(self):
+        """ Add the counts since the last flush to those in the file and write it """
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            newest, self._newest = self._newest, {}
+            last, self._last = self._last, {}
+        if not (counts or newest or last):
+            return
+        with FileLock(self.fn + '.lock'):
+            samples = read_textfile(self.fn)
+            for key, value in counts.items():
+                samples[key] = samples.get(key, 0) + value
+            for labels, (datatime, lag) in newest.items():
+                key = ('qccodar_newest_output_timestamp_seconds', labels)
+                if datatime >= samples.get(key, 0):
+                    samples[key] = datatime
+                    samples[('qccodar_output_lag_seconds', labels)] = lag
+            for labels, t in last.items():
+                key = ('qccodar_last_event_timestamp_seconds', labels)
+                samples[key] = max(t, samples.get(key, 0))
+            atomic_write(self.fn, format_textfile(samples))
+
+    def close(self):
+        self.flush()
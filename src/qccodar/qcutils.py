@@ -25,15 +25,37 @@ import os
 import re
 import fnmatch
 import datetime
+from multiprocessing.pool import ThreadPool
 
 import numpy
 numpy.set_printoptions(suppress=True)
 
-# 
-from .codarutils import *
+# LLUV reading, writing and output table functions (also used by
+# modules and tests doing from qcutils import *)
+from .codarutils import load_data, write_output, read_lluv_file, parse_lluv_lines, \
+    get_radialmetric_foldername, get_columns, generate_radialshort_array, \
+    generate_radialshort_header, unique_rows, cell_intersect, compass2uv, \
+    run_LLUVMerger, merge_params
+from .catalog import filt_datetime
+from . import metrics
+from .metrics import instrumented, rows, site_of
 
 debug = 1
 
+# settings used by do_qc() for threshold tests, and averaging over time
+# (numfiles, sample_interval in minutes) and bearing (numdegrees)
+qc_params = {'numfiles' : 3,
+             'sample_interval' : 30,
+             'thresholds' : [5.0, 50.0, 5.0, 5.0],
+             'numdegrees' : 3,
+             'weight_parameter' : 'MP',
+             'numpoints' : 3,
+}
+
+# threads for averaging the range cells of one window in do_qc(), see
+# weighted_velocities() (not in qc_params as output does not depend on it)
+qc_threads = 1
+
 def _commonly_assigned_columns():
     """
     Commonly assigned CODAR RadialMetric columns
@@ -137,6 +159,11 @@ def threshold_qc_loop_snr(d, types_str, threshold=5.0):
     d4[bad, VFLG] = d[bad,VFLG]+(1<<3)
     return d4
 
+def _threshold_counts(dall, d, types_str, *args, **kwargs):
+    VFLG = get_columns(types_str)['VFLG']
+    return {'rows_in' : rows(d), 'rows_flagged' : int((dall[:,VFLG] != d[:,VFLG]).sum())}
+
+@instrumented('threshold_qc_all', _threshold_counts)
 def threshold_qc_all(d, types_str, thresholds=[5.0, 50.0, 5.0, 5.0]):
     """Combine all three threshold tests
 
@@ -147,10 +174,18 @@ def threshold_qc_all(d, types_str, thresholds=[5.0, 50.0, 5.0, 5.0]):
     # if dict what key to use
     # if list how know the correct order for tests
     # 
-    dall = threshold_qc_doa_peak_power(d, types_str, thresholds[0])
-    dall = threshold_qc_doa_half_power_width(dall, types_str, thresholds[1])
-    dall = threshold_qc_monopole_snr(dall, types_str, thresholds[2])
-    dall = threshold_qc_loop_snr(dall, types_str, thresholds[3])
+    tests = [('doa_peak_power', threshold_qc_doa_peak_power),
+             ('doa_half_power_width', threshold_qc_doa_half_power_width),
+             ('monopole_snr', threshold_qc_monopole_snr),
+             ('loop_snr', threshold_qc_loop_snr)]
+    dall = d
+    for (name, test), threshold in zip(tests, thresholds):
+        dtest = test(dall, types_str, threshold)
+        if metrics.enabled():
+            # rows flagged by each test, for metrics
+            VFLG = get_columns(types_str)['VFLG']
+            metrics.add(**{'flagged_'+name : int((dtest[:,VFLG] != dall[:,VFLG]).sum())})
+        dall = dtest
     
     return dall
 
@@ -175,7 +210,9 @@ def threshold_rsd_numpoints(rsd, rstypes_str, numpoints=1):
     return rsd1
    
 
-def weighted_velocities(d, types_str, numdegrees=3, weight_parameter='MP'):
+@instrumented('weighted_velocities', lambda result, d, *args, **kw: \
+              {'rows_in' : rows(d), 'cells_out' : rows(result[0])})
+def weighted_velocities(d, types_str, numdegrees=3, weight_parameter='MP', threads=1):
     """Calculates weighted average of radial velocities (VELO) at bearing and range.
 
     The weighted average of velocities found at given range and
@@ -198,6 +235,11 @@ def weighted_velocities(d, types_str, numdegrees=3, weight_parameter='MP'):
           If 1 deg, velocities from window of 1 deg will be averaged.
           If 3 deg, velocities from a window of 3 degrees will be averaged. This is the default.
           If 5 deg, velocities from a window of 5 degrees will be averaged.
+    threads: int, optional (default 1)
+       If more than 1, the data are partitioned by range cell (SPRC), as
+       each range cell is averaged on its own, and the range cells are
+       averaged on a pool of threads.  The output is the same, in the
+       same order.
 
     Returns
     -------
@@ -227,6 +269,35 @@ def weighted_velocities(d, types_str, numdegrees=3, weight_parameter='MP'):
     allranges = numpy.unique(ud[:,0])
     ud = numpy.array([[r,b] for r in allranges for b in allbearings])
 
+    if threads > 1:
+        # rows of ud are ordered by range, so the blocks of each range
+        # cell stack up in the same order as in the serial case
+        sprc = d[:,c['SPRC']]
+        def average_range(rngcell):
+            return _weighted_cells(d[sprc==rngcell], c, ud[ud[:,0]==rngcell], offset,
+                                   weight_parameter, xc)
+        pool = ThreadPool(threads)
+        try:
+            xd = numpy.vstack(pool.map(average_range, allranges))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        xd = _weighted_cells(d, c, ud, offset, weight_parameter, xc)
+
+    # delete extra lines (nan) not filled above
+    wherenan = numpy.where(numpy.isnan(xd[:,xc['VFLG']]))[0]
+    xd = numpy.delete(xd, wherenan, axis=0)
+
+    return xd, xtypes_str
+
+
+def _weighted_cells(d, c, ud, offset, weight_parameter, xc):
+    """ Weighted average of velocities of data d for each (range, bearing) cell in ud
+
+    Returns array with a row for each cell of ud, columns xc, and
+    rows of cells with no good data all nan.
+    """
     #
     nrows, _ = ud.shape
     ncols = len(xc)
@@ -279,11 +350,7 @@ def weighted_velocities(d, types_str, numdegrees=3, weight_parameter='MP'):
         xd[irow,xc['EDVC']] = VELO.size # EDVC Velocity Count 
         xd[irow,xc['ERSC']] = VELO.size # ERSC Spatial Count
                 
-    # delete extra lines (nan) not filled above
-    wherenan = numpy.where(numpy.isnan(xd[:,xc['VFLG']]))[0]
-    xd = numpy.delete(xd, wherenan, axis=0)
-
-    return xd, xtypes_str
+    return xd
 
 
 def recursive_glob(treeroot, pattern):
@@ -316,69 +383,7 @@ def recursive_glob(treeroot, pattern):
         results.extend(os.path.join(base, f) for f in goodfiles) 
     return results 
 
-def filt_datetime(input_string, pattern=None):
-    """Attempts to filter date and time from input string based on regex pattern.
-    
-    Default pattern follows the template, YYYY(-)MM(-)DD(-)(hh(:)(mm(:)(ss)))
-    with minimum of YYYY MM and DD (date) supplied in descending order to 
-    return its datetime object, otherwise returns None.
-
-    Typical matches include, YYYYMMDD-hhmmss, YYYY-MM-DD-hh:mm:ss All
-    the following will produce the corresponding datetime object. Any
-    2-digit year will return None.
-
-    Requires date with all three (year, month, day) in decreasing
-    order as integers. Time is optional.
-
-    >>> filt_datetime('RDLv_HATY_2013_11_05_000000.ruv')
-    datetime.datetime(2013, 11, 5, 0, 0)
-
-    >>> filt_datetime('RDLv_HATY_2013_11_05_0000.ruv')
-    datetime.datetime(2013, 11, 5, 0, 0)
-    
-    >>> filt_datetime('RDLv_HATY_2013_11_05_00.ruv')
-    datetime.datetime(2013, 11, 5, 0, 0)
-    
-    >>> filt_datetime('RDLv_HATY_2013_11_05.ruv')
-    datetime.datetime(2013, 11, 5, 0, 0)
-    
-    # NOTE: returns None
-    >>> filt_datetime('RDLv_HATY_13_11_05.ruv')
-    
-    >>> filt_datetime('RDLv_HATY_2013-11-05T00:00:00.ruv')
-    datetime.datetime(2013, 11, 5, 0, 0)
-
-    """
-
-    #  the default pattern for a typical codar time stamp format
-    if not pattern:
-        pattern = r"""
-        # YYYY(-)MM(-)DD(-)(hh(:)(mm(:)(ss)))
-        (\d{4})           # 4-digit YEAR 
-        \D?               # optional 1 character non-digit separator (e.g. ' ' or '-')
-        (\d{2})           # 2-digit MONTH 
-        \D?               # optional 1 character non-digit separator
-        (\d{2})           # 2-digit DAY 
-        \D?               # optional 1 character non-digit separator (e.g. ' ' or 'T')
-        (\d{2})?          # optional 2-digit HOUR 
-        \D?               # optional 1 character non-digit separator (e.g. ' ' or ':')
-        (\d{2})?          # optional 2-digit MINUTE 
-        \D?               # optional 1 character non-digit separator (e.g. ' ' or ':')
-        (\d{2})?          # optional 2-digit SECOND
-        """
-    #         
-    p = re.compile(pattern, re.VERBOSE)
-    m = p.search(input_string) 
-    # m.groups() # should be ('2013', '11', '05', '00', '00', None) for 'RDLv_HATY_2013_11_05_0000.ruv'
-    if m:
-        values = [int(yi) for yi in m.groups() if yi is not None] # [2013, 11, 5, 0, 0]
-        # datetime.datetime(*v) requires mininum of year, month, day
-        dt = datetime.datetime(*values) # datetime.datetime(2013, 11, 5, 0, 0)
-    else:
-        dt = None
-    return dt
-
-def find_files_to_merge(ifn, numfiles=3, sample_interval=30):
+def find_files_to_merge(ifn, numfiles=3, sample_interval=30, catalog=None, patterntype=None):
     """Finds the files that will be used in averaging in addition to ifn,
     based on sample_interval and numfiles to average over.
  
@@ -391,6 +396,12 @@ def find_files_to_merge(ifn, numfiles=3, sample_interval=30):
     sample_interval : int
        The sample interval in minutes. For radialmetric should be the
        same as CODAR's output rate.
+    catalog : FileCatalog, optional
+       If given, the window is looked up in the catalogue instead of
+       globbing the directory of ifn.
+    patterntype : string, optional
+       The pattern type of ifn in the catalogue (default is the name
+       of the directory of ifn).
 
     Return
     ------
@@ -399,6 +410,14 @@ def find_files_to_merge(ifn, numfiles=3, sample_interval=30):
 
     """
 
+    if catalog is not None:
+        if patterntype is None:
+            patterntype = os.path.basename(os.path.dirname(ifn))
+        files = catalog.window(ifn, patterntype, numfiles, sample_interval)
+        assert len(files) <= numfiles, \
+            "Some duplicate files found since number found > numfiles needed "
+        return files
+
     indir = os.path.dirname(ifn)
     rdlstr = re.match(r'RDL[vw]', os.path.basename(ifn)).group()
     all_files = recursive_glob(os.path.join(indir), rdlstr+'*.ruv')
@@ -418,18 +437,8 @@ def find_files_to_merge(ifn, numfiles=3, sample_interval=30):
         "Some duplicate files found since number found > numfiles needed "
     return files           
 
-def do_qc(datadir, fn, patterntype):
-    """ Do qc and then average over 3 sample_intervals (time), 3 degrees of bearing.
-    """
-    # read in the data
-    rmfoldername = get_radialmetric_foldername(datadir)
-    ifn = os.path.join(datadir, rmfoldername, patterntype, fn)
-    d, types_str, header, footer = read_lluv_file(ifn)
-
-    # test_str = 'testall_mp_weight_npts1'
-    # test_str = 'testall_mp_weight_npts3'
-    # test_str = 'qcd'
-
+def radialshort_filename(datadir, fn, patterntype):
+    """ Output path of radialshort data for radialmetric filename fn """
     # determine output directory and filename for radialshort data
     outdir = os.path.join(datadir, 'RadialShorts_qcd', patterntype)
     if patterntype=='IdealPattern':
@@ -441,39 +450,57 @@ def do_qc(datadir, fn, patterntype):
         return None
     # substitute RDLv(w) for RDLx(y) in filename
     rsdfn = re.sub(r'RDL[vw]', 'RDL'+lluvtype, fn)
-    ofn = os.path.join(outdir, rsdfn)
+    return os.path.join(outdir, rsdfn)
 
-    # handle empty radialmetric by outputting an empty radialshorts file
-    # do not try to merge other files to fill empty radialmetric for this timestampe
-    if d.size == 0:
-        rsd, rsdtypes_str = generate_radialshort_array(d, types_str, header)
-        rsdheader = generate_radialshort_header(rsd, rsdtypes_str, header)
-        rsdfooter = footer
-        # 
-        write_output(ofn, rsdheader, rsd, rsdfooter)
-        return ofn
-
-    # read in other data to use in averaging over time
-    ixfns = find_files_to_merge(ifn, numfiles=3, sample_interval=30)
-    for xfn in ixfns:
-        if xfn == ifn:
-            continue
-        d1, types_str1, _, _ = read_lluv_file(xfn)
+def stack_window(d, types_str, others):
+    """ Append the data of other files in the time window to d
+
+    Parameters
+    ----------
+    d : ndarray
+       The data of the target file
+    types_str : string
+       The column types of d
+    others : list of (xfn, (d1, types_str1, header1, footer1)) 
+       The filename and read_lluv_file() output of the other files in window
+
+    Returns
+    -------
+    d : ndarray
+       The data with rows of other files with same columns appended
+    """
+    for xfn, (d1, types_str1, _, _) in others:
         if len(d.shape) == len(d1.shape) == 2:
             if (d.shape[1] == d1.shape[1]) & (types_str == types_str1):
                 # if same number and order of columns as d, then append the data d
                 if debug:
                     print '... ... include: %s' % xfn
                 d = numpy.vstack((d,d1))
+    return d
 
-    # (1) do threshold qc on radialmetric
-    d = threshold_qc_all(d, types_str, thresholds=[5.0, 50.0, 5.0, 5.0])
-   
-    # (2) do weighted averaging of good 
-    xd, xtypes_str = weighted_velocities(d, types_str, numdegrees=3, weight_parameter='MP')
+def qc_radialshort(d, types_str, header, footer, params=None):
+    """ Threshold qc and average radialmetric data into radialshort data.
+
+    Returns (rsdheader, rsd, rsdfooter) ready for write_output().  If
+    d is empty, the radialshort data is empty.
+    """
+    p = dict(qc_params)
+    if params:
+        p.update(params)
+
+    if d.size == 0:
+        xd, xtypes_str = d, types_str
+    else:
+        # (1) do threshold qc on radialmetric
+        d = threshold_qc_all(d, types_str, thresholds=p['thresholds'])
+
+        # (2) do weighted averaging of good 
+        xd, xtypes_str = weighted_velocities(d, types_str, numdegrees=p['numdegrees'],
+                                             weight_parameter=p['weight_parameter'],
+                                             threads=qc_threads)
 
-    # (3) require a minimum numpoints used in to form cell average
-    xd = threshold_rsd_numpoints(xd, xtypes_str, numpoints=3)
+        # (3) require a minimum numpoints used in to form cell average
+        xd = threshold_rsd_numpoints(xd, xtypes_str, numpoints=p['numpoints'])
 
     # create radialshort data, 
     rsd, rsdtypes_str = generate_radialshort_array(xd, xtypes_str, header)
@@ -482,10 +509,106 @@ def do_qc(datadir, fn, patterntype):
     rsdheader = generate_radialshort_header(rsd, rsdtypes_str, header)
     # not modifying the footer at this time
     rsdfooter = footer
-    # 
+    return rsdheader, rsd, rsdfooter
+
+def read_or_error(read, fn):
+    """ read(fn), or the IOError or EOFError it raised, raised in turn by process_file() """
+    try:
+        return read(fn)
+    except (IOError, EOFError), e:
+        return e
+
+@instrumented('process_file', lambda ofn, datadir, ifn, *args, **kw: \
+              {'file' : os.path.basename(ifn), 'output' : os.path.basename(ofn) if ofn else None},
+              lambda datadir, ifn, patterntype, *args, **kw: {'site' : site_of(ifn), 'pattern' : patterntype})
+def process_file(datadir, ifn, patterntype, data, others=(), catalog=None, manifest=None,
+                 window=None, params=None, lock=None):
+    """ qc of RadialMetric file ifn, written to RadialShorts_qcd.
+
+    The qc of one file shared by do_qc() and the manual-mode
+    executors, which read the files of the window in their own way.
+    data is the read_lluv_file() output of ifn and others the (xfn,
+    data) of the other files of its window; either may be the IOError
+    or EOFError its read raised (see read_or_error()), raised here.
+    The output file is added to catalog and recorded in manifest with
+    window (by default ifn and others) as its inputs, holding lock if
+    given.  Settings not given in params are taken from qc_params.
+
+    Returns the output filename, None if patterntype is not known.
+    """
+    p = dict(qc_params)
+    if params:
+        p.update(params)
+    if isinstance(data, Exception):
+        raise data
+    d, types_str, header, footer = data
+
+    ofn = radialshort_filename(datadir, os.path.basename(ifn), patterntype)
+    if ofn is None:
+        return None
+
+    # handle empty radialmetric by outputting an empty radialshorts file
+    # do not try to merge other files to fill empty radialmetric for this timestampe
+    if d.size > 0:
+        for xfn, xdata in others:
+            if isinstance(xdata, Exception):
+                raise xdata
+        d = stack_window(d, types_str, others)
+
+    rsdheader, rsd, rsdfooter = qc_radialshort(d, types_str, header, footer, p)
+    metrics.add(rows_in=rows(d), cells_out=rows(rsd))
     write_output(ofn, rsdheader, rsd, rsdfooter)
+
+    if window is None:
+        window = [ifn] + [xfn for xfn, xdata in others]
+    if lock is not None:
+        lock.acquire()
+    try:
+        if catalog is not None:
+            catalog.add(ofn, patterntype)
+        if manifest is not None:
+            manifest.record(ofn, window, p, 'RadialShorts')
+    finally:
+        if lock is not None:
+            lock.release()
     return ofn
 
+@instrumented('do_qc', lambda ofn, datadir, fn, *args, **kw: \
+              {'file' : fn, 'output' : os.path.basename(ofn) if ofn else None},
+              lambda datadir, fn, patterntype, *args, **kw: {'site' : site_of(fn), 'pattern' : patterntype})
+def do_qc(datadir, fn, patterntype, catalog=None, params=None, source=None, manifest=None):
+    """ Do qc and then average over 3 sample_intervals (time), 3 degrees of bearing.
+
+    If a FileCatalog is given, the files to average over are looked up
+    in it and the output file is added to it.  If a Manifest is given,
+    the output is recorded in it.  Settings not given in params are
+    taken from qc_params.  If an ArchiveSource is given, the
+    RadialMetric files are read from the archive (catalog should list
+    its members) and datadir is only where output goes.
+    """
+    p = dict(qc_params)
+    if params:
+        p.update(params)
+    # read in the data
+    if source is not None:
+        ifn = source.find(fn, patterntype) or os.path.join(source.path, fn)
+        read = source.read_lluv_file
+    else:
+        rmfoldername = get_radialmetric_foldername(datadir)
+        ifn = os.path.join(datadir, rmfoldername, patterntype, fn)
+        read = read_lluv_file
+    data = read_or_error(read, ifn)
+
+    window, others = [ifn], []
+    if not isinstance(data, Exception):
+        # read in other data to use in averaging over time
+        window = find_files_to_merge(ifn, numfiles=p['numfiles'], sample_interval=p['sample_interval'],
+                                     catalog=catalog, patterntype=patterntype)
+        if data[0].size > 0:
+            others = [(xfn, read_or_error(read, xfn)) for xfn in window if xfn != ifn]
+
+    return process_file(datadir, ifn, patterntype, data, others, catalog, manifest, window, params)
+
 # for debugging
 def _trial_qc():
     # read in the data
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#
+""" Rows of RadialMetric and RadialShort arrays by bearing for qcviz
+
+qcviz plots the data of one bearing (with the bearings around it for
+RadialMetric data) at a time, and the bearing slider moves through
+them.  Rather than scanning the whole window on each move, the rows
+are sorted by bearing once when the data are loaded, good and
+badflagged rows apart, so the rows of a bearing are a slice found by
+bisection.  The MSEL-based MUSIC power (MP) column is made once too.
+"""
+import numpy
+
+# RadialMetric columns plotted, MP is added as the last column
+metric_columns = ['VELO', 'SPRC', 'BEAR', 'MA3S', 'MSEL', 'MSP1', 'MDP1', 'MDP2']
+# RadialShort columns plotted
+short_columns = ['VELO', 'SPRC', 'BEAR']
+
+class BearingIndex(object):
+    """Rows of columns of array d, sorted by bearing.
+
+    Parameters
+    ----------
+    d : ndarray
+       RadialMetric or RadialShort data
+    c : dict
+       The column index of each column type of d (get_columns())
+    columns : list of string
+       The columns kept, in order.  If MSEL is one of them, followed by
+       MSP1, MDP1 and MDP2, the MSEL-based MUSIC power is appended.
+    """
+    def __init__(self, d, c, columns):
+        ncols = len(columns) + (1 if 'MSEL' in columns else 0)
+        if d.ndim != 2 or d.size == 0:
+            self.a = numpy.empty((0, ncols))
+            self.groups = dict((k, (numpy.empty(0), numpy.empty(0, dtype=int))) for k in ['good', 'bad'])
+            return
+        a = d[:, [c[k] for k in columns]]
+        if 'MSEL' in columns:
+            # pluck the msel-based Music Power from MSP1, MDP1 or MPD2 column
+            msel = columns.index('MSEL')
+            MP = numpy.ones(a.shape[0])*numpy.nan
+            for m in [1, 2, 3]:
+                which = a[:,msel]==m
+                MP[which] = a[which, msel+m]
+            a = numpy.hstack((a, MP.reshape(MP.size,1)))
+        self.a = a
+
+        bear, vflg = d[:,c['BEAR']], d[:,c['VFLG']]
+        self.groups = {}
+        for name, which in [('good', vflg==0), ('bad', vflg>0)]:
+            rows = numpy.where(which)[0]
+            order = rows[numpy.argsort(bear[rows], kind='mergesort')]
+            self.groups[name] = (bear[order], order)
+
+    def rows(self, bearing, numdegrees=1, flagged=False):
+        """ Rows of good (or badflagged) data within (numdegrees-1)/2 of bearing, in order of d """
+        bears, order = self.groups['bad' if flagged else 'good']
+        offset = ((numdegrees-1)/2)
+        lo = numpy.searchsorted(bears, bearing-offset, 'left')
+        hi = numpy.searchsorted(bears, bearing+offset, 'right')
+        return self.a[numpy.sort(order[lo:hi])]
+
+# last index made of each set of columns, as (d, flags of d, index)
+_cache = {}
+
+def bearing_index(d, c, columns):
+    """ BearingIndex of d, made once for each array d and its flags
+
+    The flags (VFLG) of d are compared too, so that d flagged again in
+    place is indexed again.
+    """
+    key = tuple(columns)
+    flags = d[:,c['VFLG']] if d.ndim == 2 and d.size else None
+    cached = _cache.get(key)
+    if cached is None or cached[0] is not d or \
+       (flags is not None and not numpy.array_equal(cached[1], flags)):
+        cached = _cache[key] = (d, None if flags is None else flags.copy(), BearingIndex(d, c, columns))
+    return cached[2]
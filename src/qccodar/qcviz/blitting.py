@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+""" Incremental redraw of qcviz by blitting, and debounced slider callbacks
+
+Most qcviz callbacks change only the data of a few lines and the
+position of a slider, so rather than redrawing the whole figure (three
+axes, the legend, the compass wedge and seven sliders) each time, the
+artists that change are set animated and redrawn over a copy of the
+background of their region (blitting).  The background is copied
+after each full draw of the canvas (at start, on resize, or when axes
+limits or labels change).
+
+Dragging a slider sends many changes; Debounced runs the callback only
+with the latest value once the slider has stopped for a moment,
+instead of queuing a recomputation for each.
+"""
+import matplotlib.backend_bases
+from matplotlib.transforms import Bbox
+
+class Blitter(object):
+    """Redraws only the animated artists of fig over cached backgrounds.
+
+    Artists added are set animated, so a full draw of the canvas
+    leaves them out; the background of each region is then copied and
+    the artists drawn over it.  update() restores the backgrounds,
+    draws the artists and blits their regions only.
+    """
+    def __init__(self, fig):
+        self.fig = fig
+        self.canvas = fig.canvas
+        self.regions = []
+        self.backgrounds = None
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def add(self, artists, bbox=None):
+        """ Redraw artists in region bbox (default the axes of the first), a Bbox or function returning one """
+        for a in artists:
+            a.set_animated(True)
+        self.regions.append((bbox or artists[0].axes.bbox, artists))
+
+    def _bbox(self, bbox):
+        return bbox() if callable(bbox) else bbox
+
+    def on_draw(self, event):
+        if not getattr(self.canvas, 'supports_blit', True):
+            return
+        self.backgrounds = [(self._bbox(bbox), self.canvas.copy_from_bbox(self._bbox(bbox)))
+                            for bbox, artists in self.regions]
+        for bbox, artists in self.regions:
+            for a in artists:
+                self.fig.draw_artist(a)
+
+    def update(self):
+        """ Redraw the animated artists, or the whole canvas if there is no background yet """
+        if self.backgrounds is None:
+            self.canvas.draw_idle()
+            return
+        for (bbox, background), (_, artists) in zip(self.backgrounds, self.regions):
+            self.canvas.restore_region(background)
+            for a in artists:
+                self.fig.draw_artist(a)
+            self.canvas.blit(bbox)
+
+def slider_region(slider):
+    """ Region of slider, its bar and the value text to the right of it """
+    ax = slider.ax
+    return lambda: Bbox([[ax.bbox.x0, ax.bbox.y0], [ax.figure.bbox.x1, ax.bbox.y1]])
+
+def blit_slider(blitter, slider):
+    """ Redraw slider by blitting rather than drawing the canvas on each change """
+    slider.drawon = False
+    blitter.add([slider.poly, slider.valtext], slider_region(slider))
+
+
+class Debounced(object):
+    """Callback calling func with the latest value after interval ms without a new one.
+
+    The slider itself is redrawn on each value.  Where the backend has
+    no timer (non-interactive backends), func is called at once.
+    """
+    def __init__(self, blitter, func, interval=80):
+        self.blitter = blitter
+        self.func = func
+        self.value = None
+        self.timer = blitter.canvas.new_timer(interval=interval)
+        self.timer.add_callback(self._fire)
+        self.immediate = type(self.timer) is matplotlib.backend_bases.TimerBase
+
+    def __call__(self, value):
+        self.value = value
+        if self.immediate:
+            self._fire()
+            return
+        self.blitter.update()
+        # restart, so only the last of a run of values is used
+        self.timer.stop()
+        self.timer.start()
+
+    def _fire(self):
+        self.timer.stop()
+        self.func(self.value)
@@ -29,9 +29,11 @@ In[]: %run qcutil.py
 In[]: plt.show()
 
 """
-from qcutils import *
-from codarutils import *
-from sliders import IndexedSlider
+from qccodar.qcutils import *
+from qccodar.codarutils import *
+from qccodar.qcviz.sliders import IndexedSlider
+from qccodar.qcviz.blitting import Blitter, Debounced, blit_slider
+from qccodar.qcviz.bearings import bearing_index, metric_columns, short_columns
 
 import sys
 
@@ -83,13 +85,20 @@ axs[2].set_yticklabels('')
 
 lbear, = axs[2].plot([0,compass2uv(1,45)[0]], [0,compass2uv(1,45)[1]], 'b-')
 
+# callbacks redraw only the lines (and sliders) over the rest of the figure
+blitter = Blitter(fig)
+blitter.add([ld_bad, ld_good, lrs])
+blitter.add([ls_bad, ls_good])
+blitter.add([lbear])
+
 
 # Widget functions
 def sbear_change(val):
     global params
     params['bearing'] = sbear.seqvals[val]
+    # the averages of all bearings are made, only the rows shown change
     plot_data(d, types_str, rsd, rstypes_str)
-    fig.canvas.draw()
+    blitter.update()
 
 def wtdavg_change(label):
     global params
@@ -106,9 +115,9 @@ def wtdavg_change(label):
         axs[1].set_ylim(0, 1)
         axs[1].set_ylabel('No Weighting Param')
  
-    rsd, rstypes_str = weighted_velocities(d, types_str, params['numdegrees'], params['weight_parameter'])
-    rsd = threshold_rsd_numpoints(rsd, rstypes_str, params['numpoints'])
+    rsd, rstypes_str = average_data(d, types_str)
     plot_data(d, types_str, rsd, rstypes_str)
+    # limits and label changed, so draw all (and copy the new background)
     fig.canvas.draw()
 
 def stest1_change(val):
@@ -116,21 +125,21 @@ def stest1_change(val):
     params['thresholds'][0] = stest1.seqvals[val]
     d, types_str, rsd, rstypes_str = get_data(datadir, fn, patterntype)
     plot_data(d, types_str, rsd, rstypes_str)
-    fig.canvas.draw()
+    blitter.update()
 
 def stest2_change(val):
     global params, d, types_str, rsd, rstypes_str
     params['thresholds'][1] = stest2.seqvals[val]
     d, types_str, rsd, rstypes_str = get_data(datadir, fn, patterntype)
     plot_data(d, types_str, rsd, rstypes_str)
-    fig.canvas.draw()
+    blitter.update()
 
 def stest3_change(val):
     global params, d, types_str, rsd, rstypes_str
     params['thresholds'][2] = stest3.seqvals[val]
     d, types_str, rsd, rstypes_str = get_data(datadir, fn, patterntype)
     plot_data(d, types_str, rsd, rstypes_str)
-    fig.canvas.draw()
+    blitter.update()
 
 def snumfiles_change(val):
     global params, d, types_str, rsd, rstypes_str
@@ -138,29 +147,30 @@ def snumfiles_change(val):
     params['numfiles'] = int(numfiles)
     d, types_str, rsd, rstypes_str = get_data(datadir, fn, patterntype)
     plot_data(d, types_str, rsd, rstypes_str)
-    fig.canvas.draw()
+    blitter.update()
 
 def snumdegrees_change(val):
-    global params, d, types_str, rsd, rstypes_str
+    global params, rsd, rstypes_str
     numdegrees = snumdegrees.seqvals[val]
     params['numdegrees'] = int(numdegrees)
-    d, types_str, rsd, rstypes_str = get_data(datadir, fn, patterntype)
+    # only the averaging depends on numdegrees
+    rsd, rstypes_str = average_data(d, types_str)
     plot_data(d, types_str, rsd, rstypes_str)
-    fig.canvas.draw()
+    blitter.update()
 
 def snumpoints_change(val):
     global params, rsd, rstypes_str
     numpoints = snumpoints.seqvals[val]
     params['numpoints'] = int(numpoints)
-    rsd, rstypes_str = weighted_velocities(d, types_str, params['numdegrees'], params['weight_parameter'])
-    rsd = threshold_rsd_numpoints(rsd, rstypes_str, params['numpoints'])
+    rsd, rstypes_str = average_data(d, types_str)
     plot_data(d, types_str, rsd, rstypes_str)
-    fig.canvas.draw()
+    blitter.update()
 
 # Widgets
 axbear = plt.axes([0.1, 0.05, 0.8, 0.03])
 sbear = IndexedSlider(axbear, 'Bearing', seqvals=range(0,269,1), valinit=0, valfmt=u'%03d (deg)')
-sbear.on_changed(sbear_change)
+blit_slider(blitter, sbear)
+sbear.on_changed(Debounced(blitter, sbear_change))
 
 axradio = plt.axes([0.4, 0.1, 0.15, 0.15], aspect='equal', title='Weighting Param')
 rwtdavg = matplotlib.widgets.RadioButtons(axradio, ('MP', 'SNR', 'NONE'), active=1)
@@ -174,70 +184,47 @@ igs = matplotlib.gridspec.GridSpecFromSubplotSpec(7,1,subplot_spec=ogs[-1,-1], h
 axtest1 = plt.subplot(igs[0], title='Thresholds')
 stest1 = IndexedSlider(axtest1, 'DOA Power', seqvals=numpy.arange(0,25,0.1), \
                        valinit=params['thresholds'][0], valfmt=u'%3.1f (dB)')
-stest1.on_changed(stest1_change)
+blit_slider(blitter, stest1)
+stest1.on_changed(Debounced(blitter, stest1_change))
 axtest2 = plt.subplot(igs[1])
 stest2 = IndexedSlider(axtest2, 'DOA Width', seqvals=range(100,0,-1), \
                        valinit=params['thresholds'][1], valfmt=u'%3.1f (deg)')
-stest2.on_changed(stest2_change)
+blit_slider(blitter, stest2)
+stest2.on_changed(Debounced(blitter, stest2_change))
 axtest3 = plt.subplot(igs[2])
 stest3 = IndexedSlider(axtest3, 'SNR Mono', seqvals=numpy.arange(0,25,0.1), \
                        valinit=params['thresholds'][2], valfmt=u'%3.1f (dB)')
-stest3.on_changed(stest3_change)
+blit_slider(blitter, stest3)
+stest3.on_changed(Debounced(blitter, stest3_change))
 
 axnf = plt.subplot(igs[4], title='Weighting Windows')
 snumfiles = IndexedSlider(axnf, 'numfiles', seqvals=[1,3,5,7], valinit=params['numfiles'], valfmt=u'%d')
-snumfiles.on_changed(snumfiles_change)
+blit_slider(blitter, snumfiles)
+snumfiles.on_changed(Debounced(blitter, snumfiles_change))
 
 axnd = plt.subplot(igs[5])
 snumdegrees = IndexedSlider(axnd, 'numdegrees', seqvals=[1,3,5,7], valinit=params['numdegrees'], valfmt=u'%d')
-snumdegrees.on_changed(snumdegrees_change)
+blit_slider(blitter, snumdegrees)
+snumdegrees.on_changed(Debounced(blitter, snumdegrees_change))
 
 axnp = plt.subplot(igs[6])
 snumpoints = IndexedSlider(axnp, 'numpoints', seqvals=range(1,11), valinit=params['numpoints'], valfmt=u'%d')
-snumpoints.on_changed(snumpoints_change)
+blit_slider(blitter, snumpoints)
+snumpoints.on_changed(Debounced(blitter, snumpoints_change))
 
 def subset_rsdata(rsd, rsc, bearing):
     # get data from qc'd and averaged (now data for RadialShorts) array
-    xrow = numpy.where( (rsd[:,rsc['BEAR']]==bearing) & (rsd[:,rsc['VFLG']]==0))[0]
-    xcol = numpy.array([rsc['VELO'], rsc['SPRC'], rsc['BEAR']])
-    a = rsd[numpy.ix_(xrow, xcol)]
-    return a
+    return bearing_index(rsd, rsc, short_columns).rows(bearing)
 
 def subset_data_good(d, c, bearing, numdegrees):
-    # get GOOD data from RadialMetric array that is not badflagged 
-    offset = ((numdegrees-1)/2)
-    xrow = numpy.where( (d[:,c['BEAR']]>=bearing-offset) & \
-                        (d[:,c['BEAR']]<=bearing+offset) & \
-                        (d[:,c['VFLG']]==0) )[0]
-    xcol = numpy.array([c['VELO'], c['SPRC'], c['BEAR'], c['MA3S'], c['MSEL'], c['MSP1'], c['MDP1'], c['MDP2']])
-    a = d[numpy.ix_(xrow, xcol)]
-    # Create array to hold each Music Power (based on MSEL)
-    MP = numpy.array(numpy.ones(a[:,0].shape)*numpy.nan) 
-    # pluck the msel-based Music Power from MSP1, MDP1 or MPD2 column
-    for msel in [1, 2, 3]:
-        which = a[:,4]==msel
-        MP[which,] = a[which, msel+4]
-    # append as last column
-    a = numpy.hstack((a,MP.reshape(MP.size,1)))
-    return a
+    # get GOOD data from RadialMetric array that is not badflagged, with
+    # the msel-based Music Power appended as last column
+    return bearing_index(d, c, metric_columns).rows(bearing, numdegrees)
 
 def subset_data_bad(d, c, bearing, numdegrees):
-    # get BAD data from RadialMetric array that is badflagged 
-    offset = ((numdegrees-1)/2)
-    xrow = numpy.where( (d[:,c['BEAR']]>=bearing-offset) & \
-                        (d[:,c['BEAR']]<=bearing+offset) & \
-                        (d[:,c['VFLG']]>0) )[0]
-    xcol = numpy.array([c['VELO'], c['SPRC'], c['BEAR'], c['MA3S'], c['MSEL'], c['MSP1'], c['MDP1'], c['MDP2']])
-    a = d[numpy.ix_(xrow, xcol)]
-    # Create array to hold each Music Power (based on MSEL)
-    MP = numpy.array(numpy.ones(a[:,0].shape)*numpy.nan) 
-    # pluck the msel-based Music Power from MSP1, MDP1 or MPD2 column
-    for msel in [1, 2, 3]:
-        which = a[:,4]==msel
-        MP[which,] = a[which, msel+4]
-    # append as last column
-    a = numpy.hstack((a,MP.reshape(MP.size,1)))
-    return a
+    # get BAD data from RadialMetric array that is badflagged, with
+    # the msel-based Music Power appended as last column
+    return bearing_index(d, c, metric_columns).rows(bearing, numdegrees, flagged=True)
 
 def compass2deg(az):
     """ Convert compass azimuth to cartesian angle in degrees
@@ -292,6 +279,7 @@ def init_plot(d, types_str, rsd, rstypes_str):
     sbear.set_val(sbear.valinit)
 
     # put the first bearing data into the plots
+    rsd, rstypes_str = average_data(d, types_str)
     plot_data(d, types_str, rsd, rstypes_str)
 
 
@@ -351,34 +339,68 @@ def debug_data(d, types_str, rsd, rstypes_str):
     gd = subset_data_good(d, c, params['bearing'], params['numdegrees'])
     bd = subset_data_bad(d, c, params['bearing'], params['numdegrees'])
 
+# RadialMetric files parsed, the stacked window of fn for each
+# numfiles and the weighted averages of the flagged window for each
+# (numdegrees, weight_parameter) with numpoints checked, so moving a
+# slider only redoes the steps that depend on it
+parsed = {}
+stacked = {}
+averages = {}
+checked = {}
+averaged_for = None
+
+def read_parsed(ifn):
+    """ read_lluv_file() output of ifn, read from disk once """
+    if ifn not in parsed:
+        parsed[ifn] = read_lluv_file(ifn)
+    return parsed[ifn]
+
+def stack_data(datadir, fn, patterntype):
+    """ Raw stacked window of fn for params['numfiles'], stacked once for each numfiles
+    """
+    key = (datadir, patterntype, fn, params['numfiles'])
+    if key not in stacked:
+        ifn = os.path.join(datadir, 'RadialMetric', patterntype, fn)
+        d, types_str, header, footer = read_parsed(ifn)
+        ixfns = find_files_to_merge(ifn, params['numfiles'], sample_interval=30)
+        others = [(xfn, read_parsed(xfn)) for xfn in ixfns if xfn != ifn]
+        stacked[key] = (stack_window(d, types_str, others), types_str)
+    return stacked[key]
+
+def average_data(d, types_str):
+    """ Weighted averages at all bearings of flagged window d, with minimum numpoints checked
+
+    Made once for each flagged window and settings, the bearing slider
+    only slices the rows of the bearing shown from it.
+    """
+    global averaged_for
+    if averaged_for is not d:
+        averages.clear()
+        checked.clear()
+        averaged_for = d
+    key = (params['numdegrees'], params['weight_parameter'])
+    if key not in averages:
+        averages[key] = weighted_velocities(d, types_str, key[0], key[1])
+    ckey = key + (params['numpoints'],)
+    if ckey not in checked:
+        rsd, rstypes_str = averages[key]
+        # check minimum numpoints 
+        checked[ckey] = (threshold_rsd_numpoints(rsd, rstypes_str, params['numpoints']), rstypes_str)
+    return checked[ckey]
+
 def get_data(datadir, fn, patterntype):
     """
     """
     global params, d, types_str, rsd, rstypes_str
 
-    # read in the data
-    ifn = os.path.join(datadir, 'RadialMetric', patterntype, fn)
-    d, types_str, header, footer = read_lluv_file(ifn)
-
-    ixfns = find_files_to_merge(ifn, params['numfiles'], sample_interval=30)
-    for xfn in ixfns:
-        if xfn == ifn:
-            continue
-        d1, types_str1, _, _ = read_lluv_file(xfn)
-        if len(d.shape) == len(d1.shape) == 2:
-            if (d.shape[1] == d1.shape[1]) & (types_str == types_str1):
-                # if same number and order of columns as d, then append the data d
-                print '... ... merging: %s' % xfn
-                d = numpy.vstack((d,d1))
-
-    # do any threshold qc
+    # the stacked window, read in only the first time for each numfiles
+    d, types_str = stack_data(datadir, fn, patterntype)
+
+    # do any threshold qc (on a copy, the stacked window is kept raw)
     d = threshold_qc_all(d, types_str, params['thresholds'])
    
     # do weighted averaging
-    rsd, rstypes_str = weighted_velocities(d, types_str, params['numdegrees'], params['weight_parameter'])
-        
-    # check minimum numpoints 
-    rsd = threshold_rsd_numpoints(rsd, rstypes_str, params['numpoints'])
+    rsd, rstypes_str = average_data(d, types_str)
 
     return d, types_str, rsd, rstypes_str
 
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#
+""" Readiness of RadialMetric files that may still be being written
+
+A complete LLUV file ends with the '%End:' line, after the last
+'%TableEnd:' of its footer.  A file is ready when it is not empty,
+its last line (read by a seek from the end, not the whole file) is
+'%End:', and its size has been stable for settle seconds (it was last
+modified at least that long ago).  A file that the writer has closed
+(close-write event) only needs the footer.
+
+wait_until_ready() polls every poll seconds, or with pyinotify (Linux,
+optional) wakes up on the close-write of the file, so qc can start the
+moment the file is complete instead of at the next cron tick.
+first_not_ready() waits on the files of a qc window, only the newest
+for long, since the older ones were written one or more sample
+intervals before.
+
+A file that never completes (truncated, or without '%End:') would be
+waited on at every cron tick.  The files that were waited on in vain
+are kept in DATADIR/.qccodar/PATTERN/not_ready.json (see NotReadyLog),
+and after ready_params['attempts'] waits a file is no longer waited on,
+until it changes.
+
+"""
+import os
+import json
+import time
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+# settle and poll in seconds, timeout of wait_until_ready() in seconds,
+# the timeout for files of a window older than the newest, and the
+# waits on a file that does not change before it is given up on
+ready_params = {'settle' : 2.0,
+                'poll' : 1.0,
+                'timeout' : 300,
+                'older_timeout' : 5,
+                'attempts' : 3,
+}
+
+def has_footer(fn, tail=1024):
+    """ True if the last line of fn is the LLUV '%End:' line """
+    f = open(fn, 'rb')
+    try:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(size-tail, 0))
+        lines = f.read().splitlines()
+    finally:
+        f.close()
+    while lines and not lines[-1].strip():
+        lines.pop()
+    return bool(lines) and lines[-1].strip().startswith('%End:')
+
+def is_ready(fn, settle=None, closed=False):
+    """ True if fn is complete and not being written """
+    if settle is None:
+        settle = ready_params['settle']
+    try:
+        st = os.stat(fn)
+    except OSError:
+        return False
+    if st.st_size == 0 or not has_footer(fn):
+        return False
+    return closed or time.time() - st.st_mtime >= settle
+
+def wait_until_ready(fn, timeout=None, poll=None, settle=None):
+    """ Wait up to timeout seconds for fn to be ready, return True if ready """
+    if timeout is None:
+        timeout = ready_params['timeout']
+    if poll is None:
+        poll = ready_params['poll']
+    if is_ready(fn, settle):
+        return True
+
+    closed = []
+    notifier = None
+    if pyinotify is not None and os.path.isdir(os.path.dirname(fn) or '.'):
+        wm = pyinotify.WatchManager()
+        def _event(event):
+            if os.path.abspath(event.pathname) == os.path.abspath(fn):
+                closed.append(event)
+        notifier = pyinotify.Notifier(wm, default_proc_fun=_event, timeout=int(poll*1000))
+        wm.add_watch(os.path.dirname(fn) or '.', pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO)
+
+    t0 = time.time()
+    try:
+        while True:
+            # also checked after the watch is set, in case fn was closed before
+            if is_ready(fn, settle, closed=bool(closed)):
+                return True
+            if time.time() - t0 >= timeout:
+                return False
+            del closed[:]
+            if notifier is not None:
+                if notifier.check_events():
+                    notifier.read_events()
+                    notifier.process_events()
+            else:
+                time.sleep(poll)
+    finally:
+        if notifier is not None:
+            notifier.stop()
+
+class NotReadyLog(object):
+    """Files of datadir and pattern that were not ready when waited on.
+
+    For each file (by path relative to datadir) the number of waits
+    that timed out, and its size and modification time at the last
+    one.  A file that has changed since is waited on again as if new.
+
+    """
+    def __init__(self, datadir, pattern):
+        from .manifest import statedir
+        self.datadir = datadir
+        self.filename = os.path.join(statedir(datadir, pattern), 'not_ready.json')
+        self.entries = {}
+        if os.path.exists(self.filename):
+            f = open(self.filename, 'r')
+            try:
+                self.entries = json.load(f)
+            except ValueError:
+                # partly written by a run that was killed, start over
+                pass
+            finally:
+                f.close()
+
+    def _stat(self, fn):
+        try:
+            st = os.stat(fn)
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime]
+
+    def attempts(self, fn):
+        """ Waits on fn that timed out, since it last changed """
+        entry = self.entries.get(os.path.relpath(fn, self.datadir))
+        if entry is None or entry['stat'] != self._stat(fn):
+            return 0
+        return entry['attempts']
+
+    def given_up(self, fn):
+        return self.attempts(fn) >= ready_params['attempts']
+
+    def timed_out(self, fn):
+        self.entries[os.path.relpath(fn, self.datadir)] = {'attempts' : self.attempts(fn)+1,
+                                                           'stat' : self._stat(fn)}
+        self.save()
+
+    def ready(self, fn):
+        if self.entries.pop(os.path.relpath(fn, self.datadir), None) is not None:
+            self.save()
+
+    def save(self):
+        from .manifest import atomic_write
+        from .locks import makedirs
+        makedirs(os.path.dirname(self.filename))
+        atomic_write(self.filename, json.dumps(self.entries, sort_keys=True, indent=1))
+
+def first_not_ready(fns, newest, log=None):
+    """ The first of fns that is not ready, None if all are
+
+    newest (the file just arrived) is waited on up to timeout, the
+    older files up to older_timeout seconds.  With a NotReadyLog log,
+    the waits that time out are counted, and a file given up on is
+    not waited on.
+    """
+    for fn in fns:
+        if log is not None and log.given_up(fn):
+            return fn
+        timeout = ready_params['timeout'] if fn == newest else ready_params['older_timeout']
+        if not wait_until_ready(fn, timeout=timeout):
+            if log is not None:
+                log.timed_out(fn)
+            return fn
+        if log is not None:
+            log.ready(fn)
+    return None
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#
+""" Catchup scheduling, newest data first and the backlog in background
+
+After a station outage catchup finds a long backlog of RadialMetric
+files.  The scheduler splits the pending files in two priority classes:
+
+realtime
+   the newest realtime_files files, enough for the latest merged
+   Radials_qcd product (merge_params['rs_num'] files), done first and
+   in time order.
+backlog
+   the older files, done oldest first with backlog_share of the CPU
+   (the scheduler sleeps after each file so that work takes that share
+   of the wall time).  Before each backlog file, at most every
+   rescan_interval seconds, datadir is scanned for newly arrived files,
+   which are done at once as realtime.
+
+The merges of the realtime files are made before the backlog files in
+their window are qc'd.  Once the backlog is done, remerge(catalog,
+since) is called to redo the merges of sources from the oldest backlog
+file on that are now missing some of their sources.
+
+The lag of each class, the time from the newest data in a processed
+window to when it was processed, is printed at the end and written to
+DATADIR/.qccodar/PATTERN/lag.json.
+
+"""
+import os
+import json
+import time
+import datetime
+import collections
+
+from .catalog import build_catalog, lluvtype_for, parse_lluv_filename
+from .manifest import statedir, atomic_write
+from .locks import makedirs
+
+CLASSES = ('realtime', 'backlog')
+
+def pending_files(catalog, pattern, numfiles=3):
+    """ RadialMetric files to give to auto() for the files without RadialShorts_qcd
+
+    auto() qc's the file (numfiles-1)/2 before the one it is given,
+    so the first pending files are covered by the ones after them.
+    """
+    fns = catalog.paths(lluvtype_for('RadialMetric', pattern), pattern)
+    newfns = [fn for fn in fns if not catalog.has_output(fn, pattern, 'RadialShorts')]
+    return newfns[(numfiles-1)/2:]
+
+def file_time(fn):
+    parsed = parse_lluv_filename(fn)
+    return parsed[2] if parsed else None
+
+
+class LagStats(object):
+    """ Count, queue length and lag (seconds) of one priority class """
+    def __init__(self):
+        self.queued = 0
+        self.count = 0
+        self.last = None
+        self.max = None
+        self.total = 0.0
+
+    def add(self, lag):
+        self.count += 1
+        self.queued = max(self.queued-1, 0)
+        self.last = lag
+        self.max = lag if self.max is None else max(self.max, lag)
+        self.total += lag
+
+    def as_dict(self):
+        return {'queued' : self.queued, 'count' : self.count, 'last' : self.last, 'max' : self.max,
+                'mean' : self.total/self.count if self.count else None}
+
+    def report(self, name):
+        if not self.count:
+            return '%-8s done %5d  queued %5d' % (name, self.count, self.queued)
+        return '%-8s done %5d  queued %5d  lag last %10.0f s  mean %10.0f s  max %10.0f s' % \
+            (name, self.count, self.queued, self.last, self.total/self.count, self.max)
+
+
+class Scheduler(object):
+    """ Runs process(fullfn, catalog) on pending files, newest window first """
+    def __init__(self, datadir, pattern, backlog_share=0.5, realtime_files=None, rescan_interval=60):
+        self.datadir = datadir
+        self.pattern = pattern
+        self.backlog_share = min(max(float(backlog_share), 0.01), 1.0)
+        self.realtime_files = realtime_files
+        self.rescan_interval = rescan_interval
+        self.lag = dict((name, LagStats()) for name in CLASSES)
+        self.sleep = time.sleep
+
+    def split(self, fns):
+        """ Split pending fns into (realtime, backlog) """
+        if not fns:
+            return [], []
+        if self.realtime_files is None:
+            # codarutils (numpy) only when there is something to do
+            from .codarutils import merge_params
+            self.realtime_files = merge_params['rs_num']
+        n = len(fns) - self.realtime_files
+        if n <= 0:
+            return list(fns), []
+        return fns[n:], fns[:n]
+
+    def _process(self, name, process, fullfn, catalog):
+        t0 = time.time()
+        process(fullfn, catalog)
+        elapsed = time.time() - t0
+        dt = file_time(fullfn)
+        if dt is not None:
+            lag = datetime.datetime.utcnow() - dt
+            self.lag[name].add(lag.days*86400 + lag.seconds + lag.microseconds/1e6)
+        return elapsed
+
+    def run(self, process, remerge=None):
+        catalog = build_catalog(self.datadir, self.pattern)
+        fns = pending_files(catalog, self.pattern)
+        print "Files to process ..."
+        print [os.path.basename(fn) for fn in fns]
+        realtime, backlog = self.split(fns)
+        self.lag['realtime'].queued = len(realtime)
+        self.lag['backlog'].queued = len(backlog)
+        newest = file_time(fns[-1]) if fns else None
+        since = file_time(backlog[0]) if backlog else None
+
+        for fullfn in realtime:
+            self._process('realtime', process, fullfn, catalog)
+
+        backlog = collections.deque(backlog)
+        scanned = time.time()
+        while backlog:
+            if time.time() - scanned >= self.rescan_interval:
+                catalog = build_catalog(self.datadir, self.pattern)
+                scanned = time.time()
+                arrived = [fn for fn in pending_files(catalog, self.pattern) \
+                           if newest is None or file_time(fn) > newest]
+                if arrived:
+                    print '... %d new files, done before backlog' % len(arrived)
+                    newest = file_time(arrived[-1])
+                    self.lag['realtime'].queued += len(arrived)
+                    for fullfn in arrived:
+                        self._process('realtime', process, fullfn, catalog)
+            elapsed = self._process('backlog', process, backlog.popleft(), catalog)
+            if self.backlog_share < 1.0:
+                self.sleep(elapsed*(1.0-self.backlog_share)/self.backlog_share)
+
+        # the realtime merges now have the backlog files of their window
+        if since is not None and remerge is not None:
+            remerge(catalog, since)
+
+    def report(self):
+        print 'qccodar (catchup) -- lag per priority class'
+        for name in CLASSES:
+            print self.lag[name].report(name)
+
+    def save(self):
+        """ Write lag of each class to lag.json in the state directory """
+        dirname = statedir(self.datadir, self.pattern)
+        makedirs(dirname)
+        lag = dict((name, self.lag[name].as_dict()) for name in CLASSES)
+        lag['time'] = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        atomic_write(os.path.join(dirname, 'lag.json'), json.dumps(lag, sort_keys=True, indent=1))
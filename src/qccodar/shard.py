@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+#
+""" Shard mode, one manual run spread over several nodes
+
+For large reanalysis runs the RadialMetric timeline of a datadir is
+split into chunks of chunk_files target files.  Each chunk also lists
+the files it reads, its targets plus the (numfiles-1)/2 files either
+side, so the 3- or 5-file windows at chunk boundaries are the same as
+in a single manual run.
+
+Nodes that share the datadir (e.g. over NFS) each run shard mode.  The
+plan and the claims of chunks are files in DATADIR/.qccodar/PATTERN/shards,
+created with O_EXCL or link() so only one node gets each chunk.  The
+plan lists files relative to that directory, so nodes may mount the
+datadir at different paths.  A claim is a lock file (see
+qccodar.locks) renewed after each target of the chunk; the claim of a
+node that died (its pid is gone on this host, or the claim was not
+renewed for lease seconds) is taken over by the next node.  Each
+chunk keeps its own manifest.  The node that finds all chunks done
+claims the merge phase, which stitches the chunk manifests into the
+datadir manifest and runs LLUVMerger across chunk boundaries.
+
+"""
+import os
+import json
+import time
+
+from .qcutils import do_qc, find_files_to_merge, qc_params
+from .codarutils import run_LLUVMerger, merge_params
+from .catalog import FileCatalog, build_catalog, lluvtype_for
+from .manifest import Manifest, statedir, merge_sources
+from .locks import FileLock, node_id, create_exclusive, makedirs
+
+debug = 1
+
+# seconds without renewal after which the claim of a chunk is taken over
+lease = 1800
+
+def plan_chunks(catalog, pattern, chunk_files=48):
+    """ Split RadialMetric files of pattern into chunks of chunk_files targets
+
+    Returns list of chunks, each a dict with id, targets (in time
+    order) and reads, the files read for the windows of the targets.
+    """
+    fns = catalog.paths(lluvtype_for('RadialMetric', pattern), pattern)
+    chunk_files = max(int(chunk_files), 1)
+    chunks = []
+    for i in range(0, len(fns), chunk_files):
+        targets = fns[i:i+chunk_files]
+        reads = set()
+        for fn in targets:
+            reads.update(find_files_to_merge(fn, qc_params['numfiles'], qc_params['sample_interval'],
+                                             catalog=catalog, patterntype=pattern))
+        chunks.append({'id' : 'chunk-%05d' % len(chunks),
+                       'targets' : targets,
+                       'reads' : sorted(reads)})
+    return chunks
+
+
+class ShardQueue(object):
+    """ Plan and claims of chunks on the shared filesystem """
+    def __init__(self, datadir, pattern, lease=None):
+        self.dir = os.path.join(statedir(datadir, pattern), 'shards')
+        self.lease = lease
+        self.claims = {}
+        makedirs(self.dir)
+
+    def _fn(self, name):
+        return os.path.join(self.dir, name)
+
+    def plan(self, chunks):
+        """ Use the plan already on disk, else make chunks the plan """
+        relative = [dict(chunk, targets=[os.path.relpath(fn, self.dir) for fn in chunk['targets']],
+                         reads=[os.path.relpath(fn, self.dir) for fn in chunk['reads']])
+                    for chunk in chunks]
+        create_exclusive(self._fn('plan.json'), json.dumps(relative, indent=1))
+        f = open(self._fn('plan.json'), 'r')
+        try:
+            planned = json.load(f)
+        finally:
+            f.close()
+        for chunk in planned:
+            for key in ['targets', 'reads']:
+                chunk[key] = [os.path.normpath(os.path.join(self.dir, fn)) for fn in chunk[key]]
+        return planned
+
+    def claim(self, name):
+        """ Claim chunk or phase name for this node, True if claimed
+
+        A claim left by a node that died is stale (see
+        locks.FileLock) and is taken over.
+        """
+        claim = FileLock(self._fn(name+'.claim'), stale_after=lease if self.lease is None else self.lease)
+        if not claim.acquire():
+            return False
+        self.claims[name] = claim
+        return True
+
+    def renew(self, name):
+        """ Keep the claim of name from going stale, False if another node took it over """
+        return name not in self.claims or self.claims[name].renew()
+
+    def complete(self, name):
+        create_exclusive(self._fn(name+'.done'), json.dumps({'node' : node_id(), 'time' : time.time()}))
+
+    def is_done(self, name):
+        return os.path.exists(self._fn(name+'.done'))
+
+    def manifest_filename(self, name):
+        # own directory, so each chunk also has its own journal
+        return os.path.join(self.dir, name, 'manifest.json')
+
+
+def process_chunk(datadir, pattern, chunk, manifest, queue=None):
+    """ qc the targets of chunk, reading only the files of the chunk
+
+    The claim of the chunk in queue is renewed after each target.
+    Returns False if the chunk was taken over by another node meanwhile.
+    """
+    catalog = FileCatalog()
+    catalog.add_files(chunk['reads'], pattern)
+    for fullfn in chunk['targets']:
+        print '... input: %s' % fullfn
+        ofn = do_qc(datadir, os.path.basename(fullfn), pattern, catalog=catalog, manifest=manifest)
+        print '... output: %s' % ofn
+        if queue is not None and not queue.renew(chunk['id']):
+            print '... claim of %s taken over by another node' % chunk['id']
+            return False
+    manifest.save()
+    return True
+
+def stitch(datadir, pattern, queue, chunks):
+    """ Merge phase, combine chunk manifests and run LLUVMerger """
+    manifest = Manifest(datadir, pattern)
+    for chunk in chunks:
+        manifest.update(Manifest(datadir, pattern, filename=queue.manifest_filename(chunk['id'])))
+    catalog = build_catalog(datadir, pattern, kinds=('RadialShorts',))
+    for fullfn in catalog.paths(lluvtype_for('RadialShorts', pattern), pattern):
+        if not os.path.basename(fullfn).endswith('00.ruv'):
+            continue
+        print '... merge input: %s' % fullfn
+        ofn = run_LLUVMerger(datadir, os.path.basename(fullfn), pattern)
+        print '... merge output: %s' % ofn
+        if ofn:
+            manifest.record(ofn, merge_sources(catalog, fullfn, pattern, merge_params),
+                            merge_params, 'Radials')
+        queue.renew('merge')
+    manifest.save()
+
+def run_shard(datadir, pattern, chunk_files=48):
+    """ Work on unclaimed chunks, and the merge phase if all chunks are done
+
+    Returns (chunk ids processed by this node, True if this node merged)
+    """
+    queue = ShardQueue(datadir, pattern)
+    if queue.is_done('merge'):
+        print "qccodar (shard): all chunks and merge done in %s" % queue.dir
+        print "    remove this directory to start a new sharded run"
+        return [], False
+
+    catalog = build_catalog(datadir, pattern, kinds=('RadialMetric',))
+    chunks = queue.plan(plan_chunks(catalog, pattern, chunk_files))
+    print 'qccodar (shard) -- %d chunks, node %s' % (len(chunks), node_id())
+
+    processed = []
+    for chunk in chunks:
+        if queue.is_done(chunk['id']) or not queue.claim(chunk['id']):
+            continue
+        # done by the node whose stale claim was just taken over
+        if queue.is_done(chunk['id']):
+            continue
+        print 'qccodar (shard) -- qc %s' % chunk['id']
+        manifest = Manifest(datadir, pattern, filename=queue.manifest_filename(chunk['id']))
+        if not process_chunk(datadir, pattern, chunk, manifest, queue):
+            continue
+        queue.complete(chunk['id'])
+        processed.append(chunk['id'])
+
+    merged = False
+    if all(queue.is_done(chunk['id']) for chunk in chunks) and queue.claim('merge') \
+            and not queue.is_done('merge'):
+        print 'qccodar (shard) -- merge step ...'
+        stitch(datadir, pattern, queue, chunks)
+        queue.complete('merge')
+        merged = True
+    return processed, merged
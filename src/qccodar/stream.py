@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+#
+""" Streaming executor for manual mode, in bounded memory
+
+Walks the RadialMetric files in time order.  A reader thread parses
+files ahead of the qc, and the qc holds only a sliding deque of the
+parsed tables that the current and next window need, so memory does
+not grow with the number of files in the data directory.
+
+The bytes of parsed tables held (queued for qc or in the deque) are
+kept under a ceiling.  The reader takes the size of a file from the
+budget before parsing it (a parsed table is smaller than its file) and
+gives back the difference once parsed, or all of it if the file cannot
+be read.  When the ceiling is hit the reader waits for the qc to
+release tables before parsing further (backpressure).  The
+files of the window being processed are always read, even if that
+goes over the ceiling, so a ceiling smaller than one window only
+stops the read-ahead.  Merges are run as soon as their RadialShorts_qcd
+sources of this run are written.  Output files are the same as the
+serial manual mode.
+
+"""
+import os
+import threading
+import Queue
+import collections
+
+from .qcutils import read_lluv_file, read_or_error, find_files_to_merge, process_file, \
+    qc_params
+from .codarutils import run_LLUVMerger, merge_params
+from .manifest import merge_sources
+from .pipeline import merge_plan, output_written
+
+debug = 1
+
+# default ceiling (MB) for parsed tables held in memory
+max_memory = 256
+
+# marks the end of items put in a queue
+_done = object()
+
+def table_size(data):
+    """ Bytes held by read_lluv_file() output data """
+    if isinstance(data, Exception):
+        return 0
+    d, types_str, header, footer = data
+    return d.nbytes + len(types_str) + len(header) + len(footer)
+
+
+class MemoryBudget(object):
+    """Bytes of parsed tables held, with a ceiling.
+
+    acquire() waits while the bytes held would go over the ceiling,
+    unless nothing is held or the consumer is starving (waiting for a
+    table it needs), which lets one acquire() past the ceiling.
+    release() gives bytes back and wakes the reader.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self.stalls = 0
+        self.closed = False
+        self._starving = False
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes):
+        with self._cond:
+            stalled = False
+            while self.used > 0 and self.used + nbytes > self.limit \
+                  and not self._starving and not self.closed:
+                if not stalled:
+                    self.stalls += 1
+                    stalled = True
+                self._cond.wait(0.5)
+            if self.used > 0 and self.used + nbytes > self.limit:
+                # let past for the table the consumer waits for, not the next
+                self._starving = False
+            self.used += nbytes
+            self.peak = max(self.peak, self.used)
+
+    def release(self, nbytes):
+        with self._cond:
+            self.used -= nbytes
+            self._cond.notify_all()
+
+    def starve(self, starving):
+        with self._cond:
+            self._starving = starving
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class Stream(object):
+    """Read and qc of manual mode over a sliding window of parsed files.
+
+    Parameters
+    ----------
+    datadir : string
+       The data directory
+    pattern : string
+       The pattern type (IdealPattern or MeasPattern)
+    catalog : FileCatalog
+       The catalogue of files in datadir
+    manifest : Manifest, optional
+       If given, the inputs of each output are recorded in it
+    max_memory : float
+       Ceiling in MB for parsed tables held in memory
+    source : ArchiveSource, optional
+       The archive the RadialMetric files are read from
+    """
+    def __init__(self, datadir, pattern, catalog, manifest=None, max_memory=max_memory, source=None):
+        self.datadir = datadir
+        self.pattern = pattern
+        self.catalog = catalog
+        self.manifest = manifest
+        self.budget = MemoryBudget(int(float(max_memory)*1024*1024))
+        self.read = source.read_lluv_file if source is not None else read_lluv_file
+        self.size = source.size if source is not None else os.path.getsize
+        self._stop = threading.Event()
+
+    def _reader(self, fns, read_q):
+        try:
+            for fn in fns:
+                if self._stop.is_set():
+                    break
+                try:
+                    nbytes = self.size(fn)
+                except (OSError, KeyError):
+                    # not there, read_or_error() passes the error on
+                    nbytes = 0
+                self.budget.acquire(nbytes)
+                try:
+                    item = read_or_error(self.read, fn)
+                except:
+                    self.budget.release(nbytes)
+                    raise
+                size = table_size(item)
+                if size < nbytes:
+                    self.budget.release(nbytes-size)
+                elif size > nbytes:
+                    self.budget.acquire(size-nbytes)
+                read_q.put((fn, item, size))
+        finally:
+            read_q.put(_done)
+
+    def _next(self, read_q):
+        """ Next parsed file from the reader, letting it past the ceiling if none is queued """
+        try:
+            return read_q.get_nowait()
+        except Queue.Empty:
+            pass
+        self.budget.starve(True)
+        try:
+            return read_q.get()
+        finally:
+            self.budget.starve(False)
+
+    def _window(self, fn):
+        return find_files_to_merge(fn, qc_params['numfiles'], qc_params['sample_interval'],
+                                   catalog=self.catalog, patterntype=self.pattern)
+
+    def _merge(self, rsfn):
+        print '... merge input: %s' % rsfn
+        ofn = run_LLUVMerger(self.datadir, os.path.basename(rsfn), self.pattern)
+        print '... merge output: %s' % ofn
+        if ofn:
+            self.catalog.add(ofn, self.pattern)
+            if self.manifest is not None:
+                self.manifest.record(ofn, merge_sources(self.catalog, rsfn, self.pattern, merge_params),
+                                     merge_params, 'Radials')
+
+    def run(self, fns, skip_merge=None):
+        """ Run qc and merge for the RadialMetric files fns (in time order)
+
+        Merges of sources that do not depend on the output of fns are
+        not run if skip_merge(rsfn) is True.
+        """
+        ready, pending, waiting = merge_plan(self.datadir, self.pattern, self.catalog, fns, skip_merge)
+        read_q = Queue.Queue()
+        reader = threading.Thread(target=self._reader, args=(fns, read_q))
+        reader.daemon = True
+        reader.start()
+
+        position = dict((fn, i) for i, fn in enumerate(fns))
+        held = collections.deque()   # (fn, read_lluv_file() output, bytes) in time order
+        loaded = {}
+        reading = True
+        try:
+            window = self._window(fns[0]) if fns else []
+            for i, ifn in enumerate(fns):
+                # files outside of fns are read here when needed and not held
+                while reading and not all(xfn in loaded for xfn in window if xfn in position):
+                    item = self._next(read_q)
+                    if item is _done:
+                        reading = False
+                        break
+                    held.append(item)
+                    loaded[item[0]] = item[1]
+
+                print '... input: %s' % ifn
+                others = [(xfn, loaded[xfn] if xfn in position else read_or_error(self.read, xfn))
+                          for xfn in window if xfn != ifn]
+                ofn = process_file(self.datadir, ifn, self.pattern, loaded[ifn], others,
+                                   self.catalog, self.manifest, window)
+                if ofn is not None:
+                    print '... output: %s' % ofn
+                    # merges that were waiting for this output
+                    for rsfn in output_written(ofn, pending, waiting):
+                        self._merge(rsfn)
+
+                # slide the window, free files that no later window needs
+                if i+1 < len(fns):
+                    window = self._window(fns[i+1])
+                    lo = min([position[xfn] for xfn in window if xfn in position] + [i+1])
+                else:
+                    lo = len(fns)
+                while held and position[held[0][0]] < lo:
+                    fn, data, nbytes = held.popleft()
+                    del loaded[fn]
+                    self.budget.release(nbytes)
+
+            # merges not waiting on this run, or whose sources were not all written
+            for rsfn in sorted(ready + pending.keys()):
+                self._merge(rsfn)
+        finally:
+            self._stop.set()
+            self.budget.close()
+            while reading:
+                if read_q.get() is _done:
+                    reading = False
+            reader.join()
+        self.report()
+
+    def report(self):
+        print 'qccodar (stream) -- peak %.1f MB of parsed files held (ceiling %.0f MB), ' \
+            'reader waited %d times' % (self.budget.peak/1048576., self.budget.limit/1048576.,
+                                        self.budget.stalls)
+
+def run_stream(datadir, pattern, catalog, fns, manifest=None, max_memory=max_memory,
+               skip_merge=None, source=None):
+    """ Run manual mode qc and merge of fns streaming in bounded memory """
+    stream = Stream(datadir, pattern, catalog, manifest, max_memory, source)
+    stream.run(fns, skip_merge)
+    return stream
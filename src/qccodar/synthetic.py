@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+#
+"""Synthetic RadialMetric (LLUV RDM1) files for scaling and stress tests.
+
+Writes a series of RadialMetric files with the 34 columns of
+%TableColumnTypes that SeaSonde RadialSuite writes, with values drawn
+like those of the HATY test files: MUSIC single and dual-angle
+solutions (MSEL 1, 2, 3), DOA peak power and SNR in dB falling off
+with range, half-power widths with NaNs, and files with no radial
+data.  The number of range cells, Doppler cells per range, bearing
+coverage and number of files can be set far beyond the test files,
+e.g. for high-resolution sites or months of data.
+
+Each file is made from a random generator seeded with (seed, file
+number), so the same settings and seed always give the same files,
+whichever files of the series are written.
+
+Run as qccodar-synthetic or python -m qccodar.synthetic.
+
+Usage:
+  qccodar-synthetic DATADIR [options]
+
+Options:
+  -p PAT --pattern PAT      Pattern type [default: IdealPattern]
+  --site SITE               Site code [default: SYNT]
+  --start TIME              Time of the first file, YYYY-MM-DDTHH:MM [default: 2013-11-04T22:30]
+  -n NUM --numfiles NUM     Number of files [default: 7]
+  --interval MIN            Minutes between files [default: 30]
+  --preset NAME             Settings of a kind of site (haty | hires) [default: haty]
+  --range-cells NUM         Range cells (default from preset)
+  --doppler-cells NUM       Doppler cells with radials per range cell (default from preset)
+  --coverage DEG            Width of bearing coverage in degrees (default from preset)
+  --empty FRAC              Fraction of files with no radial data [default: 0.0]
+  --seed NUM                Seed of the random generator [default: 0]
+  -h --help                 Show this help message and exit
+
+"""
+import os
+import datetime
+
+import numpy
+
+from .catalog import lluvtype_for
+
+TYPES_STR = 'LOND LATD VELU VELV VFLG RNGE BEAR VELO HEAD SPRC SPDC MSEL MSA1 MDA1 MDA2 MEGR ' \
+            'MPKR MOFR MSP1 MDP1 MDP2 MSW1 MDW1 MDW2 MSR1 MDR1 MDR2 MA1S MA2S MA3S MEI1 MEI2 ' \
+            'MEI3 MDRJ '
+
+# output format of each column, as in RadialSuite files
+FORMATS = ['%14.7f', '%11.7f', '%8.3f', '%8.3f', '%10d', '%9.4f', '%7.1f', '%10.3f', '%9.1f',
+           '%9d', '%8d', '%5d', '%10.1f', '%9.1f', '%9.1f', '%13.3f', '%12.3f', '%12.8f',
+           '%8.1f', '%9.1f', '%9.1f', '%9.1f', '%9.1f', '%9.1f', '%10.1f', '%9.1f', '%9.1f',
+           '%7.1f', '%9.1f', '%9.1f', '%15e', '%13e', '%13e', '%6d']
+
+# settings of a kind of site, the haty preset is about the size of the
+# HATY test files (31 range cells, ~8000 rows)
+PRESETS = {'haty' : {'range_cells' : 31, 'doppler_cells' : 210, 'coverage' : 300.0,
+                     'origin' : (35.2572667, -75.5200500), 'range_resolution' : 5.8249,
+                     'antenna_bearing' : 127.0, 'freq' : 4.537183},
+           'hires' : {'range_cells' : 120, 'doppler_cells' : 300, 'coverage' : 360.0,
+                      'origin' : (35.2572667, -75.5200500), 'range_resolution' : 1.4986,
+                      'antenna_bearing' : 127.0, 'freq' : 13.45},
+}
+
+# fraction of MUSIC solutions that are dual-angle (two rows, MSEL 2
+# and 3), of single solutions with a dual solution also computed, and
+# of half-power widths that are NaN
+dual_fraction = 0.23
+dual_computed = 0.37
+nan_fraction = 0.08
+
+HEADER = """%%CTF: 1.00
+%%FileType: LLUV rdls "RadialMap"
+%%LLUVSpec: 1.18  2012 05 07
+%%UUID: %(uuid)s
+%%Manufacturer: CODAR Ocean Sensors. SeaSonde
+%%Site: %(site)s ""
+%%TimeStamp: %(timestamp)s
+%%TimeZone: "UTC" +0.000 0 "Atlantic/Reykjavik"
+%%TimeCoverage: %(coverage_minutes).3f Minutes
+%%Origin: %(lat)11.7f %(lon)12.7f
+%%GreatCircle: "WGS84" 6378137.000  298.257223562997
+%%GeodVersion: "CGEO" 1.57  2009 03 10
+%%LLUVTrustData: all %%%% all lluv xyuv rbvd
+%%RangeStart: %(range_start)d
+%%RangeEnd: %(range_end)d
+%%RangeResolutionKMeters: %(range_resolution)f
+%%AntennaBearing: %(antenna_bearing).1f True
+%%ReferenceBearing: 0 True
+%%AngularResolution: 1 Deg
+%%SpatialResolution: 5 Deg
+%%PatternType: %(pattern_name)s
+%%PatternDate: 2009 04 30  11 21 12
+%%PatternResolution: 1.0 deg
+%%TransmitCenterFreqMHz: %(freq)f
+%%DopplerResolutionHzPerBin: 0.000488281
+%%FirstOrderMethod: 0
+%%BraggSmoothingPoints: 3
+%%CurrentVelocityLimit: 250.0
+%%BraggHasSecondOrder: 0
+%%RadialBraggPeakDropOff: 398.110
+%%RadialBraggPeakNull: 100.000
+%%RadialBraggNoiseThreshold: 5.000
+%%PatternAmplitudeCorrections: 1.0000  1.0000
+%%PatternPhaseCorrections: 70.00  35.00
+%%PatternAmplitudeCalculations: 0.7092  0.5904
+%%PatternPhaseCalculations: 71.10  50.00
+%%RadialMusicParameters: 40.000 20.000 2.000
+%%FirstOrderCalc: 1
+%%PatternMethod: 1 PatternVectors
+%%TransmitSweepRateHz: 1.000000
+%%TransmitBandwidthKHz: -25.733913
+%%SpectraRangeCells: %(spectra_range_cells)d
+%%SpectraDopplerCells: 2048
+%%TableType: LLUV RDM1
+%%TableColumns: 34
+%%TableColumnTypes: %(types_str)s
+%%TableRows: %(rows)d
+%%TableStart:
+"""
+
+FOOTER = """%%TableEnd:
+%%%%
+%%ProcessedTimeStamp: %(timestamp)s
+%%ProcessingTool: "SpectraToRadial" 11.2.2
+%%ProcessingTool: "RadialArchiver" 11.3.3
+%%End:
+"""
+
+def _lognormal(rng, median, sigma, size, lo, hi):
+    return numpy.clip(rng.lognormal(numpy.log(median), sigma, size), lo, hi)
+
+def synthetic_table(rng, range_cells=31, doppler_cells=210, coverage=300.0,
+                    origin=(35.2572667, -75.5200500), range_resolution=5.8249,
+                    antenna_bearing=127.0, range_start=3, **kw):
+    """ Radial table (ndarray with the columns of TYPES_STR) drawn from rng
+
+    For each range cell, doppler_cells Doppler cells have a MUSIC
+    solution: one row (MSEL 1) or, for dual-angle solutions, two rows
+    (MSEL 2 and 3) with the same Doppler cell and metrics.
+    """
+    c = dict((t, i) for i, t in enumerate(TYPES_STR.split()))
+    sprc = numpy.repeat(numpy.arange(range_start, range_start+range_cells), doppler_cells)
+    # Doppler cells either side of the Bragg lines, 1.614 cm/s per cell
+    side = rng.randint(0, 2, sprc.size)
+    spdc = numpy.where(side, rng.randint(1400, 1530, sprc.size), rng.randint(490, 620, sprc.size))
+    velo = numpy.where(side, (spdc-1420)*1.614, (spdc-575)*1.614)
+    n = sprc.size
+    dual = rng.random_sample(n) < dual_fraction
+
+    # bearings within coverage centred on the antenna bearing
+    def bearings(size):
+        b = antenna_bearing + (rng.random_sample(size)-0.5)*coverage
+        return numpy.round(b) % 360
+    msa1 = bearings(n)
+    computed = dual | (rng.random_sample(n) < dual_computed)
+    mda1 = numpy.where(computed, bearings(n), 1440.0)
+    mda2 = numpy.where(computed, bearings(n), 1440.0)
+
+    # signal falls off with range, metrics in dB and their spread
+    falloff = (sprc - range_start) / float(max(range_cells-1, 1))
+    ma3s = rng.normal(24.0 - 18.0*falloff, 6.0)
+    ma1s = ma3s - rng.normal(3.0, 4.0, n)
+    ma2s = ma3s - rng.normal(4.5, 4.0, n)
+    msp1 = numpy.clip(rng.normal(-96.0 - 14.0*falloff, 5.0), -125.0, -70.0)
+    mdp1 = numpy.where(computed, numpy.clip(msp1 - rng.normal(10.0, 4.0, n), -130.0, -75.0), -200.0)
+    mdp2 = numpy.where(computed, numpy.clip(msp1 - rng.normal(12.0, 4.0, n), -130.0, -75.0), -200.0)
+    msw1 = _lognormal(rng, 34.0, 1.0, n, 1.0, 180.0)
+    mdw1 = numpy.where(computed, numpy.round(_lognormal(rng, 4.0, 1.6, n, 0.0, 179.0)), 0.0)
+    mdw2 = numpy.where(computed, numpy.round(_lognormal(rng, 76.0, 0.9, n, 0.0, 180.0)), 0.0)
+    msw1 = numpy.round(msw1)
+    msw1[rng.random_sample(n) < nan_fraction] = numpy.nan
+    nan_dual = computed & (rng.random_sample(n) < nan_fraction/4)
+    mdw1[nan_dual] = numpy.nan
+    mdw2[nan_dual] = numpy.nan
+    msr1 = _lognormal(rng, 10.8, 1.4, n, 0.7, 5000.0)
+    mdr1 = numpy.where(computed, _lognormal(rng, 24.0, 2.5, n, 0.0, 3.0e6), 0.0)
+    mdr2 = numpy.where(computed, _lognormal(rng, 3.0, 1.8, n, 0.0, 4.0e4), 0.0)
+    mei1 = _lognormal(rng, 7.5e-11, 1.4, n, 1e-12, 1e-7)
+    mei2 = mei1 / _lognormal(rng, 15.0, 1.3, n, 1.1, 5000.0)
+    mei3 = mei2 / _lognormal(rng, 8.0, 1.0, n, 1.1, 1000.0)
+    megr = mei1 / mei2
+    mpkr = _lognormal(rng, 1.64, 1.2, n, 1.0, 350.0)
+    mofr = numpy.where(computed, rng.random_sample(n)*0.98, 0.0)
+    mdrj = rng.choice([0, 1, 2, 3, 4, 5, 7, 16, 17], n,
+                      p=[0.38, 0.005, 0.005, 0.03, 0.08, 0.07, 0.03, 0.26, 0.14])
+    vflg = rng.choice([0, 64, 128, 192, 1024, 1088, 1152, 1216], n,
+                      p=[0.80, 0.02, 0.03, 0.10, 0.02, 0.01, 0.01, 0.01])
+
+    # one row per single solution, two rows (MSEL 2 and 3) per dual
+    rows = numpy.concatenate([numpy.arange(n), numpy.flatnonzero(dual)])
+    msel = numpy.concatenate([numpy.where(dual, 2, 1), numpy.repeat(3, dual.sum())])
+    rows_order = numpy.lexsort((msel, spdc[rows], sprc[rows]))
+    rows, msel = rows[rows_order], msel[rows_order]
+
+    d = numpy.zeros((rows.size, len(c)))
+    d[:, c['SPRC']] = sprc[rows]
+    d[:, c['SPDC']] = spdc[rows]
+    d[:, c['MSEL']] = msel
+    bear = numpy.where(msel == 1, msa1[rows], numpy.where(msel == 2, mda1[rows], mda2[rows]))
+    d[:, c['BEAR']] = bear
+    rnge = sprc[rows] * range_resolution
+    d[:, c['RNGE']] = rnge
+    d[:, c['VELO']] = velo[rows]
+    head = (bear + 180.0) % 360
+    d[:, c['HEAD']] = head
+    d[:, c['VELU']] = velo[rows] * numpy.sin(numpy.radians(head))
+    d[:, c['VELV']] = velo[rows] * numpy.cos(numpy.radians(head))
+    # flat earth is close enough for test data
+    lat0, lon0 = origin
+    d[:, c['LATD']] = lat0 + rnge*numpy.cos(numpy.radians(bear))/111.32
+    d[:, c['LOND']] = lon0 + rnge*numpy.sin(numpy.radians(bear))/(111.32*numpy.cos(numpy.radians(lat0)))
+    for name, values in [('VFLG', vflg), ('MSA1', msa1), ('MDA1', mda1), ('MDA2', mda2),
+                         ('MEGR', megr), ('MPKR', mpkr), ('MOFR', mofr), ('MSP1', msp1),
+                         ('MDP1', mdp1), ('MDP2', mdp2), ('MSW1', msw1), ('MDW1', mdw1),
+                         ('MDW2', mdw2), ('MSR1', msr1), ('MDR1', mdr1), ('MDR2', mdr2),
+                         ('MA1S', ma1s), ('MA2S', ma2s), ('MA3S', ma3s), ('MEI1', mei1),
+                         ('MEI2', mei2), ('MEI3', mei3), ('MDRJ', mdrj)]:
+        d[:, c[name]] = values[rows]
+    return d
+
+def synthetic_lluv(rng, dt, site='SYNT', pattern='IdealPattern', empty=False, interval=30,
+                   preset='haty', **kw):
+    """ read_lluv_file() style (d, types_str, header, footer) for a file at dt """
+    settings = dict(PRESETS[preset])
+    settings.update((k, v) for k, v in kw.items() if v is not None)
+    range_start = 3
+    uuid = '%08X-%04X-%04X-%04X-%012X' % tuple(rng.randint(0, 2**b, dtype=numpy.int64)
+                                               for b in [32, 16, 16, 16, 48])
+    if empty:
+        d = numpy.array([])
+    else:
+        d = synthetic_table(rng, range_start=range_start, **settings)
+    info = {'uuid' : uuid, 'site' : site,
+            'timestamp' : dt.strftime('%Y %m %d  %H %M %S'),
+            'coverage_minutes' : interval,
+            'lat' : settings['origin'][0], 'lon' : settings['origin'][1],
+            'range_start' : range_start, 'range_end' : range_start+settings['range_cells']-1,
+            'range_resolution' : settings['range_resolution'],
+            'antenna_bearing' : settings['antenna_bearing'],
+            'pattern_name' : 'Ideal' if pattern == 'IdealPattern' else 'Measured',
+            'freq' : settings['freq'],
+            'spectra_range_cells' : range_start+settings['range_cells']+29,
+            'types_str' : TYPES_STR,
+            'rows' : d.shape[0] if d.size else 0}
+    header = HEADER % info
+    footer = FOOTER % {'timestamp' : dt.strftime('%Y %m %d  %H %M %S')}
+    return d, TYPES_STR, header, footer
+
+def write_lluv(ofn, d, header, footer):
+    """ Write a RadialMetric file with the column formats of RadialSuite """
+    f = open(ofn, 'w')
+    try:
+        f.write(header)
+        if d.size > 0:
+            numpy.savetxt(f, d, fmt=FORMATS)
+        f.write(footer)
+    finally:
+        f.close()
+
+def write_synthetic(datadir, numfiles=7, start=datetime.datetime(2013, 11, 4, 22, 30), interval=30,
+                    site='SYNT', pattern='IdealPattern', seed=0, empty=0.0, **kw):
+    """ Write numfiles synthetic RadialMetric files to datadir/RadialMetric/pattern
+
+    empty is the fraction of files with no radial data; other keywords
+    (preset, range_cells, doppler_cells, coverage, ...) set the
+    radial table (see synthetic_table).  Returns the filenames.
+    """
+    rmdir = os.path.join(datadir, 'RadialMetric', pattern)
+    for folder in [rmdir, os.path.join(datadir, 'RadialShorts_qcd', pattern),
+                   os.path.join(datadir, 'Radials_qcd', pattern)]:
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+    fns = []
+    for i in range(numfiles):
+        rng = numpy.random.RandomState([seed, i])
+        dt = start + datetime.timedelta(minutes=i*interval)
+        d, types_str, header, footer = synthetic_lluv(rng, dt, site, pattern,
+                                                      empty=rng.random_sample() < empty,
+                                                      interval=interval, **kw)
+        ofn = os.path.join(rmdir, 'RDL%s_%s_%s.ruv' % (lluvtype_for('RadialMetric', pattern), site,
+                                                       dt.strftime('%Y_%m_%d_%H%M')))
+        write_lluv(ofn, d, header, footer)
+        fns.append(ofn)
+    return fns
+
+def main():
+    from docopt import docopt
+    arguments = docopt(__doc__)
+    optional = lambda key, kind: kind(arguments[key]) if arguments[key] else None
+    fns = write_synthetic(arguments['DATADIR'],
+                          numfiles=int(arguments['--numfiles']),
+                          start=datetime.datetime.strptime(arguments['--start'], '%Y-%m-%dT%H:%M'),
+                          interval=int(arguments['--interval']),
+                          site=arguments['--site'],
+                          pattern=arguments['--pattern'],
+                          seed=int(arguments['--seed']),
+                          empty=float(arguments['--empty']),
+                          preset=arguments['--preset'],
+                          range_cells=optional('--range-cells', int),
+                          doppler_cells=optional('--doppler-cells', int),
+                          coverage=optional('--coverage', float))
+    print 'qccodar (synthetic) -- %d files in %s' % (len(fns), os.path.dirname(fns[0]) if fns else '')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+#
+""" Task-graph executor for manual mode
+
+A reprocessing job is a graph of tasks built from the catalogue:
+
+  read  -- parse one RadialMetric file, used by the 3 or 5 qc windows
+           that include it
+  qc    -- stack a window, qc, average and write RadialShorts_qcd
+           (qcutils.process_file())
+  merge -- run LLUVMerger on a merge source, after the qc of all its
+           RadialShorts_qcd sources made in this run
+
+Each task runs once, on a pool of worker threads, as soon as the tasks
+it depends on are done.  Tasks further down the graph go first, and
+reads are held back while enough parsed files are waiting, so the
+result of a read is freed once the last qc that uses it is done and
+only a few windows of parsed files are in memory.  At the end the
+critical path, the chain of tasks that determined the run time, is
+reported.
+
+"""
+import os
+import time
+import heapq
+import Queue
+import threading
+import collections
+
+from .qcutils import read_lluv_file, read_or_error, find_files_to_merge, process_file, \
+    radialshort_filename, qc_params
+from .codarutils import run_LLUVMerger, merge_params
+from .manifest import merge_sources
+from .pipeline import merge_plan
+
+debug = 1
+
+class Task(object):
+    """ A node of the graph, func is called with the results of deps """
+    def __init__(self, name, func, deps, priority, buffered):
+        self.name = name
+        self.func = func
+        self.deps = deps
+        self.priority = priority
+        self.buffered = buffered
+        self.consumers = []
+        self.start = None
+        self.end = None
+
+
+class TaskGraph(object):
+    """Tasks with dependencies, run once each on a pool of threads.
+
+    Ready tasks of lower priority value go first.  Results of buffered
+    tasks (e.g. parsed files) count against max_buffered: while that
+    many are held, no more buffered tasks are started unless nothing
+    else can run.  A result is freed when its last consumer is done.
+    """
+    def __init__(self):
+        self.tasks = collections.OrderedDict()
+
+    def add(self, name, func, deps=(), priority=0, buffered=False):
+        task = Task(name, func, list(deps), priority, buffered)
+        for dep in task.deps:
+            self.tasks[dep].consumers.append(name)
+        self.tasks[name] = task
+        return task
+
+    def run(self, workers=2, max_buffered=None):
+        """ Run all tasks, return the results of tasks no other task consumes """
+        workers = max(int(workers), 1)
+        if max_buffered is None:
+            max_buffered = 2*qc_params['numfiles'] + workers
+        work_q, done_q = Queue.Queue(), Queue.Queue()
+
+        def worker():
+            while True:
+                task = work_q.get()
+                if task is None:
+                    break
+                args = [results[dep] for dep in task.deps]
+                task.start = time.time()
+                try:
+                    result, error = task.func(*args), None
+                except Exception, e:
+                    result, error = None, e
+                task.end = time.time()
+                done_q.put((task, result, error))
+
+        results, outputs = {}, {}
+        waiting = dict((name, len(task.deps)) for name, task in self.tasks.items())
+        unconsumed = dict((name, len(task.consumers)) for name, task in self.tasks.items())
+        order = dict((name, i) for i, name in enumerate(self.tasks))
+        ready = []
+        for name, n in waiting.items():
+            if n == 0:
+                task = self.tasks[name]
+                heapq.heappush(ready, (task.priority, order[name], name))
+        inflight, buffered, errors = 0, 0, []
+
+        threads = [threading.Thread(target=worker) for i in range(workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        self.t0 = time.time()
+        try:
+            while ready or inflight:
+                held = []
+                while ready and inflight < workers and not errors:
+                    item = heapq.heappop(ready)
+                    task = self.tasks[item[2]]
+                    if task.buffered and buffered >= max_buffered and inflight > 0:
+                        held.append(item)
+                        continue
+                    if task.buffered:
+                        buffered += 1
+                    inflight += 1
+                    work_q.put(task)
+                for item in held:
+                    heapq.heappush(ready, item)
+                if inflight == 0:
+                    break
+                task, result, error = done_q.get()
+                inflight -= 1
+                if error is not None:
+                    errors.append(error)
+                    continue
+                if task.consumers:
+                    results[task.name] = result
+                else:
+                    outputs[task.name] = result
+                # free results whose last consumer is done
+                for dep in task.deps:
+                    unconsumed[dep] -= 1
+                    if unconsumed[dep] == 0:
+                        del results[dep]
+                        if self.tasks[dep].buffered:
+                            buffered -= 1
+                for name in task.consumers:
+                    waiting[name] -= 1
+                    if waiting[name] == 0:
+                        heapq.heappush(ready, (self.tasks[name].priority, order[name], name))
+        finally:
+            for t in threads:
+                work_q.put(None)
+            for t in threads:
+                t.join()
+        self.t1 = time.time()
+        if errors:
+            raise errors[0]
+        return outputs
+
+    def critical_path(self):
+        """ Tasks (first to last) of the chain that ended last
+
+        Going back from the task that finished last, each step is to
+        the dependency that finished last, the one it had to wait for.
+        """
+        done = [task for task in self.tasks.values() if task.end is not None]
+        if not done:
+            return []
+        task = max(done, key=lambda t: t.end)
+        path = [task]
+        while task.deps:
+            task = max((self.tasks[dep] for dep in task.deps), key=lambda t: t.end)
+            path.append(task)
+        return path[::-1]
+
+    def report(self):
+        counts = collections.Counter(name.split()[0] for name in self.tasks)
+        print 'qccodar (taskgraph) -- %d tasks (%s) in %.1f s' % \
+            (len(self.tasks), ', '.join('%d %s' % (counts[k], k) for k in sorted(counts)), self.t1-self.t0)
+        path = self.critical_path()
+        if path:
+            print '... critical path %.1f s (%.1f s running):' % \
+                (path[-1].end - path[0].start, sum(t.end-t.start for t in path))
+            for task in path:
+                print '...   %-60s %6.2f s' % (task.name, task.end-task.start)
+
+
+def build_graph(datadir, pattern, catalog, fns, manifest=None, skip_merge=None, source=None):
+    """ TaskGraph of read, qc and merge tasks of manual mode for fns """
+    read = source.read_lluv_file if source is not None else read_lluv_file
+    lock = threading.Lock()     # guards catalog and manifest updates
+    graph = TaskGraph()
+
+    def qc(ifn, window):
+        def func(*data):
+            data = dict(zip(window, data))
+            print '... input: %s' % ifn
+            # reads are shared by windows, the qc does not modify them
+            ofn = process_file(datadir, ifn, pattern, data[ifn],
+                               [(xfn, data[xfn]) for xfn in window if xfn != ifn],
+                               catalog, manifest, window, lock=lock)
+            if ofn is not None:
+                print '... output: %s' % ofn
+            return ofn
+        return func
+
+    def merge(rsfn):
+        def func(*ofns):
+            print '... merge input: %s' % rsfn
+            ofn = run_LLUVMerger(datadir, os.path.basename(rsfn), pattern)
+            print '... merge output: %s' % ofn
+            if ofn:
+                with lock:
+                    catalog.add(ofn, pattern)
+                    if manifest is not None:
+                        manifest.record(ofn, merge_sources(catalog, rsfn, pattern, merge_params),
+                                        merge_params, 'Radials')
+            return ofn
+        return func
+
+    windows = [(ifn, find_files_to_merge(ifn, qc_params['numfiles'], qc_params['sample_interval'],
+                                         catalog=catalog, patterntype=pattern)) for ifn in fns]
+    for ifn, window in windows:
+        for xfn in window:
+            if 'read %s' % xfn not in graph.tasks:
+                graph.add('read %s' % xfn, lambda xfn=xfn: read_or_error(read, xfn), priority=2, buffered=True)
+    qctask = {}
+    for ifn, window in windows:
+        ofn = radialshort_filename(datadir, os.path.basename(ifn), pattern)
+        graph.add('qc %s' % ifn, qc(ifn, window), ['read %s' % xfn for xfn in window], priority=1)
+        qctask[ofn] = 'qc %s' % ifn
+
+    ready, pending, waiting = merge_plan(datadir, pattern, catalog, fns, skip_merge)
+    for rsfn in sorted(ready + pending.keys()):
+        graph.add('merge %s' % rsfn, merge(rsfn),
+                  sorted(qctask[ofn] for ofn in pending.get(rsfn, ())), priority=0)
+    return graph
+
+def run_taskgraph(datadir, pattern, catalog, fns, manifest=None, workers=2, skip_merge=None,
+                  source=None):
+    """ Run manual mode qc and merge of fns as a task graph """
+    graph = build_graph(datadir, pattern, catalog, fns, manifest, skip_merge, source)
+    graph.run(workers)
+    graph.report()
+    return graph
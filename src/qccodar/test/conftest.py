@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#
+"""
+Fixtures shared by the tests of the run modes and executors.
+
+"""
+import os
+import shutil
+import pytest
+import qccodar.app as app
+import qccodar.batch as batch
+import qccodar.pipeline as pipeline
+import qccodar.taskgraph as taskgraph
+import qccodar.stream as stream
+
+files = os.path.join(os.path.curdir, 'test', 'files')
+indir = os.path.join(files, 'codar_raw', 'RadialMetric', 'IdealPattern')
+
+@pytest.fixture
+def make_datadir(tmpdir):
+    """ make_datadir(fns) makes a datadir in tmpdir with copies of the RadialMetric files fns
+
+    The RadialShorts_qcd and Radials_qcd folders are made too, unless
+    outdirs is False.  Each datadir is a new folder of tmpdir, named
+    name if given.
+    """
+    made = []
+    def make(fns, name=None, outdirs=True):
+        made.append(name)
+        datadir = str(tmpdir.join(name or 'datadir%d' % len(made)))
+        rmdir = os.path.join(datadir, 'RadialMetric', 'IdealPattern')
+        os.makedirs(rmdir)
+        for fn in fns:
+            shutil.copy(os.path.join(indir, fn), rmdir)
+        if outdirs:
+            for folder in ['RadialShorts_qcd', 'Radials_qcd']:
+                os.makedirs(os.path.join(datadir, folder, 'IdealPattern'))
+        return datadir
+    return make
+
+@pytest.fixture
+def merged(monkeypatch):
+    """ The merge sources given to LLUVMerger, stood in for in app, batch and the executors """
+    merged = []
+    # no LLUVMerger outside of SeaSonde systems
+    fake = lambda datadir, fn, pattern: merged.append(fn) or ''
+    for module in [app, batch, pipeline, taskgraph, stream]:
+        monkeypatch.setattr(module, 'run_LLUVMerger', fake)
+    return merged
+
+@pytest.fixture
+def run_manual(merged):
+    """ run_manual(datadir, executor) runs manual mode and returns the sorted merge sources """
+    def run(datadir, executor='serial', **kw):
+        del merged[:]
+        app.manual(datadir, 'IdealPattern', executor=executor, **kw)
+        return sorted(merged)
+    return run
+
+class ListSink(object):
+    """ Metrics sink keeping the records in a list """
+    def __init__(self):
+        self.records = []
+    def emit(self, record):
+        self.records.append(record)
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'timing: timed against a budget, deselect with -m "not timing" on a busy machine')
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+#
+"""
+Tests for tar and zip archives of RadialMetric files as input.
+
+"""
+import os
+import tarfile
+import zipfile
+import pytest
+import qccodar.app as app
+from qccodar.archive import *
+from qccodar.qcutils import find_files_to_merge
+from conftest import indir
+
+fns = ['RDLv_HATY_2013_11_04_2230.ruv', 'RDLv_HATY_2013_11_04_2300.ruv',
+       'RDLv_HATY_2013_11_04_2330.ruv']
+
+def _make_archives(topdir):
+    tarfn = os.path.join(topdir, 'HATY_2013_11.tar.gz')
+    tar = tarfile.open(tarfn, 'w:gz')
+    for fn in fns:
+        tar.add(os.path.join(indir, fn), arcname='RadialMetric/IdealPattern/'+fn)
+    tar.close()
+    # members without folders, pattern from the LLUV type
+    zipfn = os.path.join(topdir, 'HATY_2013_11b.zip')
+    z = zipfile.ZipFile(zipfn, 'w')
+    for fn in fns:
+        z.write(os.path.join(indir, fn), arcname=fn)
+    z.writestr('README.txt', 'not a RadialMetric file')
+    z.close()
+    return tarfn, zipfn
+
+def test_archive_index_and_windows(tmpdir):
+    topdir = str(tmpdir)
+    tarfn, zipfn = _make_archives(topdir)
+    assert is_archive(tarfn) and is_archive(zipfn)
+    assert not is_archive(indir)
+    assert archive_outdir(tarfn) == os.path.join(topdir, 'HATY_2013_11')
+    for fn in [tarfn, zipfn]:
+        source = ArchiveSource(fn)
+        assert source.patterns() == ['IdealPattern']
+        paths = source.paths('IdealPattern')
+        assert [os.path.basename(p) for p in paths] == fns
+        catalog = source.catalog('IdealPattern')
+        assert find_files_to_merge(paths[1], catalog=catalog, patterntype='IdealPattern') == paths
+        d, types_str, header, footer = source.read_lluv_file(paths[1])
+        assert d.shape[0] > 0 and footer.strip().endswith('%End:')
+        # the cached table, not a copy, and it cannot be changed
+        assert source.read_lluv_file(paths[1])[0] is d
+        with pytest.raises(ValueError):
+            d[:] = 0
+        source.close()
+
+def test_manual_on_archive_same_as_tree(tmpdir, make_datadir, run_manual, monkeypatch):
+    tarfn, zipfn = _make_archives(str(tmpdir))
+    treedir = make_datadir(fns, 'tree')
+    run_manual(treedir)
+    run_manual(tarfn)
+    run_manual(zipfn, executor='pipeline')
+    outdir = os.path.join(treedir, 'RadialShorts_qcd', 'IdealPattern')
+    assert len(os.listdir(outdir)) == 3
+    for archivefn in [tarfn, zipfn]:
+        outdir2 = os.path.join(archive_outdir(archivefn), 'RadialShorts_qcd', 'IdealPattern')
+        assert sorted(os.listdir(outdir2)) == sorted(os.listdir(outdir))
+        for fn in os.listdir(outdir):
+            assert open(os.path.join(outdir, fn)).read() == open(os.path.join(outdir2, fn)).read()
+    # update finds the archive outputs up to date
+    done = []
+    monkeypatch.setattr(app, 'do_qc', lambda *args, **kw: done.append(args[1]))
+    app.update(tarfn, 'IdealPattern')
+    assert done == []
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+"""
+Tests for multi-site batch mode.
+
+"""
+import os
+import numpy
+import collections
+import pytest
+from qccodar.batch import *
+from qccodar.batch import _next_job
+from qccodar.bufferpool import BufferPool, PoolSource, shm_dir
+from qccodar.qcutils import do_qc, qc_params
+from conftest import indir
+
+def test_read_batch_config(tmpdir):
+    configfn = os.path.join(str(tmpdir), 'batch.cfg')
+    f = open(configfn, 'w')
+    f.write('[HATY]\ndatadir = /data/HATY\npatterns = IdealPattern, MeasPattern\n\n')
+    f.write('[DUCK]\ndatadir = /data/DUCK\n')
+    f.close()
+    assert read_batch_config(configfn) == [('HATY', '/data/HATY', 'IdealPattern'),
+                                           ('HATY', '/data/HATY', 'MeasPattern'),
+                                           ('DUCK', '/data/DUCK', 'IdealPattern')]
+
+def test_run_batch_two_sites(tmpdir, make_datadir, merged):
+    fns = ['RDLv_HATY_2013_11_04_2330.ruv', 'RDLv_HATY_2013_11_05_0000.ruv']
+    # workers inherit the fake merger
+    targets = [('SITE1', make_datadir(fns, 'SITE1', outdirs=False), 'IdealPattern'),
+               ('SITE2', make_datadir(fns[0:1], 'SITE2', outdirs=False), 'IdealPattern'),
+               ('SITE3', os.path.join(str(tmpdir), 'missing'), 'IdealPattern')]
+    stats = run_batch(targets, workers=2)
+    assert sorted(stats) == ['SITE1', 'SITE2']
+    assert (stats['SITE1'].qc, stats['SITE1'].merge, stats['SITE1'].errors) == (2, 1, 0)
+    assert (stats['SITE2'].qc, stats['SITE2'].merge, stats['SITE2'].errors) == (1, 0, 0)
+    outdir = os.path.join(str(tmpdir), 'SITE1', 'RadialShorts_qcd', 'IdealPattern')
+    assert sorted(os.listdir(outdir)) == ['RDLx_HATY_2013_11_04_2330.ruv', 'RDLx_HATY_2013_11_05_0000.ruv']
+
+class _Jobs(object):
+    def __init__(self, pattern, n):
+        self.pattern = pattern
+        self.jobs = collections.deque('%s %d' % (pattern, i) for i in range(n))
+
+def test_next_job_patterns_in_turn():
+    # a backlog of one pattern does not hold up the other pattern of the site
+    sites = collections.OrderedDict([('HATY', [_Jobs('IdealPattern', 6), _Jobs('MeasPattern', 2)]),
+                                     ('DUCK', [_Jobs('IdealPattern', 1)])])
+    running = {'HATY' : 0, 'DUCK' : 1}
+    stats = {'HATY' : SiteStats(), 'DUCK' : SiteStats()}
+    turn = {}
+    jobs = []
+    while True:
+        item = _next_job(sites, running, stats, turn)
+        if item is None:
+            break
+        jobs.append(item[2])
+        # DUCK has one running until HATY is done
+        if not any(t.jobs for t in sites['HATY']):
+            running['DUCK'] = 0
+    assert jobs == ['IdealPattern 0', 'MeasPattern 0', 'IdealPattern 1', 'MeasPattern 1',
+                    'IdealPattern 2', 'IdealPattern 3', 'IdealPattern 4', 'IdealPattern 5',
+                    'IdealPattern 0']
+
+def test_buffer_pool(make_datadir):
+    pool = BufferPool()
+    try:
+        ifn = os.path.join(indir, 'RDLv_HATY_2013_11_04_2300.ruv')
+        assert pool.get(ifn) is None
+        d, types_str, header, footer = pool.read_lluv_file(ifn)
+        d1, types_str1, header1, footer1 = pool.get(ifn)
+        assert isinstance(d1, numpy.memmap)
+        numpy.testing.assert_array_equal(d1, d)
+        assert (types_str1, header1, footer1) == (types_str, header, footer)
+        # readers map the shared table, read-only
+        d2 = pool.read_lluv_file(ifn)[0]
+        assert isinstance(d2, numpy.memmap) and not d2.flags.writeable
+        with pytest.raises(ValueError):
+            d2[:] = 0
+        numpy.testing.assert_array_equal(d2, d)
+        # the qc of a file on its own only reads the mapped table
+        saved = dict(qc_params)
+        qc_params['numfiles'] = 1
+        try:
+            ofn = do_qc(make_datadir([]), os.path.basename(ifn), 'IdealPattern',
+                        source=PoolSource(pool.dir, [ifn]))
+        finally:
+            qc_params.update(saved)
+        assert os.path.getsize(ofn) > 0
+        pool.put('empty.ruv', (numpy.array([]), '', '%CTF: 1.00\n', ''))
+        assert pool.get('empty.ruv')[0].size == 0
+        pool.release(ifn)
+        assert pool.get(ifn) is None
+    finally:
+        pool.close()
+    assert not os.path.exists(pool.dir)
+
+def test_run_batch_shared_same_output(make_datadir, merged):
+    fns = ['RDLv_HATY_2013_11_04_2300.ruv', 'RDLv_HATY_2013_11_04_2330.ruv',
+           'RDLv_HATY_2013_11_05_0000.ruv']
+    datadir = make_datadir(fns, 'SITE1', outdirs=False)
+    refdir = make_datadir(fns, 'REF')
+    pools = set(os.listdir(shm_dir()))
+    stats = run_batch([('SITE1', datadir, 'IdealPattern')], workers=3)
+    assert stats['SITE1'].qc == 3
+    # the pool is removed
+    assert set(os.listdir(shm_dir())) == pools
+    for fn in fns:
+        ofn = do_qc(refdir, fn, 'IdealPattern')
+        assert open(ofn).read() == \
+            open(os.path.join(datadir, 'RadialShorts_qcd', 'IdealPattern', os.path.basename(ofn))).read()
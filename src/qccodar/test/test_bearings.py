@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+"""
+Tests for the rows of a bearing that qcviz plots.
+
+"""
+import os
+import numpy
+from qccodar.qcutils import *
+from qccodar.qcviz.bearings import *
+from conftest import indir
+
+# the subset functions of qcviz before the rows were indexed by bearing
+def _subset_rsdata(rsd, rsc, bearing):
+    xrow = numpy.where( (rsd[:,rsc['BEAR']]==bearing) & (rsd[:,rsc['VFLG']]==0))[0]
+    xcol = numpy.array([rsc['VELO'], rsc['SPRC'], rsc['BEAR']])
+    return rsd[numpy.ix_(xrow, xcol)]
+
+def _subset_data(d, c, bearing, numdegrees, flagged):
+    offset = ((numdegrees-1)/2)
+    which = d[:,c['VFLG']]>0 if flagged else d[:,c['VFLG']]==0
+    xrow = numpy.where( (d[:,c['BEAR']]>=bearing-offset) & \
+                        (d[:,c['BEAR']]<=bearing+offset) & which )[0]
+    xcol = numpy.array([c['VELO'], c['SPRC'], c['BEAR'], c['MA3S'], c['MSEL'], c['MSP1'], c['MDP1'], c['MDP2']])
+    a = d[numpy.ix_(xrow, xcol)]
+    MP = numpy.array(numpy.ones(a[:,0].shape)*numpy.nan)
+    for msel in [1, 2, 3]:
+        which = a[:,4]==msel
+        MP[which,] = a[which, msel+4]
+    return numpy.hstack((a,MP.reshape(MP.size,1)))
+
+def _flagged():
+    d, types_str, header, footer = read_lluv_file(os.path.join(indir, 'RDLv_HATY_2013_11_05_0000.ruv'))
+    return threshold_qc_all(d, types_str, thresholds=[5.0, 50.0, 5.0, 5.0]), types_str
+
+def _same(a, b):
+    # nan of the MUSIC power where MSEL is not 1, 2 or 3
+    return a.shape == b.shape and numpy.array_equal(numpy.isnan(a), numpy.isnan(b)) and \
+        (a[~numpy.isnan(a)] == b[~numpy.isnan(b)]).all()
+
+def test_rows_as_subset_functions():
+    d, types_str = _flagged()
+    c = get_columns(types_str)
+    assert (d[:,c['VFLG']]==0).any() and (d[:,c['VFLG']]>0).any()
+    index = BearingIndex(d, c, metric_columns)
+    for numdegrees in [1, 3, 5, 7]:
+        for flagged in [False, True]:
+            for bearing in range(360):
+                assert _same(index.rows(bearing, numdegrees, flagged),
+                             _subset_data(d, c, bearing, numdegrees, flagged))
+
+def test_rows_of_averages_as_subset_rsdata():
+    d, types_str = _flagged()
+    rsd, rstypes_str = weighted_velocities(d, types_str, numdegrees=3, weight_parameter='MP')
+    # flags some of the cells
+    rsd = threshold_rsd_numpoints(rsd, rstypes_str, numpoints=3)
+    rsc = get_columns(rstypes_str)
+    assert (rsd[:,rsc['VFLG']]>0).any()
+    index = BearingIndex(rsd, rsc, short_columns)
+    for bearing in range(360):
+        assert _same(index.rows(bearing), _subset_rsdata(rsd, rsc, bearing))
+
+def test_bearing_index_cache():
+    d, types_str = _flagged()
+    c = get_columns(types_str)
+    index = bearing_index(d, c, metric_columns)
+    assert bearing_index(d, c, metric_columns) is index
+    bearing = d[d[:,c['VFLG']]==0][0, c['BEAR']]
+    good = len(index.rows(bearing, 3))
+    # stricter thresholds, flags of a new array
+    d2 = threshold_qc_all(d, types_str, thresholds=[5.0, 50.0, 15.0, 5.0])
+    assert bearing_index(d2, c, metric_columns) is not index
+    # flagged again in place
+    d[:,c['VFLG']] = 1
+    index2 = bearing_index(d, c, metric_columns)
+    assert index2 is not index
+    assert len(index2.rows(bearing, 3)) == 0
+    assert len(index2.rows(bearing, 3, flagged=True)) >= good
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#
+"""
+Tests for the benchmark suite (not the timings themselves).
+
+"""
+import os
+import sys
+import json
+import pytest
+import qccodar.benchmark as benchmark
+from qccodar.benchmark import *
+
+def test_make_datadir_scaled(tmpdir):
+    workdir = str(tmpdir)
+    datadir1 = make_datadir(workdir, 1)
+    datadir3 = make_datadir(workdir, 3)
+    rmdir1 = os.path.join(datadir1, 'RadialMetric', 'IdealPattern')
+    rmdir3 = os.path.join(datadir3, 'RadialMetric', 'IdealPattern')
+    assert sorted(os.listdir(rmdir1)) == sorted(os.listdir(rmdir3)) == sorted(os.listdir(haty_dir))
+    fn = 'RDLv_HATY_2013_11_05_0000.ruv'
+    d1 = read_lluv_file(os.path.join(rmdir1, fn))[0]
+    d3 = read_lluv_file(os.path.join(rmdir3, fn))[0]
+    assert d3.shape == (3*d1.shape[0], d1.shape[1])
+
+def test_run_benchmarks_results():
+    results = run_benchmarks(scales=[1], repeat=2, only=['read', 'threshold', 'write'])
+    assert sorted(results['benchmarks']) == ['read/1', 'threshold/1', 'write/1']
+    for r in results['benchmarks'].values():
+        assert r['repeat'] == 2 and 0 < r['best'] <= r['mean'] and r['rows'] > 0
+    assert results['machine']['cpus'] > 0 and results['machine']['python']
+
+def test_compare_flags_regressions():
+    baseline = {'benchmarks' : {'read/1' : {'best' : 1.0}, 'weighted/1' : {'best' : 2.0}}}
+    results = {'benchmarks' : {'read/1' : {'best' : 1.2}, 'weighted/1' : {'best' : 3.0},
+                               'write/1' : {'best' : 9.0}}}
+    assert compare(results, baseline, tolerance=0.25) == [('weighted/1', 3.0, 2.0, 1.5)]
+    assert compare(results, baseline, tolerance=0.1) == [('read/1', 1.2, 1.0, 1.2),
+                                                         ('weighted/1', 3.0, 2.0, 1.5)]
+
+def test_memory_benchmark_and_limit():
+    results = run_benchmarks(scales=[1], repeat=1, only=['memory'])
+    assert results['benchmarks'] == {}
+    r = results['memory']['1']
+    assert r['input_bytes'] > 0 and r['peak_growth'] >= 0
+    assert r['ratio'] == float(r['peak_growth'])/r['input_bytes']
+    results = {'memory' : {'1' : {'ratio' : 2.5}, 'hires' : {'ratio' : 6.0}}}
+    assert memory_regressions(results, 4) == [('hires', 6.0)]
+    assert memory_regressions(results, 10) == []
+
+def test_reference_baseline_shipped():
+    baseline = json.load(open(reference_baseline))
+    assert 'weighted/1' in baseline['benchmarks'] and 'manual_qc/4' in baseline['benchmarks']
+    assert compare(baseline, baseline) == []
+
+def test_datadir_outside_checkout(tmpdir, monkeypatch):
+    tmpdir.mkdir('datadir').mkdir('RadialMetrics').mkdir('IdealPattern')
+    datadir = str(tmpdir.join('datadir'))
+    assert radialmetric_dir(datadir) == os.path.join(datadir, 'RadialMetrics', 'IdealPattern')
+    # as installed, without the files of the tests
+    monkeypatch.setattr(benchmark, 'haty_dir', str(tmpdir.join('missing')))
+    monkeypatch.setattr(sys, 'argv', ['qccodar-benchmark'])
+    with pytest.raises(SystemExit) as e:
+        benchmark.main()
+    assert e.value.code == 2
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+"""
+Tests for the timestamp-indexed file catalogue.
+
+"""
+import os
+import datetime
+from qccodar.qcutils import *
+from qccodar.catalog import *
+
+files = os.path.join(os.path.curdir, 'test', 'files')
+indir = os.path.join(files, 'codar_raw', 'RadialMetric', 'IdealPattern')
+ifn = os.path.join(indir, 'RDLv_HATY_2013_11_05_0000.ruv')
+
+def test_parse_lluv_filename():
+    assert parse_lluv_filename('RDLv_HATY_2013_11_05_0000.ruv') == \
+        ('HATY', 'v', datetime.datetime(2013, 11, 5, 0, 0))
+    assert parse_lluv_filename('/some/dir/RDLx_DUCK_2014_01_02_033000.ruv') == \
+        ('DUCK', 'x', datetime.datetime(2014, 1, 2, 3, 30))
+    assert parse_lluv_filename('test_output.txt') is None
+
+def test_parse_lluv_filename_as_filt_datetime(tmpdir, capsys):
+    # timestamps the baseline (filt_datetime) accepted
+    for fn in ['RDLv_HATY_20131105_0000.ruv', 'RDLv_HATY_2013-11-05T00:00:00.ruv',
+               'RDLv_HATY_2013_11_05_00.ruv', 'RDLv_HATY_2013_11_05.ruv']:
+        assert parse_lluv_filename(fn) == ('HATY', 'v', filt_datetime(fn)) == \
+            ('HATY', 'v', datetime.datetime(2013, 11, 5, 0, 0))
+    assert parse_lluv_filename('RDLv_HATY_13_11_05.ruv') is None
+    assert parse_lluv_filename('RDLv_HATY_2013_13_05_0000.ruv') is None
+    # files not catalogued are logged
+    for fn in ['RDLv_HATY_20131105_0030.ruv', 'RDLv_HATY_13_11_05.ruv']:
+        tmpdir.join(fn).write('')
+    catalog = FileCatalog()
+    catalog.scan(str(tmpdir), 'IdealPattern')
+    assert len(catalog) == 1
+    assert 'skip %s' % tmpdir.join('RDLv_HATY_13_11_05.ruv') in capsys.readouterr()[0]
+
+def test_catalog_scan_and_paths():
+    catalog = FileCatalog()
+    catalog.scan(indir, 'IdealPattern')
+    assert len(catalog) == 7
+    fns = catalog.paths('v', 'IdealPattern')
+    assert fns == sorted(recursive_glob(indir, 'RDLv*.ruv'))
+    assert catalog.has('HATY', 'v', 'IdealPattern', datetime.datetime(2013, 11, 5, 0, 0))
+    assert not catalog.has('HATY', 'v', 'MeasPattern', datetime.datetime(2013, 11, 5, 0, 0))
+
+def test_catalog_window_same_as_find_files_to_merge():
+    catalog = FileCatalog()
+    catalog.scan(indir, 'IdealPattern')
+    for fn in catalog.paths('v', 'IdealPattern'):
+        for numfiles in [1, 3, 5, 7]:
+            expected = sorted(find_files_to_merge(fn, numfiles=numfiles, sample_interval=30))
+            assert catalog.window(fn, 'IdealPattern', numfiles, 30) == expected
+            assert find_files_to_merge(fn, numfiles, 30, catalog=catalog) == expected
+
+def test_catalog_neighbour():
+    catalog = FileCatalog()
+    catalog.scan(indir, 'IdealPattern')
+    assert os.path.basename(catalog.neighbour(ifn, 'IdealPattern', -1)) == 'RDLv_HATY_2013_11_04_2330.ruv'
+    assert os.path.basename(catalog.neighbour(ifn, 'IdealPattern', 2)) == 'RDLv_HATY_2013_11_05_0100.ruv'
+    first = catalog.paths('v', 'IdealPattern')[0]
+    assert catalog.neighbour(first, 'IdealPattern', -1) is None
+
+def test_catalog_add_out_of_order():
+    catalog = FileCatalog()
+    for fn in reversed(sorted(recursive_glob(indir, 'RDLv*.ruv'))):
+        catalog.add(fn, 'IdealPattern')
+        # query in between adds so positions must be kept up to date
+        catalog.neighbour(fn, 'IdealPattern', 1)
+    assert catalog.paths('v', 'IdealPattern') == sorted(recursive_glob(indir, 'RDLv*.ruv'))
+    assert os.path.basename(catalog.neighbour(ifn, 'IdealPattern', 1)) == 'RDLv_HATY_2013_11_05_0030.ruv'
+
+def test_catalog_has_output():
+    catalog = FileCatalog()
+    catalog.scan(indir, 'IdealPattern')
+    assert not catalog.has_output(ifn, 'IdealPattern')
+    catalog.add('RadialShorts_qcd/IdealPattern/RDLx_HATY_2013_11_05_0000.ruv', 'IdealPattern')
+    assert catalog.has_output(ifn, 'IdealPattern')
+    assert not catalog.has_output(ifn, 'IdealPattern', 'Radials')
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+#
+"""
+Tests for the equivalence of optimized paths with the reference functions.
+
+"""
+import multiprocessing
+import numpy
+from qccodar.equivalence import *
+from qccodar.benchmark import make_datadir
+
+def test_compare_arrays():
+    ref = numpy.array([[1.0, numpy.nan, 0.0], [2.0, 3.0, 128.0]])
+    assert compare_arrays(ref, ref.copy(), vflg=2) == []
+    assert compare_arrays(ref, ref + 1e-12, vflg=2) == []
+    assert compare_arrays(ref, ref[:1]) == ['shape (1, 3) is not (2, 3)']
+    out = ref.copy()
+    out[0,1], out[0,0] = 5.0, numpy.nan
+    assert compare_arrays(ref, out)[0] == 'NaN placement differs in 2 values, first at (0, 0)'
+    out = ref.copy()
+    out[1,0] = 2.1
+    assert compare_arrays(ref, out) == ['1 values differ, first at (1, 0): 2.1 is not 2.0']
+    out = ref.copy()
+    out[:,2] = [1024.0, 129.0]
+    problems = compare_arrays(ref, out, vflg=2)
+    assert problems[-1] == 'VFLG bits 0b10000000001 differ in 2 rows'
+
+def test_compare_results_finds_vflg():
+    types_str = 'LOND LATD VFLG'
+    d = numpy.array([[1.0, 2.0, 0.0]])
+    flagged = d.copy()
+    flagged[0,2] = 1024
+    assert compare_results((d, types_str), (d.copy(), types_str)) == []
+    assert compare_results((d, types_str), (flagged, types_str))[-1] == '[0] VFLG bits 0b10000000000 differ in 1 rows'
+    assert compare_results((d, types_str), (d, 'LOND LATD FLAG')) == ['[1] differs']
+
+def test_paths_equivalent_on_bundled_data(tmpdir):
+    workdir = str(tmpdir)
+    case = make_case(make_datadir(workdir))
+    results = run_paths({'bundled' : case}, repeat=1)
+    assert sorted(r['path'] for r in results) == sorted(name for name, prepare, min_cpus in paths)
+    assert all(r['problems'] == [] and r['speedup'] > 0 for r in results)
+    # threaded paths are run with 2 threads even where a speed-up cannot be measured
+    threaded = [r for r in results if r['path'].endswith('/threads')]
+    assert len(threaded) == 2 and threads >= 2
+    assert all(('unjudged' in r) == (multiprocessing.cpu_count() < 2) for r in threaded)
+    assert failures(results, min_speedup=0) == []
+
+def test_failures():
+    results = [{'path' : 'a', 'case' : 'x', 'problems' : [], 'speedup' : 1.5},
+               {'path' : 'b', 'case' : 'x', 'problems' : [], 'speedup' : 0.8},
+               {'path' : 'c', 'case' : 'x', 'problems' : ['[0] differs'], 'speedup' : 3.0},
+               {'path' : 'd', 'case' : 'x', 'problems' : [], 'speedup' : 0.5,
+                'unjudged' : 'speed-up needs 2 cpus, 1 here'}]
+    assert [r['path'] for r in failures(results)] == ['b', 'c']
+    assert [r['path'] for r in failures(results, 2.0)] == ['a', 'b', 'c']
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+#
+"""
+Tests for manual mode with each executor.
+
+"""
+import os
+import pytest
+
+executors = ['serial', 'pipeline', 'taskgraph', 'stream']
+
+@pytest.mark.parametrize('executor', executors)
+def test_same_output_as_serial(make_datadir, run_manual, executor):
+    fns = ['RDLv_HATY_2013_11_04_2230.ruv', 'RDLv_HATY_2013_11_04_2300.ruv',
+           'RDLv_HATY_2013_11_04_2330.ruv']
+    serialdir = make_datadir(fns)
+    otherdir = make_datadir(fns)
+    merged1 = run_manual(serialdir, 'serial')
+    merged2 = run_manual(otherdir, executor)
+    assert merged1 == merged2 == ['RDLx_HATY_2013_11_04_2300.ruv']
+    outdir1 = os.path.join(serialdir, 'RadialShorts_qcd', 'IdealPattern')
+    outdir2 = os.path.join(otherdir, 'RadialShorts_qcd', 'IdealPattern')
+    assert sorted(os.listdir(outdir1)) == sorted(os.listdir(outdir2))
+    assert len(os.listdir(outdir1)) == 3
+    for fn in os.listdir(outdir1):
+        assert open(os.path.join(outdir1, fn)).read() == open(os.path.join(outdir2, fn)).read()
+
+@pytest.mark.parametrize('executor', executors)
+def test_raises_read_error(make_datadir, run_manual, executor):
+    datadir = make_datadir(['RDLv_HATY_2013_11_04_2300.ruv'])
+    # empty file as if still being written
+    open(os.path.join(datadir, 'RadialMetric', 'IdealPattern', 'RDLv_HATY_2013_11_04_2230.ruv'), 'w').close()
+    try:
+        run_manual(datadir, executor)
+    except EOFError:
+        pass
+    else:
+        assert False, 'expected EOFError for empty file'
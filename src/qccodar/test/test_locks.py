@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#
+"""
+Tests for lock files of overlapping runs.
+
+"""
+import os
+import json
+import time
+import socket
+import subprocess
+import multiprocessing
+import qccodar.app as app
+from qccodar.locks import *
+from qccodar.manifest import Manifest
+
+def test_file_lock(tmpdir):
+    fn = os.path.join(str(tmpdir), 'locks', 'RDLx_HATY_2013_11_04_2300.ruv.lock')
+    lock1, lock2 = FileLock(fn), FileLock(fn)
+    assert lock1.acquire()
+    assert not lock2.acquire()
+    assert lock2.owner()['pid'] == os.getpid()
+    lock1.release()
+    assert lock2.acquire()
+    lock2.release()
+    assert os.listdir(os.path.dirname(fn)) == []
+    with FileLock(fn) as lock:
+        assert lock.held
+        try:
+            with FileLock(fn, wait=0.3):
+                pass
+        except IOError:
+            pass
+        else:
+            assert False, 'expected IOError for lock held'
+    assert not os.path.exists(fn)
+
+def test_stale_lock_broken(tmpdir):
+    topdir = str(tmpdir)
+    fn = os.path.join(topdir, 'run.lock')
+    # owner on this host that is no longer running
+    p = subprocess.Popen(['true'])
+    p.wait()
+    create_exclusive(fn, json.dumps({'host' : socket.gethostname(), 'pid' : p.pid, 'time' : time.time()}))
+    assert FileLock(fn).acquire()
+    os.remove(fn)
+    # owner on another host, too long ago
+    create_exclusive(fn, json.dumps({'host' : 'otherhost', 'pid' : 1, 'time' : time.time()-60}))
+    assert not FileLock(fn).acquire()
+    assert FileLock(fn, stale_after=30).acquire()
+    assert os.listdir(topdir) == ['run.lock']
+
+def test_release_after_takeover_keeps_new_lock(tmpdir):
+    fn = os.path.join(str(tmpdir), 'run.lock')
+    lock1 = FileLock(fn, stale_after=0.1)
+    assert lock1.acquire()
+    time.sleep(0.2)
+    # taken over as stale by another run of this process
+    lock2 = FileLock(fn, stale_after=0.1)
+    assert lock2.acquire()
+    lock1.release()
+    assert not lock1.held
+    assert os.path.exists(fn) and lock2.owner() == lock2.info
+    assert not lock1.renew()
+    assert lock2.renew()
+    lock2.release()
+    assert os.listdir(str(tmpdir)) == []
+
+def _catchup(datadir, logfn):
+    do_qc = app.do_qc
+    def _do_qc(datadir, fn, pattern, **kw):
+        f = open(logfn, 'a')
+        f.write(fn+'\n')
+        f.close()
+        return do_qc(datadir, fn, pattern, **kw)
+    app.do_qc = _do_qc
+    app.catchup(datadir, 'IdealPattern')
+
+def test_overlapping_catchup_divides_work(make_datadir, merged):
+    fns = ['RDLv_HATY_2013_11_04_2230.ruv', 'RDLv_HATY_2013_11_04_2300.ruv',
+           'RDLv_HATY_2013_11_04_2330.ruv', 'RDLv_HATY_2013_11_05_0000.ruv',
+           'RDLv_HATY_2013_11_05_0030.ruv']
+    datadir = make_datadir(fns)
+    logfn = os.path.join(datadir, 'qc.log')
+    runs = [multiprocessing.Process(target=_catchup, args=(datadir, logfn)) for i in range(2)]
+    for p in runs:
+        p.start()
+    for p in runs:
+        p.join()
+    assert [p.exitcode for p in runs] == [0, 0]
+    # each file qc'd once, by one run or the other
+    assert sorted(open(logfn).read().split()) == fns[0:4]
+    # manifest has the records of both runs
+    assert len(Manifest(datadir, 'IdealPattern').outputs) == 4
+    assert os.listdir(os.path.join(datadir, '.qccodar', 'IdealPattern', 'locks')) == []
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+"""
+Tests for provenance manifest and incremental update.
+
+"""
+import os
+import shutil
+import subprocess
+from qccodar.qcutils import *
+from qccodar.manifest import *
+import qccodar.app as app
+from conftest import indir
+
+def _run_update(datadir, monkeypatch):
+    """ Run update mode and return the basenames of files given to do_qc """
+    done = []
+    do_qc = app.do_qc
+    def _do_qc(datadir, fn, pattern, **kw):
+        done.append(fn)
+        return do_qc(datadir, fn, pattern, **kw)
+    monkeypatch.setattr(app, 'do_qc', _do_qc)
+    try:
+        app.update(datadir, 'IdealPattern')
+    finally:
+        monkeypatch.setattr(app, 'do_qc', do_qc)
+    return done
+
+def test_params_digest():
+    assert params_digest({'a' : 1, 'b' : [1, 2]}) == params_digest({'b' : [1, 2], 'a' : 1})
+    assert params_digest({'a' : 1}) != params_digest({'a' : 2})
+
+def test_manifest_is_stale(make_datadir):
+    datadir = make_datadir(['RDLv_HATY_2013_11_04_2300.ruv'])
+    ifn = os.path.join(datadir, 'RadialMetric', 'IdealPattern', 'RDLv_HATY_2013_11_04_2300.ruv')
+    ofn = os.path.join(datadir, 'RadialShorts_qcd', 'IdealPattern', 'RDLx_HATY_2013_11_04_2300.ruv')
+    m = Manifest(datadir, 'IdealPattern')
+    assert m.is_stale(ofn, [ifn], qc_params)
+    open(ofn, 'w').write('%CTF: 1.00\n')
+    m.record(ofn, [ifn], qc_params, 'RadialShorts')
+    assert not m.is_stale(ofn, [ifn], qc_params)
+    assert m.is_stale(ofn, [ifn], dict(qc_params, numdegrees=5))
+    m.save()
+    # reload from disk
+    m = Manifest(datadir, 'IdealPattern')
+    assert not m.is_stale(ofn, [ifn], qc_params)
+    # regenerated input
+    open(ifn, 'a').write('%End:\n')
+    assert m.is_stale(ofn, [ifn], qc_params)
+
+def test_update_redoes_only_dependent_windows(make_datadir, merged, monkeypatch):
+    fns = ['RDLv_HATY_2013_11_04_2230.ruv', 'RDLv_HATY_2013_11_04_2300.ruv',
+           'RDLv_HATY_2013_11_04_2330.ruv', 'RDLv_HATY_2013_11_05_0000.ruv']
+    datadir = make_datadir(fns)
+    assert _run_update(datadir, monkeypatch) == fns
+    # nothing changed
+    assert _run_update(datadir, monkeypatch) == []
+    # late file arrives, only the window it falls in is redone
+    shutil.copy(os.path.join(indir, 'RDLv_HATY_2013_11_05_0030.ruv'), \
+                os.path.join(datadir, 'RadialMetric', 'IdealPattern'))
+    assert _run_update(datadir, monkeypatch) == ['RDLv_HATY_2013_11_05_0000.ruv', 'RDLv_HATY_2013_11_05_0030.ruv']
+    # regenerated input, its 3-file window is redone
+    ifn = os.path.join(datadir, 'RadialMetric', 'IdealPattern', 'RDLv_HATY_2013_11_04_2300.ruv')
+    open(ifn, 'a').write('%End:\n')
+    assert _run_update(datadir, monkeypatch) == fns[0:3]
+
+def test_manifest_journal_replayed_without_save(make_datadir):
+    datadir = make_datadir(['RDLv_HATY_2013_11_04_2300.ruv'])
+    ifn = os.path.join(datadir, 'RadialMetric', 'IdealPattern', 'RDLv_HATY_2013_11_04_2300.ruv')
+    ofn = os.path.join(datadir, 'RadialShorts_qcd', 'IdealPattern', 'RDLx_HATY_2013_11_04_2300.ruv')
+    open(ofn, 'w').write('%CTF: 1.00\n')
+    m = Manifest(datadir, 'IdealPattern')
+    m.record(ofn, [ifn], qc_params, 'RadialShorts')
+    # interrupted before save, with a partly written journal line
+    open(m.journalfn, 'a').write('{"output": "RadialShorts_q')
+    m = Manifest(datadir, 'IdealPattern')
+    assert not m.is_stale(ofn, [ifn], qc_params)
+    m.save()
+    assert not os.path.exists(m.journalfn)
+    assert not Manifest(datadir, 'IdealPattern').is_stale(ofn, [ifn], qc_params)
+
+def test_manual_resume_after_interruption(make_datadir, merged, monkeypatch):
+    fns = ['RDLv_HATY_2013_11_04_2230.ruv', 'RDLv_HATY_2013_11_04_2300.ruv',
+           'RDLv_HATY_2013_11_04_2330.ruv']
+    datadir = make_datadir(fns)
+    do_qc = app.do_qc
+    done = []
+    def _do_qc(datadir, fn, pattern, **kw):
+        if len(done) == 2:
+            raise KeyboardInterrupt
+        done.append(fn)
+        return do_qc(datadir, fn, pattern, **kw)
+    monkeypatch.setattr(app, 'do_qc', _do_qc)
+    try:
+        app.manual(datadir, 'IdealPattern')
+    except KeyboardInterrupt:
+        pass
+    assert done == fns[0:2]
+    # a partial output of the interrupted write (its pid no longer running) is cleaned up
+    p = subprocess.Popen(['true'])
+    p.wait()
+    partfn = os.path.join(datadir, 'RadialShorts_qcd', 'IdealPattern', 'RDLx_HATY_2013_11_04_2330.ruv.part%d' % p.pid)
+    open(partfn, 'w').write('%CTF: 1.00\n')
+    del done[:]
+    monkeypatch.setattr(app, 'do_qc', lambda datadir, fn, pattern, **kw: done.append(fn) or \
+                        do_qc(datadir, fn, pattern, **kw))
+    app.manual(datadir, 'IdealPattern', resume=True)
+    assert done == fns[2:]
+    assert not os.path.exists(partfn)
+
+def test_idle_catchup_leaves_manifest_unread(make_datadir):
+    datadir = make_datadir(['RDLv_HATY_2013_11_04_2300.ruv'])
+    open(os.path.join(datadir, 'RadialShorts_qcd', 'IdealPattern', 'RDLx_HATY_2013_11_04_2300.ruv'), 'w').close()
+    dirname = statedir(datadir, 'IdealPattern')
+    os.makedirs(dirname)
+    # not JSON, fails if read
+    mfn = os.path.join(dirname, 'manifest.json')
+    open(mfn, 'w').write('{"files": ')
+    m = Manifest(datadir, 'IdealPattern')
+    try:
+        m.outputs
+        assert False, 'manifest read'
+    except ValueError:
+        pass
+    app.catchup(datadir, 'IdealPattern')
+    assert open(mfn).read() == '{"files": '
+    assert sorted(os.listdir(dirname)) == ['manifest.json']
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#
+"""
+Tests for memory high-water marks of qc calls.
+
+"""
+import os
+import json
+import numpy
+from qccodar import metrics
+from qccodar.memory import MemoryTracker, rss, max_rss
+from qccodar.qcutils import do_qc
+from qccodar.catalog import build_catalog
+from qccodar.synthetic import write_synthetic
+from conftest import ListSink
+
+def test_rss():
+    assert rss() > 0 and max_rss() > 0
+
+def test_peak_of_call(tmpdir):
+    tracker = MemoryTracker(str(tmpdir), interval=0.001)
+    previous = metrics.set_memory(tracker)
+    try:
+        # 64 MB touched and freed within the call
+        big = metrics.instrumented('big')(lambda: float(numpy.ones(8*1024*1024).sum()))
+        assert big() == 8*1024*1024
+    finally:
+        metrics.set_memory(previous)
+    calls = tracker.calls()
+    assert [r['stage'] for r in calls] == ['big']
+    assert calls[0]['rss_growth'] > 48*1048576
+    assert calls[0]['rss_end'] < calls[0]['rss_peak']
+
+def test_do_qc_per_file_and_report(tmpdir):
+    datadir = str(tmpdir)
+    sink = ListSink()
+    fns = write_synthetic(datadir, numfiles=3, range_cells=6, doppler_cells=30)
+    catalog = build_catalog(datadir, 'IdealPattern')
+    outdir = os.path.join(datadir, '.qccodar', 'IdealPattern')
+    tracker = MemoryTracker(outdir, top=3)
+    previous, previous_sink = metrics.set_memory(tracker), metrics.set_sink(sink)
+    try:
+        for fn in fns:
+            do_qc(datadir, os.path.basename(fn), 'IdealPattern', catalog=catalog)
+    finally:
+        metrics.set_memory(previous)
+        metrics.set_sink(previous_sink)
+    reportfn = tracker.finish()
+    assert reportfn == os.path.join(outdir, 'memory.txt')
+    assert not os.path.exists(tracker.rundir)
+    calls = [json.loads(line) for line in open(os.path.join(outdir, 'memory.jsonl'))]
+    assert sorted(r['file'] for r in calls if r['stage'] == 'do_qc') == \
+        sorted(os.path.basename(fn) for fn in fns)
+    assert all(r['file'].startswith('RDL') for r in calls)
+    assert all(r['rss_start'] <= r['rss_peak'] and r['rss_end'] <= r['rss_peak'] for r in calls)
+    assert len(calls) == len(sink.records)
+    assert all('rss_peak_mb' in r and 'rss_growth_mb' in r for r in sink.records)
+    report = open(reportfn).read()
+    assert report.startswith('qccodar memory -- %d calls, 3 files qc\'d' % len(calls))
+    assert 'Top 3 calls by peak RSS growth' in report
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#
+"""
+Tests for per-stage metrics records.
+
+"""
+import os
+import json
+from qccodar import metrics
+from qccodar.metrics import JSONLinesSink, set_sink
+from qccodar.qcutils import do_qc
+from qccodar.catalog import build_catalog
+from qccodar.synthetic import write_synthetic
+from conftest import ListSink
+
+def test_do_qc_stage_records(tmpdir):
+    datadir = str(tmpdir)
+    sink = ListSink()
+    fns = write_synthetic(datadir, numfiles=3, range_cells=8, doppler_cells=40)
+    fn = os.path.basename(fns[1])
+    catalog = build_catalog(datadir, 'IdealPattern')
+    previous = set_sink(sink)
+    try:
+        ofn = do_qc(datadir, fn, 'IdealPattern', catalog=catalog)
+    finally:
+        set_sink(previous)
+    stages = [r['stage'] for r in sink.records]
+    assert stages == ['read_lluv_file']*3 + ['threshold_qc_all', 'weighted_velocities',
+                                             'generate_radialshort_array', 'write_output',
+                                             'process_file', 'do_qc']
+    byname = dict((r['stage'], r) for r in sink.records)
+    read = [r for r in sink.records if r['stage'] == 'read_lluv_file']
+    assert read[0]['file'] == fn and read[0]['site'] == 'SYNT'
+    assert read[0]['bytes_read'] == os.path.getsize(fns[1]) and read[0]['rows_out'] > 0
+    qc = byname['threshold_qc_all']
+    assert qc['rows_in'] == sum(r['rows_out'] for r in read)
+    assert 0 < qc['rows_flagged'] <= sum(qc[k] for k in qc if k.startswith('flagged_'))
+    assert set(k for k in qc if k.startswith('flagged_')) == \
+        set(['flagged_doa_peak_power', 'flagged_doa_half_power_width',
+             'flagged_monopole_snr', 'flagged_loop_snr'])
+    assert byname['weighted_velocities']['cells_out'] == byname['generate_radialshort_array']['rows_in']
+    assert byname['write_output']['bytes_written'] == os.path.getsize(ofn)
+    assert byname['process_file']['file'] == fn and byname['process_file']['site'] == 'SYNT'
+    assert byname['process_file']['output'] == byname['do_qc']['output'] == os.path.basename(ofn)
+    assert byname['process_file']['rows_in'] == qc['rows_in']
+    assert byname['process_file']['seconds'] >= sum(r['seconds'] for r in sink.records[3:-2]) * 0.99
+    assert byname['do_qc']['seconds'] >= sum(r['seconds'] for r in read + [byname['process_file']]) * 0.99
+    # nothing recorded without a sink
+    do_qc(datadir, fn, 'IdealPattern', catalog=catalog)
+    assert len(sink.records) == 9
+
+def test_json_lines_sink_and_errors(tmpdir):
+    fn = os.path.join(str(tmpdir), 'metrics.jsonl')
+    sink = JSONLinesSink(fn)
+    previous = set_sink(sink)
+    try:
+        try:
+            metrics.instrumented('fail')(lambda: 1/0)()
+        except ZeroDivisionError:
+            pass
+        metrics.instrumented('ok', lambda result: {'result' : result})(lambda: 2)()
+    finally:
+        set_sink(previous)
+        sink.close()
+    records = [json.loads(line) for line in open(fn)]
+    assert [r['stage'] for r in records] == ['fail', 'ok']
+    assert records[0]['error'].startswith('ZeroDivisionError')
+    assert records[1]['result'] == 2 and records[1]['pid'] == os.getpid()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#
+"""
+Tests for profiling of sampled qc calls.
+
+"""
+import os
+import sys
+import glob
+import pstats
+import qccodar.app as app
+from qccodar.metrics import set_profiler
+from qccodar.profiling import Profiler
+from qccodar.qcutils import do_qc
+from qccodar.catalog import build_catalog
+from qccodar.synthetic import write_synthetic
+
+def test_sampled_profile_and_report(tmpdir):
+    datadir = str(tmpdir)
+    fns = write_synthetic(datadir, numfiles=4, range_cells=6, doppler_cells=30)
+    catalog = build_catalog(datadir, 'IdealPattern')
+    outdir = os.path.join(datadir, '.qccodar', 'IdealPattern')
+    profiler = Profiler(outdir, rate=0.5, top=5)
+    previous = set_profiler(profiler)
+    try:
+        for fn in fns:
+            do_qc(datadir, os.path.basename(fn), 'IdealPattern', catalog=catalog)
+    finally:
+        set_profiler(previous)
+    # every other do_qc, inner stages are not counted on their own
+    assert profiler.calls == 4 and profiler.profiled == 2
+    assert len(glob.glob(os.path.join(profiler.rundir, 'do_qc.RDLv_SYNT_*.prof'))) == 2
+    reportfn = profiler.finish()
+    assert reportfn == os.path.join(outdir, 'profile.txt')
+    assert not os.path.exists(profiler.rundir)
+    stats = pstats.Stats(os.path.join(outdir, 'profile.pstats'))
+    assert any(func[2] == 'weighted_velocities' for func in stats.stats)
+    report = open(reportfn).read()
+    assert report.startswith('qccodar profile -- 2 do_qc calls')
+    assert 'Top 5 functions by cumulative time' in report
+    assert 'Top 5 functions by own time' in report
+
+def test_nothing_profiled(tmpdir):
+    profiler = Profiler(str(tmpdir), rate=0.0)
+    assert not profiler.sample()
+    assert profiler.finish() is None
+    assert os.listdir(str(tmpdir)) == []
+
+def test_profile_pipeline_executor(tmpdir, monkeypatch, merged):
+    datadir = str(tmpdir)
+    write_synthetic(datadir, numfiles=4, range_cells=6, doppler_cells=30)
+    monkeypatch.setattr(sys, 'argv', ['qccodar', 'manual', '-d', datadir,
+                                      '--executor', 'pipeline', '--profile'])
+    app.main()
+    # the pipeline does not call do_qc, the qc of each file is process_file
+    outdir = os.path.join(datadir, '.qccodar', 'IdealPattern')
+    report = open(os.path.join(outdir, 'profile.txt')).read()
+    assert report.startswith('qccodar profile -- 4 process_file calls')
+    stats = pstats.Stats(os.path.join(outdir, 'profile.pstats'))
+    assert any(func[2] == 'weighted_velocities' for func in stats.stats)
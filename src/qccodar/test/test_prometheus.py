@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+"""
+Tests for the Prometheus textfile metrics.
+
+"""
+import os
+import time
+import qccodar.app as app
+from qccodar.metrics import set_sink
+from qccodar.prometheus import TextfileSink, read_textfile, format_textfile
+from qccodar.qcutils import do_qc
+from qccodar.catalog import build_catalog
+from qccodar.synthetic import write_synthetic
+
+def run_qc(datadir, fns, promfn):
+    catalog = build_catalog(datadir, 'IdealPattern')
+    sink = TextfileSink(promfn)
+    previous = set_sink(sink)
+    try:
+        for fn in fns:
+            do_qc(datadir, os.path.basename(fn), 'IdealPattern', catalog=catalog)
+    finally:
+        set_sink(previous)
+        sink.close()
+
+def test_textfile_counts_carry_on(tmpdir):
+    datadir = str(tmpdir)
+    fns = write_synthetic(datadir, numfiles=3, range_cells=6, doppler_cells=30)
+    promfn = os.path.join(datadir, 'qccodar.prom')
+    run_qc(datadir, fns, promfn)
+    labels = (('pattern', 'IdealPattern'), ('site', 'SYNT'))
+    samples = read_textfile(promfn)
+    assert samples[('qccodar_files_processed_total', labels)] == 3
+    assert samples[('qccodar_stage_seconds_count', labels + (('stage', 'do_qc'),))] == 3
+    assert samples[('qccodar_stage_seconds_bucket', (('le', '+Inf'),) + labels + (('stage', 'read_lluv_file'),))] == 7
+    flagged = [k for k in samples if k[0] == 'qccodar_cells_flagged_total']
+    assert sorted(dict(k[1])['test'] for k in flagged) == \
+        ['doa_half_power_width', 'doa_peak_power', 'loop_snr', 'monopole_snr']
+    assert sum(samples[k] for k in flagged) > 0
+    typed = labels + (('type', 'RadialShorts'),)
+    newest = samples[('qccodar_newest_output_timestamp_seconds', typed)]
+    assert newest == 1383607800   # 2013-11-04 23:30, the last file
+    assert abs(samples[('qccodar_output_lag_seconds', typed)] - (time.time() - newest)) < 60
+    # a second run adds to the counters of the first
+    run_qc(datadir, fns[:1], promfn)
+    again = read_textfile(promfn)
+    assert again[('qccodar_files_processed_total', labels)] == 4
+    assert again[('qccodar_newest_output_timestamp_seconds', typed)] == newest
+    text = open(promfn).read()
+    assert '# TYPE qccodar_stage_seconds histogram\n' in text
+    assert not [fn for fn in os.listdir(datadir) if '.tmp' in fn or fn.endswith('.lock')]
+
+def test_files_processed_pipeline_executor(tmpdir, merged):
+    datadir = str(tmpdir)
+    fns = write_synthetic(datadir, numfiles=3, range_cells=6, doppler_cells=30)
+    promfn = os.path.join(datadir, 'qccodar.prom')
+    sink = TextfileSink(promfn)
+    previous = set_sink(sink)
+    try:
+        app.manual(datadir, 'IdealPattern', executor='pipeline')
+    finally:
+        set_sink(previous)
+        sink.close()
+    # no do_qc in the pipeline, files are counted from process_file
+    labels = (('pattern', 'IdealPattern'), ('site', 'SYNT'))
+    samples = read_textfile(promfn)
+    assert samples[('qccodar_files_processed_total', labels)] == 3
+    assert samples[('qccodar_stage_seconds_count', labels + (('stage', 'process_file'),))] == 3
+    assert not [k for k in samples if dict(k[1]).get('site') == 'unknown']
+
+def test_merge_failures_and_format(tmpdir):
+    promfn = os.path.join(str(tmpdir), 'qccodar.prom')
+    sink = TextfileSink(promfn, pattern='MeasPattern')
+    sink.emit({'stage' : 'run_LLUVMerger', 'site' : 'HATY', 'seconds' : 2.0, 'output' : None})
+    sink.emit({'stage' : 'run_LLUVMerger', 'site' : 'HATY', 'seconds' : 3.0, 'error' : 'OSError: x'})
+    sink.emit({'stage' : 'run_LLUVMerger', 'site' : 'HATY', 'seconds' : 1.0,
+               'output' : 'RDLm_HATY_2013_11_05_0000.ruv'})
+    labels = (('pattern', 'MeasPattern'), ('site', 'HATY'))
+    samples = read_textfile(promfn)
+    assert samples[('qccodar_merge_failures_total', labels)] == 2
+    assert samples[('qccodar_merges_total', labels)] == 1
+    stage = labels + (('stage', 'run_LLUVMerger'),)
+    assert samples[('qccodar_stage_seconds_sum', stage)] == 6.0
+    assert samples[('qccodar_stage_seconds_bucket', (('le', '2.5'),) + stage)] == 2
+    assert samples[('qccodar_stage_seconds_bucket', (('le', '1'),) + stage)] == 1
+    odd = {('qccodar_merges_total', (('site', 'a"b\\c'),)) : 1.0}
+    assert format_textfile(odd) == \
+        '# HELP qccodar_merges_total Radials merged by LLUVMerger\n' \
+        '# TYPE qccodar_merges_total counter\n' \
+        'qccodar_merges_total{site="a\\"b\\\\c"} 1\n'
+    open(promfn, 'w').write(format_textfile(odd))
+    assert read_textfile(promfn) == odd
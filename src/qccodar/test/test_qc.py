@@ -202,3 +202,16 @@ def _generate_output():
     #
     ofn = os.path.join(files, 'Radialmetric_test4', 'RDLv_HATY_2013_11_05_0000.ruv')
     write_output(ofn, header, d4, footer)
+
+def test_weighted_velocities_threads_same_output():
+    ifn = os.path.join(files, 'codar_raw', 'Radialmetric_HATY_2013_11_05', 'RDLv_HATY_2013_11_05_0000.ruv')
+    d, types_str, header, footer = read_lluv_file(ifn)
+    d = threshold_qc_all(d, types_str, thresholds=[5.0, 50.0, 5.0, 5.0])
+    for weight_parameter in ['MP', 'SNR3', 'NONE']:
+        xd, xtypes_str = weighted_velocities(d, types_str, numdegrees=3, weight_parameter=weight_parameter)
+        xd4, xtypes_str4 = weighted_velocities(d, types_str, numdegrees=3, weight_parameter=weight_parameter,
+                                               threads=4)
+        # same rows in the same order, bit for bit
+        assert xtypes_str4 == xtypes_str
+        assert xd4.shape == xd.shape
+        assert (xd4.tobytes() == xd.tobytes())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+"""
+Tests for the qcviz slider callbacks, headless (Agg backend).
+
+"""
+import sys
+import pytest
+matplotlib = pytest.importorskip('matplotlib')
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.backend_bases
+from qccodar.qcviz.sliders import IndexedSlider
+from qccodar.qcviz.blitting import Blitter, Debounced, blit_slider
+
+class ManualTimer(matplotlib.backend_bases.TimerBase):
+    """ Timer of an interactive backend, fired by the test """
+    def __init__(self, *args, **kwargs):
+        matplotlib.backend_bases.TimerBase.__init__(self, *args, **kwargs)
+        self.running = False
+    def _timer_start(self):
+        self.running = True
+    def _timer_stop(self):
+        self.running = False
+    def fire(self):
+        for func, args, kwargs in self.callbacks:
+            func(*args, **kwargs)
+
+def _figure():
+    fig, ax = plt.subplots()
+    line, = ax.plot([0, 1], [0, 1])
+    slider = IndexedSlider(fig.add_axes([0.2, 0.02, 0.6, 0.03]), 'Bearing',
+                           seqvals=range(10, 20), valinit=10, valfmt=u'%d')
+    return fig, line, slider
+
+def test_blitted_slider_immediate_without_timer():
+    fig, line, slider = _figure()
+    blitter = Blitter(fig)
+    blitter.add([line])
+    blit_slider(blitter, slider)
+    assert line.get_animated() and slider.poly.get_animated() and not slider.drawon
+    values = []
+    slider.on_changed(Debounced(blitter, values.append))
+    # no background before the first draw, the canvas is drawn and they are copied
+    assert blitter.backgrounds is None
+    blitter.update()
+    assert len(blitter.backgrounds) == 2
+    # Agg has no timer, each value is used at once
+    slider.set_val(3)
+    slider.set_val(4)
+    assert values == [3, 4] and slider.valtext.get_text() == '14'
+    line.set_ydata([1, 0])
+    blitter.update()
+    plt.close(fig)
+
+def test_debounced_latest_value_once(monkeypatch):
+    fig, line, slider = _figure()
+    timers = []
+    def new_timer(*args, **kwargs):
+        timers.append(ManualTimer(*args, **kwargs))
+        return timers[-1]
+    monkeypatch.setattr(fig.canvas, 'new_timer', new_timer)
+    blitter = Blitter(fig)
+    blit_slider(blitter, slider)
+    fig.canvas.draw()
+    values = []
+    slider.on_changed(Debounced(blitter, values.append, interval=50))
+    assert timers[0].interval == 50
+    for val in [1, 2, 5]:
+        slider.set_val(val)
+    # the slider moved, the callback waits for it to stop
+    assert values == [] and timers[0].running
+    assert slider.valtext.get_text() == '15'
+    timers[0].fire()
+    assert values == [5] and not timers[0].running
+    plt.close(fig)
+
+def test_qcviz_sliders_on_test_files(monkeypatch):
+    # qcviz plots the test files when run without arguments
+    monkeypatch.setattr(sys, 'argv', ['qcviz.py'])
+    from qccodar.qcviz import qcviz
+    qcviz.fig.canvas.draw()
+    assert qcviz.blitter.backgrounds is not None
+    bearing = qcviz.params['bearing']
+    good = len(qcviz.ld_good.get_xdata())
+    # bearing moves slice the averages, made once for the settings
+    averaged = []
+    weighted_velocities = qcviz.weighted_velocities
+    monkeypatch.setattr(qcviz, 'weighted_velocities', lambda *args: \
+                        averaged.append(args[2:]) or weighted_velocities(*args))
+    for step in [1, 2, 3, 2]:
+        qcviz.sbear.set_val(qcviz.sbear.val + step)
+    assert averaged == []
+    assert qcviz.params['bearing'] == qcviz.sbear.seqvals[qcviz.sbear.val] != bearing
+    rsc = qcviz.get_columns(qcviz.rstypes_str)
+    shown = qcviz.rsd[qcviz.rsd[:,rsc['BEAR']] == qcviz.params['bearing']]
+    assert len(qcviz.lrs.get_xdata()) == len(shown) > 0
+    # more files in the window, more rows at the bearing
+    qcviz.snumfiles.set_val(qcviz.snumfiles.seqvals.index(5))
+    assert qcviz.params['numfiles'] == 5
+    assert len(qcviz.ld_good.get_xdata()) + len(qcviz.ld_bad.get_xdata()) > good
+    # a stricter monopole SNR test flags more rows
+    bad = len(qcviz.ld_bad.get_xdata())
+    qcviz.stest3.set_val(qcviz.stest3.seqvals.index(15.0))
+    assert qcviz.params['thresholds'][2] == 15.0
+    assert len(qcviz.ld_bad.get_xdata()) > bad
+    qcviz.snumdegrees.set_val(qcviz.snumdegrees.seqvals.index(1))
+    assert qcviz.params['numdegrees'] == 1
+    qcviz.rwtdavg.set_active(2)
+    assert qcviz.params['weight_parameter'] == 'NONE'
+    assert averaged == [(3, 'MP'), (3, 'MP'), (1, 'MP'), (1, 'NONE')]
+    assert list(qcviz.ls_good.get_xdata()) == []
+    plt.close(qcviz.fig)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#
+"""
+Tests for readiness of RadialMetric files being written.
+
+"""
+import os
+import glob
+import time
+import shutil
+import threading
+import qccodar.app as app
+import qccodar.readiness as readiness
+from qccodar.readiness import *
+from conftest import indir
+
+def _write_part(src, dst, fraction):
+    content = open(src).read()
+    open(dst, 'w').write(content[:int(len(content)*fraction)])
+    return content
+
+def test_has_footer(tmpdir):
+    src = os.path.join(indir, 'RDLv_HATY_2013_11_04_2300.ruv')
+    assert has_footer(src)
+    fn = os.path.join(str(tmpdir), 'RDLv_HATY_2013_11_04_2300.ruv')
+    # stops in the table, and in the footer after a %TableEnd:
+    for fraction in [0.5, 0.999]:
+        _write_part(src, fn, fraction)
+        assert not has_footer(fn)
+        assert not is_ready(fn, settle=0)
+    open(fn, 'w').close()
+    assert not is_ready(fn, settle=0)
+    assert not is_ready(os.path.join(str(tmpdir), 'missing.ruv'), settle=0)
+    shutil.copy(src, fn)
+    assert is_ready(fn, settle=0)
+    # size not yet stable
+    assert not is_ready(fn, settle=60)
+    assert is_ready(fn, settle=60, closed=True)
+
+def test_wait_until_ready(tmpdir):
+    src = os.path.join(indir, 'RDLv_HATY_2013_11_04_2300.ruv')
+    fn = os.path.join(str(tmpdir), 'RDLv_HATY_2013_11_04_2300.ruv')
+    content = _write_part(src, fn, 0.5)
+    assert not wait_until_ready(fn, timeout=0.3, poll=0.1, settle=0)
+    def finish():
+        time.sleep(0.3)
+        open(fn, 'w').write(content)
+    t = threading.Thread(target=finish)
+    t.start()
+    t0 = time.time()
+    # with close-write events (pyinotify) ready without waiting to settle
+    assert wait_until_ready(fn, timeout=30, poll=0.1, settle=0 if readiness.pyinotify is None else 60)
+    assert time.time() - t0 < 10
+    t.join()
+
+def test_auto_skips_partial_file(make_datadir, merged, monkeypatch):
+    datadir = make_datadir(['RDLv_HATY_2013_11_04_2230.ruv', 'RDLv_HATY_2013_11_04_2300.ruv'])
+    monkeypatch.setitem(readiness.ready_params, 'timeout', 0.3)
+    newfn = os.path.join(datadir, 'RadialMetric', 'IdealPattern', 'RDLv_HATY_2013_11_04_2330.ruv')
+    _write_part(os.path.join(indir, 'RDLv_HATY_2013_11_04_2330.ruv'), newfn, 0.5)
+    app.auto(datadir, 'IdealPattern', newfn)
+    assert os.listdir(os.path.join(datadir, 'RadialShorts_qcd', 'IdealPattern')) == []
+
+def test_older_files_short_timeout(tmpdir, monkeypatch):
+    fns = []
+    for i, name in enumerate(['RDLv_HATY_2013_11_04_2300.ruv', 'RDLv_HATY_2013_11_04_2330.ruv']):
+        fns.append(os.path.join(str(tmpdir), name))
+        _write_part(os.path.join(indir, name), fns[-1], 0.5 if i == 0 else 1.0)
+    monkeypatch.setitem(readiness.ready_params, 'settle', 0)
+    monkeypatch.setitem(readiness.ready_params, 'older_timeout', 0.3)
+    t0 = time.time()
+    assert first_not_ready(fns, fns[1]) == fns[0]
+    assert time.time() - t0 < 10
+    assert first_not_ready(fns[1:], fns[1]) is None
+
+def test_auto_waits_without_lock(make_datadir, merged, monkeypatch):
+    datadir = make_datadir(['RDLv_HATY_2013_11_04_2230.ruv', 'RDLv_HATY_2013_11_04_2300.ruv',
+                            'RDLv_HATY_2013_11_04_2330.ruv'])
+    locked = []
+    def wait(fn, timeout=None):
+        locked.append(glob.glob(os.path.join(datadir, '.qccodar', 'IdealPattern', 'locks', '*.lock')))
+        return True
+    monkeypatch.setattr(readiness, 'wait_until_ready', wait)
+    app.auto(datadir, 'IdealPattern', os.path.join(datadir, 'RadialMetric', 'IdealPattern',
+                                                     'RDLv_HATY_2013_11_04_2330.ruv'))
+    assert locked == [[]]*3
+    assert os.listdir(os.path.join(datadir, 'RadialShorts_qcd', 'IdealPattern')) == \
+        ['RDLx_HATY_2013_11_04_2300.ruv']
+
+def test_auto_gives_up_on_file_never_complete(make_datadir, merged, monkeypatch):
+    datadir = make_datadir(['RDLv_HATY_2013_11_04_2230.ruv', 'RDLv_HATY_2013_11_04_2300.ruv'])
+    monkeypatch.setitem(readiness.ready_params, 'timeout', 0.1)
+    monkeypatch.setitem(readiness.ready_params, 'attempts', 2)
+    newfn = os.path.join(datadir, 'RadialMetric', 'IdealPattern', 'RDLv_HATY_2013_11_04_2330.ruv')
+    content = _write_part(os.path.join(indir, 'RDLv_HATY_2013_11_04_2330.ruv'), newfn, 0.5)
+    waits = []
+    wait_until_ready = readiness.wait_until_ready
+    monkeypatch.setattr(readiness, 'wait_until_ready', lambda fn, timeout=None: \
+                        waits.append(os.path.basename(fn)) or wait_until_ready(fn, timeout=timeout))
+    # waited on at the first ticks, not after
+    for tick in range(4):
+        app.auto(datadir, 'IdealPattern', newfn)
+    assert waits.count('RDLv_HATY_2013_11_04_2330.ruv') == 2
+    log = NotReadyLog(datadir, 'IdealPattern')
+    assert log.given_up(newfn) and log.attempts(newfn) == 2
+    assert os.listdir(os.path.join(datadir, 'RadialShorts_qcd', 'IdealPattern')) == []
+    # written at last, waited on again and qc'd
+    open(newfn, 'w').write(content)
+    monkeypatch.setitem(readiness.ready_params, 'settle', 0)
+    app.auto(datadir, 'IdealPattern', newfn)
+    assert waits.count('RDLv_HATY_2013_11_04_2330.ruv') == 3
+    assert os.listdir(os.path.join(datadir, 'RadialShorts_qcd', 'IdealPattern')) == \
+        ['RDLx_HATY_2013_11_04_2300.ruv']
+    assert NotReadyLog(datadir, 'IdealPattern').entries == {}
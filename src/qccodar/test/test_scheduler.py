@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+"""
+Tests for the catchup scheduler.
+
+"""
+import os
+import json
+import datetime
+import qccodar.app as app
+import qccodar.readiness as readiness
+from qccodar.scheduler import *
+from qccodar.catalog import output_filename
+from qccodar.manifest import Manifest, merge_output
+from qccodar.codarutils import merge_params
+from conftest import indir
+
+def _arrive(datadir, t):
+    # the scheduler only looks at file names
+    fn = os.path.join(datadir, 'RadialMetric', 'IdealPattern', 'RDLv_HATY_2013_11_%s.ruv' % t)
+    open(fn, 'w').close()
+    return fn
+
+def test_newest_first_then_backlog(make_datadir):
+    times = ['04_2100', '04_2130', '04_2200', '04_2230', '04_2300', '04_2330',
+             '05_0000', '05_0030', '05_0100']
+    datadir = make_datadir([], outdirs=False)
+    for t in times:
+        _arrive(datadir, t)
+    done = []
+    slept = []
+    def process(fullfn, catalog):
+        done.append(os.path.basename(fullfn)[18:25])
+        # a file arrives while the backlog is being worked on
+        if len(done) == 6:
+            _arrive(datadir, '05_0130')
+    def remerge(catalog, since):
+        done.append(('remerge', since))
+    s = Scheduler(datadir, 'IdealPattern', backlog_share=0.25, realtime_files=5, rescan_interval=0)
+    s.sleep = slept.append
+    s.run(process, remerge=remerge)
+    # the first pending file is qc'd by auto() of the next, merges
+    # of the realtime files are redone once the backlog is done
+    assert done == ['04_2300', '04_2330', '05_0000', '05_0030', '05_0100',
+                    '04_2130', '05_0130', '04_2200', '04_2230',
+                    ('remerge', datetime.datetime(2013, 11, 4, 21, 30))]
+    assert (s.lag['realtime'].count, s.lag['backlog'].count) == (6, 3)
+    assert (s.lag['realtime'].queued, s.lag['backlog'].queued) == (0, 0)
+    # backlog gets a quarter of the time, sleeps three times its work
+    assert len(slept) == 3
+    s.save()
+    lag = json.load(open(os.path.join(datadir, '.qccodar', 'IdealPattern', 'lag.json')))
+    assert lag['backlog']['count'] == 3
+    assert lag['realtime']['max'] > 0
+
+def test_catchup_merges_have_backlog_sources(make_datadir, monkeypatch):
+    fns = sorted(os.listdir(indir))
+    datadir = make_datadir(fns)
+    monkeypatch.setitem(readiness.ready_params, 'settle', 0)
+    rsdir = os.path.join(datadir, 'RadialShorts_qcd', 'IdealPattern')
+    def do_qc(datadir, fn, pattern, catalog=None, manifest=None):
+        ofn = output_filename(datadir, fn, pattern, 'RadialShorts')
+        open(ofn, 'w').close()
+        catalog.add(ofn, pattern)
+        manifest.record(ofn, [], {}, 'RadialShorts')
+        return ofn
+    merged = {}
+    def run_LLUVMerger(datadir, fn, pattern):
+        # RadialShorts_qcd files there are when merged
+        merged[fn] = sorted(os.listdir(rsdir))
+        ofn = merge_output(datadir, fn, pattern, merge_params)
+        open(ofn, 'w').write(' '.join(merged[fn]))
+        return ofn
+    monkeypatch.setattr(app, 'do_qc', do_qc)
+    monkeypatch.setattr(app, 'run_LLUVMerger', run_LLUVMerger)
+    app.catchup(datadir, 'IdealPattern', backlog_share=1.0)
+    # 04_2300 and 05_0000 are first merged without 04_2230, from the backlog
+    assert sorted(merged) == ['RDLx_HATY_2013_11_04_2300.ruv', 'RDLx_HATY_2013_11_05_0000.ruv',
+                              'RDLx_HATY_2013_11_05_0100.ruv']
+    for fn, sources in merged.items():
+        dt = datetime.datetime.strptime(fn[10:25], '%Y_%m_%d_%H%M')
+        start = dt - datetime.timedelta(minutes=(merge_params['rs_num']-1)*merge_params['rs_output_interval'])
+        window = [f for f in os.listdir(rsdir) if start.strftime('%Y_%m_%d_%H%M') <= f[10:25] <= fn[10:25]]
+        assert set(window) <= set(sources)
+    # and recorded with all their sources
+    assert not Manifest(datadir, 'IdealPattern').is_stale(
+        merge_output(datadir, os.path.join(rsdir, 'RDLx_HATY_2013_11_05_0000.ruv'), 'IdealPattern', merge_params),
+        [os.path.join(rsdir, f) for f in ['RDLx_HATY_2013_11_04_2230.ruv', 'RDLx_HATY_2013_11_04_2300.ruv',
+                                          'RDLx_HATY_2013_11_04_2330.ruv', 'RDLx_HATY_2013_11_05_0000.ruv']],
+        merge_params)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+"""
+Tests for sharding a manual run over several nodes.
+
+"""
+import os
+import json
+import time
+import multiprocessing
+import qccodar.shard as shard
+from qccodar.shard import *
+from qccodar.qcutils import do_qc
+
+fns = ['RDLv_HATY_2013_11_04_2230.ruv', 'RDLv_HATY_2013_11_04_2300.ruv',
+       'RDLv_HATY_2013_11_04_2330.ruv', 'RDLv_HATY_2013_11_05_0000.ruv',
+       'RDLv_HATY_2013_11_05_0030.ruv']
+
+def _fake_merger(datadir, fn, pattern):
+    """ Stand-in for LLUVMerger, one file per merge seen by all nodes """
+    ofn = os.path.join(datadir, 'Radials_qcd', pattern, fn.replace('RDLx', 'RDLy'))
+    open(ofn, 'w').write('%CTF: 1.00\n')
+    return ofn
+
+def test_plan_chunks_overlap_windows(make_datadir):
+    datadir = make_datadir(fns)
+    catalog = build_catalog(datadir, 'IdealPattern', kinds=('RadialMetric',))
+    chunks = plan_chunks(catalog, 'IdealPattern', chunk_files=2)
+    assert [len(c['targets']) for c in chunks] == [2, 2, 1]
+    # the window of a target at a chunk boundary reaches into the next chunk
+    assert [os.path.basename(fn) for fn in chunks[1]['reads']] == fns[1:5]
+    assert [os.path.basename(fn) for fn in chunks[2]['reads']] == fns[3:5]
+
+def test_create_exclusive(tmpdir):
+    topdir = str(tmpdir)
+    fn = os.path.join(topdir, 'chunk-00000.claim')
+    assert create_exclusive(fn, 'node1')
+    assert not create_exclusive(fn, 'node2')
+    assert open(fn).read() == 'node1'
+    assert os.listdir(topdir) == ['chunk-00000.claim']
+
+def test_shard_nodes_same_output_as_single_run(make_datadir, monkeypatch):
+    sharddir = make_datadir(fns)
+    refdir = make_datadir(fns)
+    # three local processes as nodes, they inherit the fake merger
+    monkeypatch.setattr(shard, 'run_LLUVMerger', _fake_merger)
+    nodes = [multiprocessing.Process(target=run_shard, args=(sharddir, 'IdealPattern', 2))
+             for i in range(3)]
+    for p in nodes:
+        p.start()
+    for p in nodes:
+        p.join()
+    assert [p.exitcode for p in nodes] == [0, 0, 0]
+
+    queue = ShardQueue(sharddir, 'IdealPattern')
+    assert all(queue.is_done(name) for name in ['chunk-00000', 'chunk-00001', 'chunk-00002', 'merge'])
+    # a second run finds the work done
+    assert run_shard(sharddir, 'IdealPattern', 2) == ([], False)
+    assert sorted(os.listdir(os.path.join(sharddir, 'Radials_qcd', 'IdealPattern'))) == \
+        ['RDLy_HATY_2013_11_04_2300.ruv', 'RDLy_HATY_2013_11_05_0000.ruv']
+
+    # chunk outputs are the same as qc of the whole range
+    for fn in fns:
+        do_qc(refdir, fn, 'IdealPattern')
+    outdir1 = os.path.join(sharddir, 'RadialShorts_qcd', 'IdealPattern')
+    outdir2 = os.path.join(refdir, 'RadialShorts_qcd', 'IdealPattern')
+    assert sorted(os.listdir(outdir1)) == sorted(os.listdir(outdir2))
+    for fn in os.listdir(outdir2):
+        assert open(os.path.join(outdir1, fn)).read() == open(os.path.join(outdir2, fn)).read()
+
+    # the stitched manifest covers every output
+    m = Manifest(sharddir, 'IdealPattern')
+    assert len(m.outputs) == 7
+
+def test_abandoned_claim_taken_over(make_datadir, monkeypatch):
+    datadir = make_datadir(fns[:2])
+    monkeypatch.setattr(shard, 'run_LLUVMerger', _fake_merger)
+    queue = ShardQueue(datadir, 'IdealPattern')
+    # left by a node that died, its pid is no longer running on this host
+    p = multiprocessing.Process(target=queue.claim, args=('chunk-00000',))
+    p.start()
+    p.join()
+    # left by a node elsewhere, not renewed within the lease
+    old = {'host' : 'elsewhere', 'pid' : 1, 'time' : time.time() - 2*shard.lease}
+    open(os.path.join(queue.dir, 'chunk-00001.claim'), 'w').write(json.dumps(old))
+    # still being worked on elsewhere
+    live = {'host' : 'elsewhere', 'pid' : 1, 'time' : time.time()}
+    open(os.path.join(queue.dir, 'chunk-00002.claim'), 'w').write(json.dumps(live))
+    assert not queue.claim('chunk-00002')
+    assert run_shard(datadir, 'IdealPattern', 1) == (['chunk-00000', 'chunk-00001'], True)
+    # the claims are renewed, another node does not take over a live one
+    assert not ShardQueue(datadir, 'IdealPattern').claim('chunk-00000')
+
+def test_plan_relative_to_shard_dir(make_datadir):
+    datadir = make_datadir(fns[:2])
+    catalog = build_catalog(datadir, 'IdealPattern', kinds=('RadialMetric',))
+    chunks = ShardQueue(datadir, 'IdealPattern').plan(plan_chunks(catalog, 'IdealPattern', 1))
+    assert [c['targets'] for c in chunks] == [[fn] for fn in catalog.paths('v', 'IdealPattern')]
+    # the datadir mounted elsewhere
+    moved = datadir + '-moved'
+    os.rename(datadir, moved)
+    queue = ShardQueue(moved, 'IdealPattern')
+    saved = json.load(open(os.path.join(queue.dir, 'plan.json')))
+    assert not [fn for c in saved for fn in c['targets'] + c['reads'] if os.path.isabs(fn)]
+    assert all(os.path.isfile(fn) for c in queue.plan([]) for fn in c['targets'] + c['reads'])
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+"""
+Tests for start-up time of the qccodar command (cron runs of auto).
+
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import distutils.sysconfig
+import pytest
+
+# not needed when auto finds nothing new to process (pkg_resources is
+# left out, it declares the namespace of qccodar in a source tree)
+heavy_modules = ['numpy', 'geopy', 'pyinotify',
+                 'qccodar.qcutils', 'qccodar.codarutils']
+
+def _run(code):
+    """ Run python code in a new interpreter, return what it prints as JSON """
+    out = subprocess.check_output([sys.executable, '-c', code])
+    return json.loads(out.splitlines()[-1])
+
+def _imported_by(module):
+    """ Modules loaded by importing module after the qccodar package, and where from """
+    code = ("import sys, json; import qccodar; before = set(sys.modules); import %s; "
+            "print json.dumps(dict((m, getattr(sys.modules[m], '__file__', None)) "
+            "for m in set(sys.modules) - before if sys.modules[m] is not None))" % module)
+    return _run(code)
+
+def test_import_app_light():
+    # counted rather than timed, so a busy machine does not fail it
+    app = _imported_by('qccodar.app')
+    qc = _imported_by('qccodar.qcutils')
+    print 'import qccodar.app: %d modules, qccodar.qcutils: %d' % (len(app), len(qc))
+    assert not [m for m in heavy_modules if m in app]
+    # only the standard library and qccodar
+    stdlib = distutils.sysconfig.get_python_lib(standard_lib=True)
+    assert not [m for m, fn in app.items() if fn and not m.startswith('qccodar') and \
+                (not fn.startswith(stdlib) or 'site-packages' in fn)]
+    assert len(app) < len(qc)/3
+
+def test_auto_nothing_new_no_heavy_imports(tmpdir):
+    datadir = str(tmpdir)
+    for folder in ['RadialMetric', 'RadialShorts_qcd', 'Radials_qcd']:
+        os.makedirs(os.path.join(datadir, folder, 'IdealPattern'))
+    code = ("import sys, json; import qccodar.app; "
+            "sys.argv = ['qccodar', 'auto', '-d', %r]; qccodar.app.main(); "
+            "print json.dumps([m for m in %r if m in sys.modules])" % (datadir, heavy_modules))
+    assert _run(code) == []
+
+@pytest.mark.timing
+def test_auto_nothing_new_startup_budget():
+    from qccodar.benchmark import startup_benchmark, startup_budget
+    workdir = tempfile.mkdtemp(prefix='qccodar-startup-')
+    try:
+        # best of five, so one slow run on a busy machine does not fail it
+        result = startup_benchmark(workdir, repeat=5)
+    finally:
+        shutil.rmtree(workdir)
+    print 'auto, nothing new: best %.3f s, mean %.3f s (budget %.3f s)' % \
+        (result['best'], result['mean'], startup_budget)
+    assert result['best'] < startup_budget
+
+def test_version():
+    out = subprocess.check_output([sys.executable, '-c',
+                                   "import sys, qccodar.app; sys.argv = ['qccodar', '--version']; "
+                                   "qccodar.app.main()"])
+    assert out.startswith('qccodar ')
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+#
+"""
+Tests for the bounded-memory streaming manual-mode executor.
+
+"""
+import os
+from qccodar.stream import Stream
+from qccodar.catalog import build_catalog, lluvtype_for
+from conftest import indir
+
+def test_stream_memory_ceiling(make_datadir, merged):
+    fns = sorted(os.listdir(indir))[:5]
+    datadir = make_datadir(fns)
+    catalog = build_catalog(datadir, 'IdealPattern')
+    paths = catalog.paths(lluvtype_for('RadialMetric', 'IdealPattern'), 'IdealPattern')
+    sizes = [os.path.getsize(fn) for fn in paths]
+    # a ceiling below one file still reads each window, but no further
+    # ahead, the size of a file is held while it is parsed
+    s = Stream(datadir, 'IdealPattern', catalog, max_memory=1e-6)
+    s.run(paths)
+    assert s.budget.used == 0
+    assert s.budget.stalls > 0
+    assert s.budget.peak <= max(sum(sizes[i:i+3]) for i in range(len(sizes)))
+    # without a ceiling all files may be read ahead
+    s = Stream(datadir, 'IdealPattern', catalog, max_memory=1024)
+    s.run(paths)
+    assert s.budget.used == 0 and s.budget.stalls == 0
+
+def test_stream_reserves_before_parsing(make_datadir, merged):
+    fns = sorted(os.listdir(indir))[:5]
+    datadir = make_datadir(fns)
+    catalog = build_catalog(datadir, 'IdealPattern')
+    paths = catalog.paths(lluvtype_for('RadialMetric', 'IdealPattern'), 'IdealPattern')
+    s = Stream(datadir, 'IdealPattern', catalog, max_memory=1e-6)
+    used = []
+    read = s.read
+    def parse(fn):
+        used.append((fn, s.budget.used))
+        return read(fn)
+    s.read = parse
+    s.run(paths)
+    # the size of each file was taken from the budget before it was parsed
+    assert [fn for fn, u in used] == paths
+    assert all(u >= os.path.getsize(fn) for fn, u in used)
+    assert s.budget.used == 0
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+#
+"""
+Tests for the synthetic RadialMetric file generator.
+
+"""
+import os
+import numpy
+from qccodar.synthetic import *
+from qccodar.qcutils import read_lluv_file, do_qc, get_columns
+from qccodar.catalog import build_catalog
+
+def test_synthetic_files_read_like_radialmetric(tmpdir):
+    datadir = str(tmpdir)
+    fns = write_synthetic(datadir, numfiles=3, range_cells=10, doppler_cells=50, coverage=360.0)
+    assert [os.path.basename(fn) for fn in fns] == \
+        ['RDLv_SYNT_2013_11_04_2230.ruv', 'RDLv_SYNT_2013_11_04_2300.ruv',
+         'RDLv_SYNT_2013_11_04_2330.ruv']
+    d, types_str, header, footer = read_lluv_file(fns[1])
+    c = get_columns(types_str)
+    assert len(types_str.split()) == d.shape[1] == 34
+    assert sorted(numpy.unique(d[:,c['SPRC']])) == range(3, 13)
+    assert sorted(numpy.unique(d[:,c['MSEL']])) == [1, 2, 3]
+    # dual-angle solutions are pairs of rows
+    assert (d[:,c['MSEL']] == 2).sum() == (d[:,c['MSEL']] == 3).sum()
+    assert numpy.isnan(d[:,c['MSW1']]).any()
+    assert (d[:,c['MSP1']] < -70).all() and (d[:,c['MDP1']] >= -200).all()
+    assert '%%TableRows: %d' % d.shape[0] in header and footer.strip().endswith('%End:')
+    # the qc runs on it
+    ofn = do_qc(datadir, os.path.basename(fns[1]), 'IdealPattern',
+                catalog=build_catalog(datadir, 'IdealPattern'))
+    assert read_lluv_file(ofn)[0].shape[0] > 0
+
+def test_synthetic_deterministic_and_empty(tmpdir):
+    dir1, dir2 = str(tmpdir.mkdir('dir1')), str(tmpdir.mkdir('dir2'))
+    fns1 = write_synthetic(dir1, numfiles=4, seed=7, range_cells=5, doppler_cells=20, empty=0.5)
+    fns2 = write_synthetic(dir2, numfiles=4, seed=7, range_cells=5, doppler_cells=20, empty=0.5)
+    for fn1, fn2 in zip(fns1, fns2):
+        assert open(fn1).read() == open(fn2).read()
+    sizes = [read_lluv_file(fn)[0].size for fn in fns1]
+    assert 0 in sizes and max(sizes) > 0
+    fns3 = write_synthetic(dir2, numfiles=1, seed=8, range_cells=5, doppler_cells=20)
+    assert open(fns3[0]).read() != open(fns1[0]).read()
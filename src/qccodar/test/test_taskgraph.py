@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+#
+"""
+Tests for the task-graph manual-mode executor.
+
+"""
+import time
+from qccodar.taskgraph import TaskGraph
+
+def test_task_graph_runs_once_and_frees():
+    calls = []
+    def read(name):
+        def func():
+            calls.append(name)
+            return name
+        return func
+    def use(*args):
+        calls.append(args)
+        time.sleep(0.05)
+        return len(args)
+    graph = TaskGraph()
+    for i in range(6):
+        graph.add('read %d' % i, read(i), priority=2, buffered=True)
+    for i in range(1, 5):
+        graph.add('qc %d' % i, use, ['read %d' % j for j in [i-1, i, i+1]], priority=1)
+    graph.add('merge 4', use, ['qc %d' % i for i in range(1, 5)], priority=0)
+    outputs = graph.run(workers=2, max_buffered=3)
+    assert outputs == {'merge 4' : 4}
+    assert sorted(c for c in calls if not isinstance(c, tuple)) == range(6)
+    assert (1, 2, 3) in calls
+    path = graph.critical_path()
+    assert path[-1].name == 'merge 4' and path[0].name.startswith('read')
@@ -50,6 +50,8 @@ def test_write_output_by_readback():
     assert header == header2
     assert footer == footer2
     assert numpy.isclose(d, d2, equal_nan=True).all(), 'should be equal, including where NaN'
+    # written by rename of temporary file
+    assert not [fn for fn in os.listdir(files) if fn.startswith('test_output.txt.part')]
 
     # Asserting that the data arrays are equal, raised an interesting 
     # issue about NaN's.  It turns out where they are not equal is 